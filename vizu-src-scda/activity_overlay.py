@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#Population activity overlay: per-type raster & per-group rate trace of the frames around the current one
+#--------------------------------------------------------------------------
+#
+# the spikes per frame & type (frames x types) are counted once in prepare.py (TypeHistograms) and stored
+# with the prepared data (type_activity.npy) - no frame ever looks at a neuron list for the overlay.
+#
+# ACTIVITY_OVERLAY = True in config.py: every frame gets an image of the last ACTIVITY_WINDOW frames (the current frame is the right edge)
+#   top:    raster - a row per neuron type in its color, brightness = spikes per neuron of the type (scaled to its highest frame)
+#   bottom: rate trace - a line per neuron group in the color of its middle type, spikes per neuron (one scale for all groups)
+# rates are normalized for all frames once, background & color swatches are drawn once - a frame is
+# a slice of the normalized arrays and a few array writes.
+#   png:      render-frames/overlay_####.png next to render_####.png (ffmpeg overlays it, see README)
+#   segments: drawn into the frame before it goes to ffmpeg, at ACTIVITY_OVERLAY_POSITION
+
+from os import replace
+
+import numpy as np
+
+import splat_renderer
+import frame_manifest
+
+
+ACTIVITY_CHUNK = 10000000   #spikes counted at once - memory of TypeHistograms does not grow with the spike count
+BACKGROUND = (16, 16, 16)
+SEPARATOR = (64, 64, 64)
+SWATCH_WIDTH = 6            #pixels of the type color swatches left of the raster
+MARGIN = 2
+
+#==============================================================================
+
+#returns (frames, typeCount) uint32 number of spikes of each type in each frame - one pass over the frame index
+def TypeHistograms(frameIndex, typeCodes, typeCount, chunkSpikes=ACTIVITY_CHUNK):
+    frames = len(frameIndex)
+    counts = np.zeros((frames, typeCount), dtype=np.uint32)
+    offsets = np.asarray(frameIndex.offsets)
+    typeCodes = np.asarray(typeCodes)
+    for start in range(int(offsets[0]), int(offsets[-1]), chunkSpikes):
+        end = min(start + chunkSpikes, int(offsets[-1]))
+        spikeFrames = np.searchsorted(offsets, np.arange(start, end), side='right') - 1
+        spikeTypes = typeCodes[frameIndex.GetNeurons(start, end)].astype(np.int64)
+        (first, last) = (int(spikeFrames[0]), int(spikeFrames[-1]))
+        chunkCounts = np.bincount((spikeFrames - first) * typeCount + spikeTypes, minlength=(last - first + 1) * typeCount)
+        counts[first:last + 1] += chunkCounts.reshape(-1, typeCount).astype(np.uint32)
+    return counts
+
+
+#returns x, y of 'x:y' (same format as LEGEND_OVERLAY)
+def ParsePosition(position):
+    (x, y) = position.split(':')
+    return int(x), int(y)
+
+#==============================================================================
+
+class ActivityOverlay():
+    def __init__(self, typeActivity, neuronGroups, window, width, height):
+        self.window = max(int(window), 1)
+        self.width = int(width)
+        self.height = int(height)
+        neuronTypes = [neuronType for neuronGroup in neuronGroups for neuronType in neuronGroup.neuronTypes]
+        typeCount = len(neuronTypes)
+        counts = np.asarray(typeActivity, dtype=np.float32)
+        typeSizes = np.ones(typeCount, dtype=np.float32)
+        typeColors = np.zeros((typeCount, 3), dtype=np.float32)
+        for neuronType in neuronTypes:
+            typeSizes[neuronType.code] = max(neuronType.end - neuronType.start, 1)
+            typeColors[neuronType.code] = neuronType.color
+
+        #spikes per neuron, each type scaled to its highest frame (raster) - groups on one scale (trace)
+        rates = counts / typeSizes
+        self.raster = rates / np.maximum(rates.max(axis=0), 1e-12)
+        groupRates = np.zeros((len(counts), len(neuronGroups)), dtype=np.float32)
+        self.groupColors = np.zeros((len(neuronGroups), 3), dtype=np.uint8)
+        for g, neuronGroup in enumerate(neuronGroups):
+            codes = [neuronType.code for neuronType in neuronGroup.neuronTypes]
+            groupRates[:, g] = counts[:, codes].sum(axis=1) / typeSizes[codes].sum()
+            self.groupColors[g] = np.asarray(neuronGroup.neuronTypes[len(codes) // 2].color) * 255
+        self.trace = groupRates / max(float(groupRates.max()), 1e-12)
+
+        #layout: raster on top, trace below, columns of the plot -> frames of the window (+ current frame)
+        self.plotLeft = SWATCH_WIDTH + 2 * MARGIN
+        plotWidth = max(self.width - self.plotLeft - MARGIN, 1)
+        self.rasterTop = MARGIN
+        self.rasterHeight = max((self.height - 3 * MARGIN) // 2, 1)
+        self.traceTop = self.rasterTop + self.rasterHeight + MARGIN
+        self.traceHeight = max(self.height - self.traceTop - MARGIN, 1)
+        self.columnFrames = (np.arange(plotWidth) * self.window) // plotWidth - (self.window - 1)
+        self.rowTypes = (np.arange(self.rasterHeight) * typeCount) // self.rasterHeight
+        self.rowColors = typeColors[self.rowTypes] * 255
+        self.traceRows = np.arange(self.traceHeight)[:, None]
+
+        #static part - background, separator, swatches
+        self.background = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        self.background[:, :, 0:3] = BACKGROUND
+        self.background[:, :, 3] = 255
+        self.background[self.traceTop - 1, :, 0:3] = SEPARATOR
+        self.background[self.rasterTop:self.rasterTop + self.rasterHeight, MARGIN:MARGIN + SWATCH_WIDTH, 0:3] = self.rowColors[:, None, :].astype(np.uint8)
+        for g in range(len(neuronGroups)):
+            self.background[self.traceTop + g * 3:self.traceTop + g * 3 + 2, MARGIN:MARGIN + SWATCH_WIDTH, 0:3] = self.groupColors[g]
+
+    def __repr__(self):
+        return 'ActivityOverlay ' + str(self.width) + 'x' + str(self.height) + ', ' + str(self.window) + ' frames window'
+
+    #returns 8 bit RGBA (height, width, 4) overlay of frame nFrame
+    def RenderFrame(self, nFrame):
+        rgba = self.background.copy()
+        frames = self.columnFrames + int(nFrame)
+        valid = frames >= 0                                 # before the first frame: background
+        columns = np.flatnonzero(valid) + self.plotLeft
+        frames = frames[valid]
+
+        raster = self.raster[frames][:, self.rowTypes].T                      # (rows, columns)
+        rgba[self.rasterTop:self.rasterTop + self.rasterHeight, columns, 0:3] = (raster[:, :, None] * self.rowColors[:, None, :]).astype(np.uint8)
+
+        #each group a line: a column is filled from the value of the column before to its own value
+        y = ((1.0 - self.trace[frames]) * (self.traceHeight - 1) + 0.5).astype(np.int64)   # (columns, groups)
+        previous = np.vstack((y[:1], y[:-1]))
+        (low, high) = (np.minimum(y, previous), np.maximum(y, previous))
+        plot = rgba[self.traceTop:self.traceTop + self.traceHeight, columns, 0:3]
+        for g in range(y.shape[1]):
+            line = (self.traceRows >= low[:, g]) & (self.traceRows <= high[:, g])
+            plot[line] = self.groupColors[g]
+        rgba[self.traceTop:self.traceTop + self.traceHeight, columns, 0:3] = plot
+        return rgba
+
+    #png of frame nFrame - written to a temporary file and renamed, like the frames
+    def Write(self, nFrame, outputFile):
+        tmpFile = frame_manifest.GetTempFile(outputFile)
+        splat_renderer.WritePNG(tmpFile, self.RenderFrame(nFrame))
+        replace(tmpFile, outputFile)
+
+    #draws the overlay of frame nFrame into the frame rgba at x, y (parts outside of the frame are cut)
+    def Composite(self, rgba, nFrame, x, y):
+        overlay = self.RenderFrame(nFrame)
+        height = max(min(self.height, rgba.shape[0] - y), 0)
+        width = max(min(self.width, rgba.shape[1] - x), 0)
+        rgba[y:y + height, x:x + width] = overlay[:height, :width]
+        return rgba
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#Scaling benchmark: every pipeline phase timed on synthetic datasets of growing size
+#--------------------------------------------------------------------------
+#
+#   python3 benchmark.py ../bench                          (sizes below)
+#   python3 benchmark.py ../bench 100000 1000000 10000000
+#
+# for every size a dataset is generated once (synthetic_data.py) into <bench dir>/synthetic-<size>,
+# then timed (seconds):
+#   parse        text files -> binary cache (neuron_cache.WriteCache)
+#   load         open the cache, memory-mapped
+#   frameIndex   per-frame spike offsets (prepare.BuildFrameIndex)
+#   update       FrameBuffers.Update of one frame, mean over FRAMES frames
+#   afterglow    Afterglow.Advance + UpdateGlowing of one frame, mean
+#   bufferCopy   numpy copy of the pixel & size buffers of one frame, mean - memory bandwidth of the data a frame hands
+#                over, not the upload to blender (foreach_set / image.pixels run only inside blender, not timed here)
+#   lod          voxel LOD at LOD_BUDGET
+#   render       SplatRenderer.RenderFrame (numpy backend) of one frame, mean
+# results: <bench dir>/benchmark-<date>.json - compare files of two versions to see regressions.
+
+import sys
+import json
+import time
+import platform
+from os import path
+
+import numpy as np
+
+import neuron_cache
+import prepare
+import frame_buffer
+import splat_renderer
+import lod
+import synthetic_data
+
+
+SIZES = [100000, 1000000]
+FRAMES = 20             #frames timed per phase
+LOD_BUDGET = 100000
+RESOLUTION = (1920, 1080)
+
+#==============================================================================
+
+#config of the benchmark - the values of config.py that matter here, fixed so results compare
+class BenchConfig():
+    FRAME_BIN_WIDTH = 0
+    FRAME_TIME_START = None
+    FRAME_TIME_END = None
+    BASE_ALPHA = 0.05
+    SPIKE_ALPHA = 1
+    SIZE = 0.05
+    SIZE_SPIKE = 0.7
+    EMISSION = 20
+    AFTERGLOW_DECAY = 3.0
+    AFTERGLOW_MIN_ALPHA = 0.1
+
+
+#returns seconds of calling function (mean over repeat calls) and the result of the last call
+def timed(function, repeat=1):
+    start = time.time()
+    for i in range(repeat):
+        result = function()
+    return (time.time() - start) / repeat, result
+
+
+#frames spread over the whole time range
+def sampleFrames(frameIndex):
+    return np.linspace(0, len(frameIndex) - 1, min(FRAMES, len(frameIndex))).astype(np.int64)
+
+#==============================================================================
+
+def BenchmarkSize(benchDir, neuronCount):
+    cfg = BenchConfig
+    dataPath = path.join(benchDir, 'synthetic-' + str(neuronCount))
+    if not path.isdir(dataPath):
+        print('generating', dataPath)
+        synthetic_data.GenerateDataset(dataPath, neuronCount)
+    cacheDir = neuron_cache.DefaultCacheDir(dataPath)
+    phases = {}
+
+    phases['parse'], dummy = timed(lambda: neuron_cache.WriteCache(dataPath, cacheDir))
+    phases['load'], store = timed(lambda: neuron_cache.NeuronStore(cacheDir))
+    phases['frameIndex'], frameIndex = timed(lambda: prepare.BuildFrameIndex(store, cfg))
+    frames = sampleFrames(frameIndex)
+    typeColors = prepare.TypeColors(store.types)
+
+    frameBuffers = frame_buffer.FrameBuffers(typeColors, store.typeCodes, cfg.BASE_ALPHA, cfg.SPIKE_ALPHA, cfg.SIZE, cfg.SIZE_SPIKE)
+    start = time.time()
+    for nFrame in frames:
+        frameBuffers.Update(frameIndex.GetSpiking(nFrame))
+    phases['update'] = (time.time() - start) / len(frames)
+
+    afterglow = frame_buffer.Afterglow(frameIndex, len(store.ids), cfg.AFTERGLOW_DECAY, cfg.BASE_ALPHA, cfg.SPIKE_ALPHA, cfg.AFTERGLOW_MIN_ALPHA)
+    start = time.time()
+    for nFrame in frames:
+        rows, factors = afterglow.Advance(nFrame)
+        frameBuffers.UpdateGlowing(rows, factors)
+    phases['afterglow'] = (time.time() - start) / len(frames)
+
+    imagePixels = np.empty(len(store.ids) * 4, dtype=np.float32)
+    particleSizes = np.empty(len(store.ids), dtype=np.float32)
+    def bufferCopy():
+        imagePixels[:] = frameBuffers.GetFlatPixels()
+        particleSizes[:] = frameBuffers.sizes
+    phases['bufferCopy'], dummy = timed(bufferCopy, len(frames))
+
+    phases['lod'], voxelLOD = timed(lambda: lod.BuildVoxelLOD(store.positions, typeColors, store.typeCodes, LOD_BUDGET))
+
+    camera = splat_renderer.Camera((0.5, -4.0, 2.0), (1.2, 0.0, 0.0))
+    renderer = splat_renderer.SplatRenderer(camera, RESOLUTION, 100, cfg.EMISSION, 0.01)
+    renderer.CreateNeurons(store.positions, cfg.SIZE, cfg.EMISSION)
+    start = time.time()
+    for nFrame in frames:
+        frameBuffers.Update(frameIndex.GetSpiking(nFrame))
+        renderer.UpdateFrame(nFrame, frameBuffers)
+        renderer.RenderFrame()
+    phases['render'] = (time.time() - start) / len(frames)
+
+    return {'neurons': len(store.ids), 'spikes': len(store.spikeTimes), 'frames': len(frameIndex),
+            'voxels': len(voxelLOD), 'phases': phases}
+
+#==============================================================================
+
+if __name__ == '__main__':
+    benchDir = sys.argv[1]
+    sizes = [int(size) for size in sys.argv[2:]] or SIZES
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'sizes': []}
+    for neuronCount in sizes:
+        result = BenchmarkSize(benchDir, neuronCount)
+        print(neuronCount, json.dumps(result['phases'], sort_keys=True))
+        results['sizes'].append(result)
+    resultFile = path.join(benchDir, 'benchmark-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(resultFile, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print(resultFile)
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+#Blender (Cycles) render backend: neurons are particles of one vertex mesh, colors & spikes are a texture
+#--------------------------------------------------------------------------
+#
+# only imported when config.RENDER_BACKEND == "blender" - needs blender's python (bpy)
+
+import bpy  #for blender's python api
+
+import hashlib
+from os import path, replace, makedirs, getpid
+import numpy as np
+
+import splat_renderer   #LinearToSRGB
+import texture_atlas
+import metrics
+
+
+SCENE_CACHE_DIR = 'scene-cache'
+
+
+#==============================================================================
+
+def GetColorKey(neuronGroup, neuronType):
+    return neuronGroup.name +'-' + neuronType.name
+
+#==============================================================================
+
+#returns material
+def CreateMaterial(name, color):
+    scene_legend = bpy.data.scenes["flat"]
+    plane = scene_legend.objects['Plane']
+    matSRC = plane.active_material
+    mat = matSRC.copy()
+    mat.node_tree.nodes["Emission"].inputs[0].default_value = (color[0], color[1], color[2], 1)
+    mat.name = name
+    return mat
+
+#==============================================================================
+#---------update and render the legend in scene 'flat'----------------------------------------
+def CreateLegendItem(scn, oText, oPlane, name, material, pos):
+    oTextNew = oText.copy()                             # copy base object
+    oTextNew.data = oText.data.copy();
+    oTextNew.data.body = name
+    before = oTextNew.location
+    oTextNew.location = (before[0] + pos[0], before[1] + pos[1], before[2] + pos[2]) # set the position, parameter pos
+    oTextNew.hide_render=False
+    scn.objects.link(oTextNew)                          # link this object to the scene
+
+    oPlaneNew = oPlane.copy()
+    oPlaneNew.data = oPlane.data;
+    before = oPlaneNew.location
+    oPlaneNew.location = (before[0] + pos[0], before[1] + pos[1], before[2] + pos[2]) # set the position, parameter pos
+    oPlaneNew.hide_render=False
+    oPlaneNew.material_slots[0].material = material     # update material
+    oPlaneNew.active_material
+    scn.objects.link(oPlaneNew)
+    return oTextNew, oPlaneNew
+
+#==============================================================================
+
+#returns created object, dupli - is an object to be cloned if non None. -
+#for the performance we use the same mesh data of this dupli object (DUPLI_MESH)
+
+
+#------------------------------------------------------------------------------
+def CreateNeuralNetwork(positions, totalFrames):
+    bpy.context.screen.scene = bpy.data.scenes["Scene"]
+    obj = bpy.data.objects.new("NeuralNetwork", bpy.data.meshes.new("mesh"))  # add a new object using the mesh
+    scene = bpy.context.scene
+    scene.objects.link(obj)             # put the object into the scene (link)
+    mesh = obj.data
+    #create verticies for this mesh - one vertex per neuron, coordinates set in one call
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(positions, dtype=np.float32).ravel())
+    mesh.update()
+    #neuron view object
+    renderObject = scene.objects['neuron-render']
+    neuralMaterial = renderObject.material_slots[0].material
+    obj.data.materials.append(neuralMaterial)
+    obj.material_slots[0].link = 'OBJECT'
+
+    return obj, neuralMaterial
+
+#==============================================================================
+
+def CreateParticlesForFrame(nFrame, obj, positions, totalFrames, size):
+    obj.modifiers.clear()
+
+    scene = bpy.context.scene
+    renderObject = scene.objects['neuron-render']
+    #add particle system, set number of points to be exact as number of vertices (neurons)
+    obj.modifiers.new("particles", type='PARTICLE_SYSTEM')
+
+    #particle system:
+    particleSystem = obj.particle_systems[0]
+    settings = particleSystem.settings
+
+    settings.emit_from = 'VERT'
+    settings.use_emit_random = True #  True or False - doesnt matter - we set location every frame anyway.
+    settings.physics_type = 'NEWTON' #'NO' #'NEWTON'   FLUID  #IMPORTANT! neded this to activate caching otherwise we cannot set particles position/size
+    settings.particle_size = size
+    settings.render_type = 'OBJECT'
+    settings.dupli_object = renderObject
+    settings.show_unborn = False
+    settings.use_dead = True
+    settings.count = len(positions)
+    settings.frame_start = -1 #totalFrames - resets to 200???
+    settings.frame_end = -1 #totalFrames
+    settings.lifetime = 1
+    settings.draw_percentage = 1 # 1% - to draw
+    settings.normal_factor = 0
+    settings.mass = 0
+
+    #to use cache - file mustbe saved first!
+    #bpy.ops.wm.save_as_mainfile(filepath="_debug_node_" + str(nodeIndex) + ".blend")
+    particleSystem.point_cache.use_disk_cache = False
+    particleSystem.point_cache.use_library_path = False
+
+    bpy.context.scene.frame_current = -1
+    scene.update()                      #IMPORTANT! this will spawn and update particles
+
+    #position particles - clear particle cache
+    particleSystem.seed+=1
+    particleSystem.seed-=1
+
+    particles = particleSystem.particles
+    neuronLocations = np.ascontiguousarray(positions, dtype=np.float32).ravel()
+    particles.foreach_set("location", neuronLocations)
+
+    scene.update()                      #IMPORTANT! this will spawn and update particles
+
+    return particleSystem, neuronLocations
+
+#==============================================================================
+
+#returns math node 'name' of the material (created if missing): operation of input 0 & input 1
+def GetMathNode(tree, name, operation, location):
+    node = tree.nodes.get(name) or tree.nodes.new('ShaderNodeMath')
+    node.name = name
+    node.label = name
+    node.operation = operation
+    node.location = location
+    return node
+
+
+#texture lookup of the atlas layout: u = (index % width + 0.5) / width, v = (index - index % width + width/2) / (width * height)
+#particle index -> column, row -> texel center, all exact in float32 for power of two sizes (see texture_atlas.py)
+def SetupAtlasNodes(material, layout):
+    tree = material.node_tree
+    links = tree.links
+    imageNode = tree.nodes["Image Texture"]
+    (x, y) = (imageNode.location[0] - 800, imageNode.location[1])
+    info = tree.nodes.get('Particle Info') or tree.nodes.new('ShaderNodeParticleInfo')
+    index = info.outputs['Index']
+
+    column = GetMathNode(tree, 'AtlasColumn', 'MODULO', (x + 200, y))
+    links.new(index, column.inputs[0])
+    column.inputs[1].default_value = layout.width
+    u = GetMathNode(tree, 'AtlasU', 'ADD', (x + 400, y))
+    links.new(column.outputs[0], u.inputs[0])
+    u.inputs[1].default_value = 0.5
+    uScale = GetMathNode(tree, 'AtlasUScale', 'DIVIDE', (x + 600, y))
+    links.new(u.outputs[0], uScale.inputs[0])
+    uScale.inputs[1].default_value = layout.width
+
+    rowStart = GetMathNode(tree, 'AtlasRowStart', 'SUBTRACT', (x + 200, y - 200))
+    links.new(index, rowStart.inputs[0])
+    links.new(column.outputs[0], rowStart.inputs[1])
+    v = GetMathNode(tree, 'AtlasV', 'ADD', (x + 400, y - 200))
+    links.new(rowStart.outputs[0], v.inputs[0])
+    v.inputs[1].default_value = layout.width * 0.5
+    vScale = GetMathNode(tree, 'AtlasVScale', 'DIVIDE', (x + 600, y - 200))
+    links.new(v.outputs[0], vScale.inputs[0])
+    vScale.inputs[1].default_value = layout.width * layout.height
+
+    uv = tree.nodes.get('AtlasUV') or tree.nodes.new('ShaderNodeCombineXYZ')
+    uv.name = 'AtlasUV'
+    uv.location = (x + 700, y - 100)
+    links.new(uScale.outputs[0], uv.inputs[0])
+    links.new(vScale.outputs[0], uv.inputs[1])
+    uv.inputs[2].default_value = 0.0
+    links.new(uv.outputs[0], imageNode.inputs['Vector'])    #replaces the 1D lookup (node 'Math')
+    imageNode.interpolation = 'Closest'
+
+#==============================================================================
+
+#returns path of the cached positions scene: <outputDir>/scene-cache/positions-<key>.blend,
+#key is the hash of the data signature and of the files the scene is built from (config.py, start scene)
+def GetSceneCacheFile(outputDir, dataSignature, files):
+    h = hashlib.sha1(dataSignature.encode('utf-8'))
+    for filePath in files:
+        with open(filePath, 'rb') as f:
+            h.update(f.read())
+    return path.join(outputDir, SCENE_CACHE_DIR, 'positions-' + h.hexdigest()[:16] + '.blend')
+
+#==============================================================================
+
+class BlenderRenderer():
+    def __init__(self, totalFrames, resolutionScale, atlasTileRows=0):
+        self.totalFrames = totalFrames
+        self.resolutionScale = resolutionScale
+        self.atlasTileRows = atlasTileRows       #0: one texture row of all neurons, no atlas
+        self.atlas = None
+        self.materials = {}
+        self.legendObjects = []
+        self.baseCamera = None
+        self.viewerReady = False
+
+    #returns atlas layout of count neurons, None without atlas
+    def getAtlas(self, count):
+        if self.atlasTileRows > 0:
+            return texture_atlas.AtlasLayout(count, self.atlasTileRows)
+        return None
+
+    #opens the start scene
+    def OpenScene(self, baseSceneFile):
+        #open the default start up file.  (overwrite for parametrical input)
+        bpy.ops.wm.open_mainfile(filepath=baseSceneFile)
+        self.viewerReady = False
+
+        #IMPORTANT set the last frame in the scene now - need it for particles!
+        #particles start is latest canbe
+        scene = bpy.context.scene
+        scene.frame_start = -1
+        scene.frame_end = self.totalFrames
+        self.baseCamera = self.getCamera()
+
+    #frames of the next dataset (batch mode) - particles need the last frame in the scene
+    def SetTotalFrames(self, totalFrames):
+        self.totalFrames = totalFrames
+        bpy.context.scene.frame_end = totalFrames
+
+    def getCamera(self):
+        camera = bpy.context.scene.camera
+        return (tuple(camera.location), tuple(camera.rotation_euler), camera.data.type, camera.data.ortho_scale,
+                camera.data.lens, camera.data.sensor_width)
+
+    #moves the scene camera: location, euler XYZ rotation (radians), 'ORTHO' or 'PERSP' ... - None: back to the start scene camera
+    def SetCamera(self, location=None, rotation=None, cameraType=None, orthoScale=None, lens=None, sensorWidth=None):
+        if location is None and self.baseCamera is not None:
+            (location, rotation, cameraType, orthoScale, lens, sensorWidth) = self.baseCamera
+        camera = bpy.context.scene.camera
+        camera.location = location
+        camera.rotation_mode = 'XYZ'
+        camera.rotation_euler = rotation
+        camera.data.type = cameraType
+        camera.data.ortho_scale = orthoScale
+        camera.data.lens = lens
+        camera.data.sensor_width = sensorWidth
+
+    #opens a scene saved by SaveScene - mesh, particles, texture, materials & legend are there already
+    def OpenCachedScene(self, sceneFile, neuronGroups, positions):
+        bpy.ops.wm.open_mainfile(filepath=sceneFile)
+        self.viewerReady = False
+        bpy.context.screen.scene = bpy.data.scenes["Scene"]
+        scene = bpy.context.scene
+        for neuronGroup in neuronGroups:
+            for neuronType in neuronGroup.neuronTypes:
+                key = GetColorKey(neuronGroup, neuronType)
+                self.materials[key] = bpy.data.materials[key]
+
+        self.neuralObject = bpy.data.objects['NeuralNetwork']
+        self.neuralMaterial = self.neuralObject.material_slots[0].material
+        self.particleSystem = self.neuralObject.particle_systems[0]
+        self.imageColors = bpy.data.images['NeuronsColors']
+        self.atlas = self.getAtlas(len(positions))
+        self.neuronLocations = np.ascontiguousarray(positions, dtype=np.float32).ravel()
+
+        bpy.context.scene.frame_current = -1
+        scene.update()                      #IMPORTANT! this will spawn and update particles
+
+    #saves the scene with the neurons laid out, other tasks open it with OpenCachedScene
+    def SaveScene(self, sceneFile):
+        sceneDir = path.dirname(sceneFile)
+        if not path.isdir(sceneDir):
+            try:
+                makedirs(sceneDir)
+            except OSError:
+                pass
+        tmpFile = sceneFile[:-len('.blend')] + '.tmp-' + str(getpid()) + '.blend'
+        bpy.ops.wm.save_as_mainfile(filepath = tmpFile, copy = True)
+        replace(tmpFile, sceneFile)             # other tasks never see a half written file
+
+    #------ CREATE MATERIALS for all groups all types (colors are set on the types) ---------
+    #materials made for an earlier dataset (batch mode) are kept, only their color is set
+    def CreateMaterials(self, neuronGroups):
+        for neuronGroup in neuronGroups:
+            for neuronType in neuronGroup.neuronTypes:
+                key = GetColorKey(neuronGroup, neuronType)
+                if key in self.materials:
+                    color = neuronType.color
+                    self.materials[key].node_tree.nodes["Emission"].inputs[0].default_value = (color[0], color[1], color[2], 1)
+                else:
+                    self.materials[key] = CreateMaterial(key, neuronType.color)
+
+    #draw legend into scene 'flat'
+    def CreateLegend(self, neuronGroups):
+        scene_legend = bpy.data.scenes["flat"]
+        textBase = scene_legend.objects['Text']
+        textBase.hide_render=True
+        plane = scene_legend.objects['Plane']
+        plane.hide_render=True
+
+        offsetX = 0
+        offsetY = 0
+        for neuronGroup in neuronGroups:
+            #group title - with the color of its first type
+            key = GetColorKey(neuronGroup, neuronGroup.neuronTypes[0])
+            self.legendObjects.extend(CreateLegendItem(scene_legend, textBase, plane, neuronGroup.name, self.materials[key], (offsetX, offsetY, 0)))
+            offsetX = 0
+            offsetY -= 1
+            for neuronType in neuronGroup.neuronTypes:
+                key = GetColorKey(neuronGroup, neuronType)
+                self.legendObjects.extend(CreateLegendItem(scene_legend, textBase, plane, neuronType.name, self.materials[key], (offsetX, offsetY, 0)))
+                offsetX = 1
+                offsetY -= 1
+
+    #removes the legend items of CreateLegend (batch mode: the next dataset has other groups)
+    def ClearLegend(self):
+        for obj in self.legendObjects:
+            data = obj.data if obj.type == 'FONT' else None        # text copies have their own curve, planes share the mesh
+            bpy.data.objects.remove(obj, do_unlink=True)
+            if data is not None:
+                bpy.data.curves.remove(data)
+        self.legendObjects = []
+
+    #--------- RENDER LEGEND---------------------------------ENDER------------------------
+    #render the legend to outputFile (we do it once , we need just one frame for it) & save as legendBlendFile
+    def RenderLegend(self, outputFile, legendBlendFile):
+        scene_legend = bpy.data.scenes["flat"]
+        #render legend separately
+        sceneBefore = bpy.context.scene
+        bpy.context.screen.scene = scene_legend         # set the legend scene is a main scene
+        scene_legend.frame_set(1)                       # Sets scene frame to nFrame.
+        scene_legend.update()
+
+        scene_legend.render.filepath = outputFile       # update render output path
+        bpy.ops.render.render( write_still=True )
+        bpy.context.screen.scene = sceneBefore          # set the base scene as default
+
+        #Save the blend file for debugging:
+        bpy.ops.wm.save_as_mainfile(filepath = legendBlendFile, copy = True)
+
+    #create vertices & particle system to visualize the neurons, texture with neuron colors & alpha
+    def CreateNeurons(self, positions, size, emission):
+        self.neuralObject, self.neuralMaterial = CreateNeuralNetwork(positions, self.totalFrames)
+        self.particleSystem, self.neuronLocations = CreateParticlesForFrame(0, self.neuralObject, positions, self.totalFrames, size = size)
+
+        self.neuralMaterial.node_tree.nodes["Math"].inputs[1].default_value = len(positions) - 1
+        self.neuralMaterial.node_tree.nodes['Emission'].inputs[1].default_value = emission
+
+        #neuron colors & alpha - spikes are encoded into texture, index based -- create texture, total pixels >= number of neurons
+        # bpy.ops.image.new(name="untitled", width=1024, height=1024, color=(0.0, 0.0, 0.0, 1.0), alpha=True, uv_test_grid=False, float=False)
+        self.atlas = self.getAtlas(len(positions))
+        if self.atlas is not None:
+            self.imageColors = bpy.data.images.new(name='NeuronsColors', width=self.atlas.width, height=self.atlas.height, alpha=True)
+            SetupAtlasNodes(self.neuralMaterial, self.atlas)
+        else:
+            self.imageColors = bpy.data.images.new(name='NeuronsColors', width=len(positions), height=1, alpha=True)
+        ImageTextureNode = self.neuralMaterial.node_tree.nodes["Image Texture"]
+        ImageTextureNode.image = self.imageColors
+
+        # movie resolution
+        scene = bpy.context.scene
+        scene.render.resolution_percentage = self.resolutionScale #50 # 100 for 1920x1080
+
+    #removes mesh, particles & texture of CreateNeurons - scene, materials & render settings stay for the next dataset
+    def ClearNeurons(self):
+        mesh = self.neuralObject.data
+        settings = self.particleSystem.settings
+        bpy.data.objects.remove(self.neuralObject, do_unlink=True)
+        bpy.data.meshes.remove(mesh)
+        bpy.data.particles.remove(settings)
+        bpy.data.images.remove(self.imageColors)
+        (self.neuralObject, self.particleSystem, self.imageColors) = (None, None, None)
+
+    #frame dependent state besides the neurons (frame_dedup.py): values of all animation curves of the scene at the frame
+    #(animated camera, objects, world) - the same key, the same picture for the same neurons
+    def GetFrameStateKey(self, nFrame):
+        scene = bpy.context.scene
+        owners = [scene, scene.world]
+        for obj in sorted(scene.objects, key=lambda obj: obj.name):
+            owners += [obj, obj.data]
+        values = []
+        for owner in owners:
+            animation = getattr(owner, 'animation_data', None)
+            if animation is not None and animation.action is not None:
+                for fcurve in animation.action.fcurves:
+                    values.append(round(fcurve.evaluate(nFrame + 2), 6))   # frame_current of nFrame, see UpdateFrame
+        return repr(values)
+
+    #colors & sizes of this frame to the texture & particles
+    def UpdateFrame(self, nFrame, frameBuffers):
+        self.particleSystem.seed+=1
+        self.particleSystem.seed-=1
+
+        if frameBuffers.locations is not None:
+            self.neuronLocations = frameBuffers.locations.reshape(-1)      # LOD: spike slots moved
+        self.particleSystem.particles.foreach_set("location", self.neuronLocations)
+        frameBuffers.Upload(self.imageColors, self.particleSystem.particles, atlas=self.atlas)   # pixels rgba (dirty tiles) & particle sizes - particles are re-emitted (seed), their sizes always go whole
+
+        bpy.context.scene.frame_current = nFrame + 2 #IMPORTANT make sure we never render <= 1 frame, because frame 1 is broken for particles
+        with metrics.Phase('sceneUpdate', nFrame):
+            bpy.context.scene.update()
+
+    def Render(self, outputFile):
+        scene = bpy.context.scene
+        scene.render.filepath = outputFile                                  # update render output path
+        bpy.ops.render.render( write_still = True )
+
+    #the render result can't be read in python - a compositor 'Viewer' node gets a copy of it (image 'Viewer Node')
+    def setupViewer(self):
+        scene = bpy.context.scene
+        scene.use_nodes = True
+        scene.render.use_compositing = True
+        tree = scene.node_tree
+        layers = tree.nodes.get('Render Layers') or tree.nodes.new('CompositorNodeRLayers')
+        composite = tree.nodes.get('Composite') or tree.nodes.new('CompositorNodeComposite')
+        viewer = tree.nodes.get('Viewer') or tree.nodes.new('CompositorNodeViewer')
+        viewer.use_alpha = True
+        tree.links.new(layers.outputs['Image'], composite.inputs['Image'])
+        tree.links.new(layers.outputs['Image'], viewer.inputs['Image'])
+        self.viewerReady = True
+
+    #returns 8 bit RGBA frame (height, width, 4), top row first, without writing a file
+    def RenderFrame(self):
+        if not self.viewerReady:
+            self.setupViewer()
+        bpy.ops.render.render()
+        image = bpy.data.images['Viewer Node']
+        (width, height) = image.size
+        pixels = np.array(image.pixels[:], dtype=np.float32).reshape(height, width, 4)[::-1]   # blender: bottom row first
+        rgba = np.empty((height, width, 4), dtype=np.uint8)
+        rgba[:, :, 0:3] = (splat_renderer.LinearToSRGB(pixels[:, :, 0:3]) * 255 + 0.5).astype(np.uint8)   # view transform 'Default'
+        rgba[:, :, 3] = (np.clip(pixels[:, :, 3], 0.0, 1.0) * 255 + 0.5).astype(np.uint8)
+        return rgba
+
+    #for the first node - save the file for debug (it won's save the spikes - they are created per frame basis)
+    def SaveDebug(self, outputDir, blendFile):
+        self.imageColors.filepath_raw =  path.join(outputDir, "spikes-map-debug-only.bmp")
+        self.imageColors.file_format = 'BMP'
+        self.imageColors.save()
+        #Save the blend file for debugging:
+        bpy.ops.wm.save_as_mainfile( filepath = path.join(outputDir, blendFile))
@@ -12,14 +12,112 @@ SIZE = 0.05                 #0.05  size of the non spiked neuron
 
 SIZE_SPIKE = 0.7            #0.7  size of the spikes neuron
 
+AFTERGLOW = False           #if True: spiked neurons fade out over several frames (alpha & size) instead of a one frame flash
+
+AFTERGLOW_DECAY = 3.0       #decay constant in frames: alpha above BASE_ALPHA drops by 1/e every AFTERGLOW_DECAY frames
+
+AFTERGLOW_MIN_ALPHA = 0.1   #when the fading alpha drops below this value the neuron is back to BASE_ALPHA & SIZE
+
+DELTA_UPDATES = True        #if True: per frame only neurons that changed state are written & uploaded, nothing if no neuron changed
+
+LOD_BUDGET = 0              #if > 0: quiescent neurons are drawn as at most LOD_BUDGET voxel representatives (octree levels), spiking neurons one by one; 0: one particle per neuron
+
+TEXTURE_ATLAS_TILE_ROWS = 16    #blender: neuron colors in a 2D power of two texture, uploads per tile of this many texture rows; 0: one texture row of all neurons
+
 RESOLUTION_SCALE = 100      #100% is 1920x1080
 
+RENDER_BACKEND = "blender"  #"blender": blender/Cycles, "numpy": headless point splatting, no blender needed (run-script-v2.sh picks python)
+
 BASE_SCENE_FILE = "start-particles.blend"   # starting file - empty scene with camera (you can add camera animation - to circle around neurons, for example)
 
+#---- numpy backend: camera & scene like 'Camera' in start-particles.blend (update them when you change the camera there)
+CAMERA_LOCATION = (2.35222, -6.67341, 6.22914)
+
+CAMERA_ROTATION = (1.466345, 0.0, 0.247936)     #euler XYZ, radians
+
+CAMERA_TYPE = "ORTHO"       #"ORTHO" or "PERSP"
+
+CAMERA_ORTHO_SCALE = 7.0
+
+CAMERA_LENS = 35.0          #mm, for "PERSP"
+
+CAMERA_SENSOR_WIDTH = 32.0  #mm, for "PERSP"
+
+SPLAT_RESOLUTION = (1920, 1080)     #resolution at RESOLUTION_SCALE 100%
+
+SPLAT_OBJECT_RADIUS = 0.01  #half edge of the 'neuron-render' cube, scaled by SIZE/SIZE_SPIKE
+#----
+
 DRAW_LEGEND = False         #if True: legend saved as saparate *.png image file and added to *.blend file
 
 SKIP_RENDER = True          #if True: it skips render - saving file with positioned neurons to the OUT_POSITIONS_FILE
 
+CACHE_DIR = ""              #binary cache of the neuron data, empty: '<input data dir>-cache' next to the data (built once, rebuilt when the *.txt files change)
+
+CACHE_HASH_CHECK = True     #if True: data files with changed mtime are compared by content hash before the cache is rebuilt
+
+INGEST_PROCESSES = 0        #processes parsing the type files when the cache is built, 0: one per cpu, 1: no pool
+
+SPIKE_STREAMING = False     #if True: spike files are streamed in time order to build the frame index, the cache holds no spikes - memory independent of the spike count
+
+SPIKE_STREAM_CHUNK = 1000000    #spikes read at once when streaming (all spike files together)
+
+SPIKE_WINDOW = 0            #if > 0: render tasks hold the spikes of their frames in windows of SPIKE_WINDOW spikes (+ one read ahead) instead of memory-mapping them all
+
+SELECT_GROUPS = []          #render only these neuron groups (directory names, e.g. ["TH_M1", "M1"]), empty: all - flags --groups=... override (selection.py)
+
+SELECT_EXCLUDE_GROUPS = []  #neuron groups left out
+
+SELECT_TYPES = []           #render only these neuron types (file names without .txt), empty: all
+
+SELECT_EXCLUDE_TYPES = []   #neuron types left out
+
+SELECT_BOX = None           #((x0, y0, z0), (x1, y1, z1)): only neurons inside of this box, None: everywhere
+
+SELECT_ID_RANGE = None      #(first, last): only neurons with ids first..last (None in it: no limit), None: all ids
+
+FRAME_BIN_WIDTH = 0         #time per frame (units of the spike times, e.g. 0.1), 0: every distinct spike time is a frame
+
+FRAME_TIME_START = None     #first time rendered, None: first spike
+
+FRAME_TIME_END = None       #last time rendered, None: last spike
+
+SCHEDULE_FRAME_COST = 1.0   #scheduler cost model (seconds) of a frame - used until there are timings of a previous run to fit it
+
+SCHEDULE_SPIKE_COST = 0.0001    #scheduler cost model (seconds) per spiking (or glowing) neuron of a frame
+
+SCHEDULE_LINK_COST = 0.05   #scheduler cost (seconds) of a frame linked to an identical frame (DEDUP_FRAMES) - used until there are timings of linked frames
+
+SCHEDULE_CHUNKS_PER_TASK = 4    #scheduler: contiguous frame chunks per array task, more chunks balance better, fewer seek less (afterglow)
+
+OUTPUT_MODE = "png"          #"png": render-frames/render_####.png, "segments": frames piped into ffmpeg - one movie segment per chunk of frames, joined by segment_encoder.py
+
+FFMPEG_PATH = "ffmpeg"
+
+MOVIE_FRAMERATE = 30        #frames per second of the movie segments
+
+LEGEND_OVERLAY = "1600:0"   #x:y of the legend on the movie (segment_encoder.py)
+
+SCENE_CACHE = True          #if True (blender): the scene with neurons laid out is saved once per data & config.py & start scene, other tasks just open it
+
+DEDUP_FRAMES = True         #if True: a frame with the same neurons (& glow, camera) as an earlier frame is not rendered - its png is a hardlink of that frame (frame_dedup.py)
+
+DEDUP_KEEP_FRAMES = 8       #segments: frames kept in memory to be written again for their duplicates
+
+ACTIVITY_OVERLAY = False    #if True: every frame gets an activity overlay - raster of the neuron types & rate trace of the groups (activity_overlay.py)
+
+ACTIVITY_WINDOW = 300       #frames shown by the overlay, the current frame is the right edge
+
+ACTIVITY_OVERLAY_SIZE = (480, 270)      #overlay size at RESOLUTION_SCALE 100%
+
+ACTIVITY_OVERLAY_POSITION = "0:810"     #x:y of the overlay on the frame (segments: drawn in, png: render-frames/overlay_####.png for ffmpeg)
+
+PREVIEW_HOST = "127.0.0.1" #preview_server.py: address the browser connects to (local only by default)
+
+PREVIEW_PORT = 8765         #preview_server.py: port, http://PREVIEW_HOST:PREVIEW_PORT/
+
+PREVIEW_FPS = 30            #preview_server.py: highest frame rate a viewer can ask for
+
 OUT_LEGEND_FILE = "out_legend.blend"
 
 OUT_NEURONS_FILE = "out_neurons.blend"  
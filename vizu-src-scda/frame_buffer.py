@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#Per-frame color & size buffers of all neurons
+#--------------------------------------------------------------------------
+#
+# base RGBA (type color, BASE_ALPHA) and base size (SIZE) are computed once, in float32.
+# Every frame only the rows of the neurons spiking in the previous frame are restored
+# and the rows spiking now are overwritten - the buffers are never rebuilt.
+# pixels is contiguous (N,4), its flat view goes straight to image.pixels, sizes to particles.
+#
+# delta mode (DELTA_UPDATES): only the symmetric difference of the last & this frame spiking rows is written,
+# the rows written since the last Upload are kept in 'dirty'. Upload skips the image when nothing changed
+# and writes only the atlas tiles of the dirty rows (fullUpload: everything). particle sizes always go whole -
+# blender re-emits the particles every frame. a host reading the buffers itself (numpy backend) calls Consume.
+
+import numpy as np
+
+
+class FrameBuffers():
+    def __init__(self, typeColors, typeCodes, baseAlpha, spikeAlpha, size, sizeSpike, delta=False):
+        typeColors = np.asarray(typeColors, dtype=np.float32).reshape(-1, 3)
+        typeCodes = np.asarray(typeCodes)
+        count = len(typeCodes)
+        self.baseAlpha = baseAlpha
+        self.spikeAlpha = spikeAlpha
+        self.size = size
+        self.sizeSpike = sizeSpike
+
+        self.basePixels = np.empty((count, 4), dtype=np.float32)
+        self.basePixels[:, 0:3] = typeColors[typeCodes]
+        self.basePixels[:, 3] = baseAlpha
+        self.pixels = self.basePixels.copy()
+        self.sizes = np.full(count, size, dtype=np.float32)
+        self.changed = np.zeros(0, dtype=np.int32)   #rows overwritten by the last Update
+        self.locations = None                        #particles never move (lod.LODBuffers moves its spike slots)
+        self.delta = delta
+        self.dirty = np.zeros(0, dtype=np.int32)     #rows written since the last Upload (delta mode)
+        self.fullUpload = True                       #the host (image, particles) has none of the buffers yet
+
+    def __len__(self):
+        return len(self.sizes)
+
+    #restores rows of the previous frame, marks the spiking rows (NeuronTable rows of this frame)
+    def Update(self, spiking):
+        if self.delta:
+            restore = np.setdiff1d(self.changed, spiking)       # spiked before, not now
+            spikeNow = np.setdiff1d(spiking, self.changed)      # spiking now, not before - rows in both stay as they are
+            self.pixels[restore] = self.basePixels[restore]
+            self.sizes[restore] = self.size
+            self.pixels[spikeNow, 3] = self.spikeAlpha
+            self.sizes[spikeNow] = self.sizeSpike
+            self.changed = spiking
+            self.markDirty(restore, spikeNow)
+            return
+        self.Reset()
+        self.pixels[spiking, 3] = self.spikeAlpha
+        self.sizes[spiking] = self.sizeSpike
+        self.changed = spiking
+
+    #restores rows of the previous frame, glowing rows get alpha & size between base (factor 0) and spike (factor 1)
+    def UpdateGlowing(self, rows, factors):
+        if self.delta:
+            restore = np.setdiff1d(self.changed, rows)          # faded out - glowing rows are all rewritten, their factor changes
+            self.pixels[restore] = self.basePixels[restore]
+            self.sizes[restore] = self.size
+            self.markDirty(restore, rows)
+        else:
+            self.Reset()
+        self.pixels[rows, 3] = self.baseAlpha + (self.spikeAlpha - self.baseAlpha) * factors
+        self.sizes[rows] = self.size + (self.sizeSpike - self.size) * factors
+        self.changed = rows
+
+    #restores the rows changed by the last Update to the base color & size
+    def Reset(self):
+        changed = self.changed
+        self.pixels[changed] = self.basePixels[changed]
+        self.sizes[changed] = self.size
+        self.changed = np.zeros(0, dtype=np.int32)
+        if self.delta:
+            self.markDirty(changed)
+
+    def markDirty(self, *rows):
+        self.dirty = np.unique(np.concatenate((self.dirty,) + rows)).astype(np.int32)
+
+    #flat float32 view of the pixels, r,g,b,a per neuron
+    def GetFlatPixels(self):
+        return self.pixels.reshape(-1)
+
+    #the host has the current buffers - dirty rows start over
+    def Consume(self):
+        self.dirty = np.zeros(0, dtype=np.int32)
+        self.fullUpload = False
+
+    #hands the buffers to blender: image (pixels) and particles (size), no copies on our side.
+    #atlas (texture_atlas.AtlasLayout): only the tiles with dirty rows are written, else the image is written whole if anything changed
+    def Upload(self, image, particles, atlas=None):
+        full = self.fullUpload or not self.delta
+        ranges = atlas.GetTileRanges(self.dirty) if atlas is not None and not full else None
+        if ranges is not None:
+            SetImagePixelRanges(image, self.GetFlatPixels(), ranges)
+        elif full or len(self.dirty):
+            SetImagePixels(image, self.GetFlatPixels())
+        particles.foreach_set("size", self.sizes)
+        self.Consume()
+
+#==============================================================================
+
+#afterglow of spiked neurons: factor exp(-age/decay) for age = frames since the last spike,
+#the neuron is back to base when the alpha falls below minAlpha.
+#Only the active set (neurons spiked within the last 'length' frames) is kept and updated,
+#the state of any frame is exact from the frame index alone - spikes of the last 'length' frames.
+class Afterglow():
+    def __init__(self, frameIndex, count, decay, baseAlpha, spikeAlpha, minAlpha):
+        self.frameIndex = frameIndex
+        self.decay = float(decay)
+        minFactor = (minAlpha - baseAlpha) / float(spikeAlpha - baseAlpha) if spikeAlpha != baseAlpha else 1.0
+        minFactor = min(max(minFactor, 1e-3), 1.0)
+        self.length = int(np.floor(-self.decay * np.log(minFactor))) + 1   #frames a spike is visible, age 0..length-1
+        self.lastSpike = np.full(count, -1, dtype=np.int64)                 #-1 for all rows not in the active set
+        self.active = np.zeros(0, dtype=np.int32)
+        self.frame = None
+
+    #returns spiking rows of frames (fromFrame, toFrame] and the frame of each spike
+    def getSpikes(self, fromFrame, toFrame):
+        offsets = self.frameIndex.offsets
+        fromFrame = max(fromFrame, -1)
+        rows = self.frameIndex.GetNeurons(offsets[fromFrame + 1], offsets[toFrame + 1])
+        frames = np.repeat(np.arange(fromFrame + 1, toFrame + 1), np.diff(offsets[fromFrame + 1:toFrame + 2]))
+        return rows, frames
+
+    #rebuilds the active set for nFrame from the spikes of the last 'length' frames only
+    def Seek(self, nFrame):
+        rows, frames = self.getSpikes(nFrame - self.length, nFrame)
+        self.lastSpike[self.active] = -1
+        np.maximum.at(self.lastSpike, rows, frames)
+        self.active = np.unique(rows).astype(np.int32)
+        self.frame = nFrame
+
+    #moves to nFrame - incrementally if the last frame is close, returns glowing rows & their factors
+    def Advance(self, nFrame):
+        if self.frame is None or nFrame <= self.frame or nFrame - self.frame >= self.length:
+            self.Seek(nFrame)
+        else:
+            rows, frames = self.getSpikes(self.frame, nFrame)
+            np.maximum.at(self.lastSpike, rows, frames)     #frames are later than any active spike
+            self.active = np.union1d(self.active, rows).astype(np.int32)
+            self.frame = nFrame
+        ages = nFrame - self.lastSpike[self.active]
+        visible = ages < self.length
+        self.lastSpike[self.active[~visible]] = -1
+        self.active = self.active[visible]
+        return self.active, np.exp(-ages[visible] / self.decay).astype(np.float32)
+
+#==============================================================================
+
+#image.pixels.foreach_set is not in older blender (2.79) - there the slice assignment reads the buffer
+#flatPixels may be shorter than the image (atlas padding) - foreach_set takes the whole image only
+def SetImagePixels(image, flatPixels):
+    if hasattr(image.pixels, 'foreach_set') and len(image.pixels) == len(flatPixels):
+        image.pixels.foreach_set(flatPixels)
+    else:
+        image.pixels[:len(flatPixels)] = flatPixels
+
+
+#writes the pixels [(start, end)] ranges of flatPixels (4 floats a pixel) - one slice each
+def SetImagePixelRanges(image, flatPixels, ranges):
+    for (start, end) in ranges:
+        image.pixels[start * 4:end * 4] = flatPixels[start * 4:end * 4]
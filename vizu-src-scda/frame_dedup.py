@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#Frame signatures: frames that look the same are rendered once, the others are links to that frame
+#--------------------------------------------------------------------------
+#
+# DEDUP_FRAMES = True in config.py. signature of a frame = hash of
+#   the set of neurons spiking in it (sorted unique rows) - with AFTERGLOW the sets of the last 'length' frames
+#   (the glow of a frame is a function of them alone, see frame_buffer.Afterglow)
+#   the frame dependent scene state (renderer.GetFrameStateKey: animated camera & objects of the blender scene)
+# the first frame of a signature is its canonical frame, a later frame with the same signature is its duplicate.
+#
+# scheduler.py finds the duplicates of all frames (spikes only - it has no scene), gives them the cost of a link and
+# puts each into the task of its canonical frame; the task drops those whose scene state differs from their canonical frame.
+# a task renders the canonical frame, a duplicate is a hardlink (copy where links fail) of its png,
+# segments: the frame is written again from memory. renders avoided: 'dedup' in metrics.py (summary).
+
+import shutil
+import hashlib
+from os import link
+
+import numpy as np
+
+import frame_buffer
+
+
+EMPTY_FRAME = hashlib.sha1(b'').digest()
+
+#==============================================================================
+
+#returns per frame first..last the digest of its spiking set
+def SpikeHashes(frameIndex, first, last):
+    hashes = []
+    offsets = frameIndex.offsets
+    for nFrame in range(first, last + 1):
+        if offsets[nFrame] == offsets[nFrame + 1]:
+            hashes.append(EMPTY_FRAME)                  #most frames of sparse activity - no hashing
+            continue
+        rows = np.unique(np.asarray(frameIndex.GetSpiking(nFrame))).astype(np.int32)
+        hashes.append(hashlib.sha1(rows.tobytes()).digest())
+    return hashes
+
+
+#returns {duplicate frame: canonical frame} of frames (in frame order, canonical: first of a signature)
+#length: frames a spike is visible (1, or Afterglow.length), stateKey(nFrame): scene state of a frame or None
+def FindDuplicates(frameIndex, frames, length=1, stateKey=None):
+    frames = sorted(frames)
+    if len(frames) == 0:
+        return {}
+    first = max(frames[0] - length + 1, 0)
+    hashes = SpikeHashes(frameIndex, first, frames[-1])
+    canonical = {}
+    duplicates = {}
+    for nFrame in frames:
+        window = [EMPTY_FRAME] * max(length - 1 - nFrame, 0) + hashes[max(nFrame - length + 1, 0) - first:nFrame + 1 - first]
+        signature = hashlib.sha1(b''.join(window))
+        if stateKey is not None:
+            signature.update(stateKey(nFrame).encode('utf-8'))
+        signature = signature.digest()
+        if signature in canonical:
+            duplicates[nFrame] = canonical[signature]
+        else:
+            canonical[signature] = nFrame
+    return duplicates
+
+
+#frames a spike is visible with the config (afterglow) - the window of the signature
+def GetSignatureLength(frameIndex, cfg):
+    if not cfg.AFTERGLOW:
+        return 1
+    return frame_buffer.Afterglow(frameIndex, 0, cfg.AFTERGLOW_DECAY, cfg.BASE_ALPHA, cfg.SPIKE_ALPHA, cfg.AFTERGLOW_MIN_ALPHA).length
+
+#==============================================================================
+
+#fills outputFile (a temporary file, renamed into place by the manifest) with the png of the canonical frame
+def LinkFrame(canonicalFile, outputFile):
+    try:
+        link(canonicalFile, outputFile)
+    except OSError:
+        shutil.copyfile(canonicalFile, outputFile)     #file system without hardlinks
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#Frame index: which neurons spike in which frame, built once for the whole simulation
+#--------------------------------------------------------------------------
+#
+#   times     float64  time of each frame, sorted
+#   offsets   int64    len(times)+1, neurons spiking in frame f are
+#   neurons   int32    neurons[offsets[f]:offsets[f+1]]  (NeuronTable rows)
+#
+# a frame lookup is one slice, the per-frame mask one scatter - no scan over all neurons or spikes
+#
+# frames are either every distinct spike time (FromSpikes) or fixed time bins (FromBinnedSpikes),
+# for bins times[f] is the start of the bin and empty bins are frames too
+
+import numpy as np
+
+
+BIN_EPSILON = 1e-6      #fraction of a bin - spike times like 1.000000000000227374e-01 stay in their bin despite the float noise
+
+
+class FrameIndex():
+    def __init__(self, times, offsets, neurons):
+        self.times = times
+        self.offsets = offsets
+        self.neurons = neurons
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return 'FrameIndex ' + str(len(self.times)) + ' frames, ' + str(len(self.neurons)) + ' spikes'
+
+    #returns rows of the spikes start..end-1 (positions in neurons, a view, do not modify)
+    def GetNeurons(self, start, end):
+        return self.neurons[start:end]
+
+    #returns rows of the neurons spiking in frame nFrame (a view, do not modify)
+    def GetSpiking(self, nFrame):
+        return self.GetNeurons(self.offsets[nFrame], self.offsets[nFrame + 1])
+
+    #fills boolean mask (one entry per neuron) with the neurons spiking in frame nFrame
+    def GetSpikingMask(self, nFrame, mask):
+        mask[:] = False
+        mask[self.GetSpiking(nFrame)] = True
+        return mask
+
+    #returns number of spikes in every frame
+    def GetSpikeCounts(self):
+        return np.diff(self.offsets)
+
+#==============================================================================
+
+#returns spikes within [timeStart, timeEnd], None - no limit
+def selectTimeWindow(spikeNeurons, spikeTimes, timeStart, timeEnd):
+    if timeStart is None and timeEnd is None:
+        return spikeNeurons, spikeTimes
+    inside = np.ones(len(spikeTimes), dtype=bool)
+    if timeStart is not None:
+        inside &= spikeTimes >= timeStart
+    if timeEnd is not None:
+        inside &= spikeTimes <= timeEnd
+    return spikeNeurons[inside], spikeTimes[inside]
+
+
+#returns spikes sorted by key (stable), nothing is sorted if they are already - the neuron_cache store keeps them sorted by time
+def sortedBy(key, spikeNeurons, spikeTimes):
+    if len(key) > 1 and np.any(key[1:] < key[:-1]):
+        order = np.argsort(key, kind='mergesort')
+        return key[order], spikeNeurons[order], spikeTimes[order]
+    return key, spikeNeurons, spikeTimes
+
+#==============================================================================
+
+#returns FrameIndex for spikes given as (neuron row, time) pairs - one frame per distinct spike time
+def FromSpikes(spikeNeurons, spikeTimes, timeStart=None, timeEnd=None):
+    spikeNeurons, spikeTimes = selectTimeWindow(np.asarray(spikeNeurons), np.asarray(spikeTimes), timeStart, timeEnd)
+    spikeTimes, spikeNeurons, spikeTimes = sortedBy(spikeTimes, spikeNeurons, spikeTimes)
+    isFirst = np.ones(len(spikeTimes), dtype=bool)
+    isFirst[1:] = spikeTimes[1:] != spikeTimes[:-1]
+    starts = np.flatnonzero(isFirst)
+    offsets = np.append(starts, len(spikeTimes)).astype(np.int64)
+    return FrameIndex(spikeTimes[starts], offsets, spikeNeurons.astype(np.int32, copy=False))
+
+
+#returns FrameIndex with fixed time bins of binWidth: frame f is [timeStart + f*binWidth, timeStart + (f+1)*binWidth)
+#the window defaults to first & last spike, last frame holds timeEnd - frame count is known before any spike is binned
+def FromBinnedSpikes(spikeNeurons, spikeTimes, binWidth, timeStart=None, timeEnd=None):
+    spikeNeurons = np.asarray(spikeNeurons)
+    spikeTimes = np.asarray(spikeTimes)
+    if timeStart is None:
+        timeStart = float(spikeTimes.min()) if len(spikeTimes) else 0.0
+    if timeEnd is None:
+        timeEnd = float(spikeTimes.max()) if len(spikeTimes) else timeStart
+    totalFrames = GetBinnedFrameCount(binWidth, timeStart, timeEnd)
+
+    #one pass: integer frame id of every spike, spikes outside of the window dropped
+    frames = np.floor((spikeTimes - timeStart) / binWidth + BIN_EPSILON).astype(np.int64)
+    inside = (frames >= 0) & (frames < totalFrames)
+    frames, spikeNeurons, spikeTimes = sortedBy(frames[inside], spikeNeurons[inside], spikeTimes[inside])
+
+    offsets = np.searchsorted(frames, np.arange(totalFrames + 1)).astype(np.int64)
+    times = timeStart + np.arange(totalFrames) * binWidth
+    return FrameIndex(times, offsets, spikeNeurons.astype(np.int32, copy=False))
+
+
+def GetBinnedFrameCount(binWidth, timeStart, timeEnd):
+    return int(np.floor((timeEnd - timeStart) / binWidth + BIN_EPSILON)) + 1
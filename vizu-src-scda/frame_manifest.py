@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#Manifest of the rendered frames - a restarted task (--resume) renders only the frames missing or stale
+#--------------------------------------------------------------------------
+#
+# every task appends one json line per finished frame to <output>/render-frames/manifest/task_####.jsonl:
+#   frame, time (value of the frame), key (render key, see RenderKey), file, size & sha1 of the png
+# tasks write separate files - no locking; readers merge all of them, a later line of a frame wins.
+# frames are rendered to a temporary file and renamed into place, a png that exists is always complete.
+
+import json
+import hashlib
+from os import path, listdir, makedirs, getpid, replace
+
+
+MANIFEST_DIR = 'manifest'
+
+#==============================================================================
+
+#hash of everything a frame depends on: data & frame index (prepared signature), config.py, start scene...
+def RenderKey(dataSignature, files):
+    h = hashlib.sha1(dataSignature.encode('utf-8'))
+    for filePath in files:
+        with open(filePath, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def FileSHA1(filePath):
+    h = hashlib.sha1()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+#temporary name in the same directory, same extension (blender adds one if it's missing)
+def GetTempFile(outputFile):
+    (root, ext) = path.splitext(outputFile)
+    return root + '.tmp-' + str(getpid()) + ext
+
+#==============================================================================
+
+class FrameManifest():
+    def __init__(self, framesDir, nodeIndex, renderKey):
+        self.manifestDir = path.join(framesDir, MANIFEST_DIR)
+        self.manifestFile = path.join(self.manifestDir, 'task_' + str(nodeIndex).zfill(4) + '.jsonl')
+        self.renderKey = renderKey
+        self.entries = None
+
+    #all frames recorded by any task: frame -> entry
+    def Load(self):
+        self.entries = {}
+        if path.isdir(self.manifestDir):
+            for name in sorted(listdir(self.manifestDir)):
+                if not name.endswith('.jsonl'):
+                    continue
+                with open(path.join(self.manifestDir, name), 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue        #last line of a killed task
+                        self.entries[entry['frame']] = entry
+        return self.entries
+
+    #True if the frame was rendered with this render key and its file is still the one recorded
+    def IsDone(self, nFrame, outputFile):
+        if self.entries is None:
+            self.Load()
+        entry = self.entries.get(nFrame)
+        if entry is None or entry['key'] != self.renderKey or entry['file'] != path.basename(outputFile):
+            return False
+        if not path.isfile(outputFile) or path.getsize(outputFile) != entry['size']:
+            return False
+        return FileSHA1(outputFile) == entry['sha1']
+
+    #moves the finished temporary file into place and records the frame (canonical: frame it is a link of, frame_dedup.py)
+    def Commit(self, nFrame, timeFrame, tmpFile, outputFile, canonical=None):
+        replace(tmpFile, outputFile)
+        entry = {'frame': int(nFrame), 'time': float(timeFrame), 'key': self.renderKey,
+                 'file': path.basename(outputFile), 'size': path.getsize(outputFile), 'sha1': FileSHA1(outputFile)}
+        if canonical is not None:
+            entry['canonical'] = int(canonical)
+        if not path.isdir(self.manifestDir):
+            try:
+                makedirs(self.manifestDir)
+            except OSError:
+                pass
+        with open(self.manifestFile, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        if self.entries is not None:
+            self.entries[entry['frame']] = entry
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#Level of detail: quiescent neurons aggregated per voxel, spiking neurons drawn one by one
+#--------------------------------------------------------------------------
+#
+# LOD_BUDGET > 0 in config.py:
+# - the bounding cube of the positions is split like an octree, level by level (2^level cells per axis),
+#   the deepest level with at most LOD_BUDGET occupied cells is kept (built once per task, a few sorts)
+# - every occupied cell is one representative particle: centroid of its neurons, mean type color, BASE_ALPHA,
+#   size SIZE * sqrt(neurons) - about the same emitted energy as its neurons drawn separately
+# - after them come 'spike slots': particles at the positions of the neurons changed in the frame
+#   (spiking, or glowing with AFTERGLOW), colors & sizes from the full resolution FrameBuffers - activity is exact
+#   unused slots have size 0
+# particles = representatives + slots, instead of one per neuron.
+
+import numpy as np
+
+import frame_buffer
+
+
+MAX_LEVEL = 10      # 1024 cells per axis, keys fit int64 easily
+
+#==============================================================================
+
+class VoxelLOD():
+    def __init__(self, level, neuronVoxel, positions, colors, counts):
+        self.level = level
+        self.neuronVoxel = neuronVoxel      #voxel of every neuron (row)
+        self.positions = positions          #(R,3) float32 centroids
+        self.colors = colors                #(R,3) float32 mean type colors
+        self.counts = counts                #neurons per voxel
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return 'VoxelLOD level ' + str(self.level) + ', ' + str(len(self.counts)) + ' voxels'
+
+
+#returns voxel keys of every position at octree level
+def voxelKeys(positions, low, extent, level):
+    cells = 1 << level
+    cell = np.floor((positions - low) * (cells / extent)).astype(np.int64)
+    np.clip(cell, 0, cells - 1, out=cell)
+    return (cell[:, 0] * cells + cell[:, 1]) * cells + cell[:, 2]
+
+
+def BuildVoxelLOD(positions, typeColors, typeCodes, budget):
+    positions = np.asarray(positions, dtype=np.float64)
+    low = positions.min(axis=0)
+    extent = max(float((positions.max(axis=0) - low).max()), 1e-9)
+
+    level = 0
+    keys = np.zeros(len(positions), dtype=np.int64)
+    for nextLevel in range(1, MAX_LEVEL + 1):
+        nextKeys = voxelKeys(positions, low, extent, nextLevel)
+        if len(np.unique(nextKeys)) > budget:
+            break
+        (level, keys) = (nextLevel, nextKeys)
+
+    (voxelIDs, neuronVoxel) = np.unique(keys, return_inverse=True)
+    counts = np.bincount(neuronVoxel, minlength=len(voxelIDs))
+    colors = np.asarray(typeColors, dtype=np.float64).reshape(-1, 3)[np.asarray(typeCodes)]
+    centroids = np.empty((len(voxelIDs), 3), dtype=np.float32)
+    meanColors = np.empty((len(voxelIDs), 3), dtype=np.float32)
+    for axis in range(3):
+        centroids[:, axis] = np.bincount(neuronVoxel, weights=positions[:, axis], minlength=len(voxelIDs)) / counts
+        meanColors[:, axis] = np.bincount(neuronVoxel, weights=colors[:, axis], minlength=len(voxelIDs)) / counts
+    return VoxelLOD(level, neuronVoxel.astype(np.int32), centroids, meanColors, counts)
+
+#==============================================================================
+
+#same interface as frame_buffer.FrameBuffers, for the particles of the LOD (representatives + spike slots)
+class LODBuffers():
+    def __init__(self, lod, frameBuffers, positions, slotCount):
+        self.frameBuffers = frameBuffers                    # full resolution buffers - which neurons changed & how
+        frameBuffers.delta = False                          # never uploaded themselves - the slots are
+        self.neuronPositions = np.asarray(positions, dtype=np.float32)
+        self.first = len(lod)
+        self.slotCount = slotCount
+        count = len(lod) + slotCount
+
+        self.basePixels = np.zeros((count, 4), dtype=np.float32)
+        self.basePixels[:self.first, 0:3] = lod.colors
+        self.basePixels[:self.first, 3] = frameBuffers.baseAlpha
+        self.baseSizes = np.zeros(count, dtype=np.float32)
+        self.baseSizes[:self.first] = frameBuffers.size * np.sqrt(lod.counts)
+        self.baseLocations = np.empty((count, 3), dtype=np.float32)
+        self.baseLocations[:self.first] = lod.positions
+        self.baseLocations[self.first:] = lod.positions[0]  # parked, size 0
+
+        self.pixels = self.basePixels.copy()
+        self.sizes = self.baseSizes.copy()
+        self.locations = self.baseLocations.copy()         # slots move - renderers take the locations every frame
+        self.used = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    #spiking neurons of the full resolution buffers go to the slots
+    def fill(self):
+        rows = self.frameBuffers.changed
+        if len(rows) > self.slotCount:
+            print('LOD: ' + str(len(rows)) + ' neurons changed, only ' + str(self.slotCount) + ' slots')
+            rows = rows[:self.slotCount]
+        used = self.first + len(rows)
+        self.locations[self.first:used] = self.neuronPositions[rows]
+        self.pixels[self.first:used] = self.frameBuffers.pixels[rows]
+        self.sizes[self.first:used] = self.frameBuffers.sizes[rows]
+        self.used = used
+
+    def Update(self, spiking):
+        self.Reset()
+        self.frameBuffers.Update(spiking)
+        self.fill()
+
+    def UpdateGlowing(self, rows, factors):
+        self.Reset()
+        self.frameBuffers.UpdateGlowing(rows, factors)
+        self.fill()
+
+    #slots used by the last Update back to hidden
+    def Reset(self):
+        slots = slice(self.first, max(self.used, self.first))
+        self.pixels[slots] = self.basePixels[slots]
+        self.sizes[slots] = self.baseSizes[slots]
+        self.locations[slots] = self.baseLocations[slots]
+        self.used = self.first
+
+    def GetFlatPixels(self):
+        return self.pixels.reshape(-1)
+
+    def Consume(self):
+        pass                                                # the slots are written whole, nothing to track
+
+    def Upload(self, image, particles, atlas=None):
+        frame_buffer.SetImagePixels(image, self.GetFlatPixels())
+        particles.foreach_set("size", self.sizes)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#Per-phase timing & memory of a render task, and the summary of a whole array job
+#--------------------------------------------------------------------------
+#
+# phases are timed with 'with metrics.Phase(name, nFrame):' anywhere in the code - one collector per process.
+# every phase records wall time, cpu time (process) and the peak RSS of the process so far.
+# phases of the visu script: load, parse, index & activity (only when the prepared data is built), materials, legend,
+#   particles, update, render & overlay (per frame, tagged with the frame), sceneUpdate (blender, part of update), save,
+#   signatures & dedup (frames filled from an identical frame instead of rendered, frame_dedup.py)
+#
+# each task writes <output>/metrics/task_####.json: nodeIndex, frames, totals per phase, peak RSS, all records
+#   python3 metrics.py ../out_1M_test        -> summary of all tasks, also written to <output>/metrics/summary.json
+
+import sys
+import json
+import time
+import socket
+import resource
+from os import path, listdir, makedirs
+
+
+METRICS_DIR = 'metrics'
+
+#==============================================================================
+
+#peak resident set size of this process in MB (linux: ru_maxrss is in kB)
+def PeakRSS():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class phaseTimer():
+    def __init__(self, metrics, name, nFrame):
+        self.metrics = metrics
+        self.name = name
+        self.nFrame = nFrame
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.metrics.Record(self.name, time.time() - self.wall, time.process_time() - self.cpu, self.nFrame)
+        return False
+
+
+class Metrics():
+    def __init__(self):
+        self.nodeIndex = None
+        self.info = {}
+        self.records = []
+        self.start = time.time()
+
+    def Phase(self, name, nFrame=None):
+        return phaseTimer(self, name, nFrame)
+
+    def Record(self, name, wall, cpu, nFrame=None):
+        record = {'phase': name, 'wall': wall, 'cpu': cpu, 'rss': PeakRSS()}
+        if nFrame is not None:
+            record['frame'] = int(nFrame)
+        self.records.append(record)
+
+    #count, wall & cpu per phase
+    def GetTotals(self):
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['phase'], {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['count'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+        return totals
+
+    def Write(self, outputDir):
+        metricsDir = path.join(outputDir, METRICS_DIR)
+        if not path.isdir(metricsDir):
+            try:
+                makedirs(metricsDir)
+            except OSError:
+                pass
+        frames = sorted(set(record['frame'] for record in self.records if 'frame' in record))
+        result = {'nodeIndex': self.nodeIndex,
+                  'host': socket.gethostname(),
+                  'info': self.info,
+                  'wall': time.time() - self.start,
+                  'cpu': time.process_time(),
+                  'peakRSS': PeakRSS(),
+                  'frames': frames,
+                  'phases': self.GetTotals(),
+                  'records': self.records}
+        metricsFile = path.join(metricsDir, 'task_' + str(self.nodeIndex).zfill(4) + '.json')
+        with open(metricsFile, 'w') as f:
+            json.dump(result, f)
+        return metricsFile
+
+#==============================================================================
+
+TASK = Metrics()    #the collector of this process
+
+
+def Phase(name, nFrame=None):
+    return TASK.Phase(name, nFrame)
+
+#==============================================================================
+
+#summary of the metrics files of all tasks: per phase totals & slowest task, per task wall, cpu, frames, peak RSS
+def Summarize(outputDir):
+    metricsDir = path.join(outputDir, METRICS_DIR)
+    tasks = []
+    for name in sorted(listdir(metricsDir)):
+        if name.startswith('task_') and name.endswith('.json'):
+            with open(path.join(metricsDir, name), 'r') as f:
+                tasks.append(json.load(f))
+
+    phases = {}
+    for task in tasks:
+        for name, total in task['phases'].items():
+            phase = phases.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'maxTaskWall': 0.0, 'maxTask': None})
+            phase['count'] += total['count']
+            phase['wall'] += total['wall']
+            phase['cpu'] += total['cpu']
+            if total['wall'] >= phase['maxTaskWall']:
+                phase['maxTaskWall'] = total['wall']
+                phase['maxTask'] = task['nodeIndex']
+    for phase in phases.values():
+        phase['meanWall'] = phase['wall'] / phase['count']
+
+    #renders avoided by frame_dedup: frames linked, time they would have taken (mean update & render)
+    rendered = phases.get('render', {'count': 0})['count']
+    linked = phases.get('dedup', {'count': 0})['count']
+    frameWall = sum(phases[name]['meanWall'] for name in ('update', 'render') if name in phases)
+    dedup = {'rendered': rendered, 'linked': linked, 'avoided': linked / float(max(rendered + linked, 1)),
+             'savedWall': linked * frameWall - phases.get('dedup', {'wall': 0.0})['wall']}
+
+    summary = {'tasks': len(tasks),
+               'frames': sum(len(task['frames']) for task in tasks),
+               'wall': max([task['wall'] for task in tasks] or [0]),
+               'cpu': sum(task['cpu'] for task in tasks),
+               'peakRSS': max([task['peakRSS'] for task in tasks] or [0]),
+               'phases': phases,
+               'dedup': dedup,
+               'perTask': [{'nodeIndex': task['nodeIndex'], 'host': task['host'], 'wall': task['wall'], 'cpu': task['cpu'],
+                            'frames': len(task['frames']), 'peakRSS': task['peakRSS']} for task in tasks]}
+    with open(path.join(metricsDir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=1, sort_keys=True)
+    return summary
+
+
+if __name__ == '__main__':
+    summary = Summarize(sys.argv[1])
+    print('tasks', summary['tasks'], 'frames', summary['frames'], 'slowest task wall', round(summary['wall'], 2),
+          'cpu total', round(summary['cpu'], 2), 'peak RSS MB', round(summary['peakRSS'], 1))
+    for name, phase in sorted(summary['phases'].items(), key=lambda item: -item[1]['wall']):
+        print('%-12s count %7d  wall %10.2f  cpu %10.2f  mean %8.4f  max task %s (%.2f)' %
+              (name, phase['count'], phase['wall'], phase['cpu'], phase['meanWall'], phase['maxTask'], phase['maxTaskWall']))
+    dedup = summary['dedup']
+    print('renders avoided (frame_dedup):', dedup['linked'], 'of', dedup['rendered'] + dedup['linked'], 'frames',
+          '(%.1f%%), about %.2f s saved' % (100 * dedup['avoided'], dedup['savedWall']))
+    for task in summary['perTask']:
+        print('task', task['nodeIndex'], task['host'], 'wall', round(task['wall'], 2), 'frames', task['frames'],
+              'peak RSS MB', round(task['peakRSS'], 1))
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#Batch mode: several datasets, frame ranges & cameras rendered in one blender (or python) process
+#--------------------------------------------------------------------------
+#
+#   ./run-batch.sh jobs.json [--resume] [--groups=... (selection.py)]
+#   blender -b -P neuron-visu-batch.py jobs.json      (RENDER_BACKEND "blender")
+#   python3 neuron-visu-batch.py jobs.json            ("numpy")
+#
+# jobs.json - list of jobs, paths relative to this script (like the visu script):
+#   [{"input": "../1M_test", "output": "../out_1M_test_front", "from": 0, "to": 100, "step": 1,
+#     "camera": {"location": [2.35, -6.67, 6.23], "rotation": [1.466, 0.0, 0.248], "type": "PERSP", "lens": 50.0}},
+#    {"input": "../1M_test", "output": "../out_1M_test_top", "camera": {"location": [2.35, 0.5, 12.0], "rotation": [0, 0, 0]}}]
+#   from, to, step: default all frames; camera: default the camera of the start scene (blender) or CAMERA_* of config.py (numpy),
+#   keys missing in a camera are CAMERA_* of config.py
+#
+# the start scene is opened and the render settings are set once, materials are made once per group & type name
+# (their colors set per dataset). Between datasets only mesh, particles, texture & legend items are removed and made again,
+# jobs with the same input as the job before keep them - only camera & frames change.
+# frames: <output>/render-frames/render_####.png (frame manifest - --resume keeps the frames done), metrics per job.
+# ACTIVITY_OVERLAY: <output>/render-frames/overlay_####.png next to the frames (activity_overlay.py)
+
+import sys
+import json
+import time
+from os import path, makedirs
+
+import numpy as np
+
+
+#script arguments follow the script path: 'blender -b -P neuron-visu-batch.py args' or 'python neuron-visu-batch.py args'
+scriptNames = [path.basename(arg) for arg in sys.argv]
+args = sys.argv[scriptNames.index(path.basename(__file__)) + 1:]
+flags = [arg for arg in args if arg.startswith('--')]    # --resume: skip frames already rendered (frame_manifest.py)
+args = [arg for arg in args if not arg.startswith('--')]
+RESUME = '--resume' in flags
+
+SOURCE_PATH = path.dirname(path.realpath(__file__))
+sys.path.insert(0, SOURCE_PATH)     #helper modules next to this script
+
+import prepare
+import frame_buffer
+import frame_manifest
+import splat_renderer
+import spike_stream
+import selection
+import neuron_groups
+import activity_overlay
+import scheduler
+import lod
+import metrics
+
+cfg = selection.ApplyArgs(prepare.LoadConfig(SOURCE_PATH), flags)
+SUBSET_KEY = selection.FromConfig(cfg).GetSignature()
+
+with open(path.join(SOURCE_PATH, args[0]), 'r') as f:
+    JOBS = json.load(f)
+print('batch:', len(JOBS), 'jobs')
+
+#==============================================================================
+
+#camera values of a job: its 'camera' keys, the others CAMERA_* of config.py
+def GetCameraValues(camera):
+    return (camera.get('location', cfg.CAMERA_LOCATION), camera.get('rotation', cfg.CAMERA_ROTATION),
+            camera.get('type', cfg.CAMERA_TYPE), camera.get('orthoScale', cfg.CAMERA_ORTHO_SCALE),
+            camera.get('lens', cfg.CAMERA_LENS), camera.get('sensorWidth', cfg.CAMERA_SENSOR_WIDTH))
+
+
+#everything of one input directory the jobs need - kept while the next job has the same input
+class Dataset():
+    def __init__(self, inputPath, outputDir):
+        self.inputPath = inputPath
+        with metrics.Phase('load'):
+            self.prepared = prepare.OpenPrepared(inputPath, outputDir, cfg, SOURCE_PATH)
+        print(self.prepared)
+        self.dataKey = self.prepared.meta['data'] + SUBSET_KEY
+        self.neuronTable = self.prepared.neuronTable
+        self.frameIndex = self.prepared.frameIndex
+        if cfg.SPIKE_WINDOW > 0:
+            self.frameIndex = spike_stream.WindowedFrameIndex(self.frameIndex, cfg.SPIKE_WINDOW)
+        self.typeColors = self.prepared.typeColors.tolist()
+        self.neuronGroups = neuron_groups.GetNeuronGroups(self.neuronTable)
+        neuron_groups.SetTypeColors(self.neuronGroups, self.typeColors)
+        self.overlay = None
+        if cfg.ACTIVITY_OVERLAY:
+            self.overlay = activity_overlay.ActivityOverlay(self.prepared.typeActivity, self.neuronGroups, cfg.ACTIVITY_WINDOW,
+                                                            cfg.ACTIVITY_OVERLAY_SIZE[0] * cfg.RESOLUTION_SCALE / 100,
+                                                            cfg.ACTIVITY_OVERLAY_SIZE[1] * cfg.RESOLUTION_SCALE / 100)
+
+        #particles: one per neuron, or with LOD_BUDGET voxel representatives + slots for the spiking neurons
+        self.particlePositions = self.neuronTable.positions
+        self.voxelLOD = None
+        if cfg.LOD_BUDGET > 0 and cfg.LOD_BUDGET < len(self.neuronTable):
+            self.voxelLOD = lod.BuildVoxelLOD(self.neuronTable.positions, self.typeColors, self.neuronTable.typeCodes, cfg.LOD_BUDGET)
+            slotCount = int(np.ceil(scheduler.FrameWork(self.frameIndex, cfg).max()))
+            self.particlePositions = np.zeros((len(self.voxelLOD) + slotCount, 3), dtype=np.float32)
+            self.particlePositions[:len(self.voxelLOD)] = self.voxelLOD.positions
+            self.particlePositions[len(self.voxelLOD):] = self.voxelLOD.positions[0]
+
+    def __len__(self):
+        return len(self.frameIndex)
+
+    #new buffers for a job - afterglow & delta state start over
+    def GetFrameBuffers(self):
+        frameBuffers = frame_buffer.FrameBuffers(self.typeColors, self.neuronTable.typeCodes, cfg.BASE_ALPHA, cfg.SPIKE_ALPHA,
+                                                 cfg.SIZE, cfg.SIZE_SPIKE, cfg.DELTA_UPDATES)
+        if self.voxelLOD is not None:
+            frameBuffers = lod.LODBuffers(self.voxelLOD, frameBuffers, self.neuronTable.positions,
+                                          len(self.particlePositions) - len(self.voxelLOD))
+        afterglow = None
+        if cfg.AFTERGLOW:
+            afterglow = frame_buffer.Afterglow(self.frameIndex, len(self.neuronTable), cfg.AFTERGLOW_DECAY, cfg.BASE_ALPHA,
+                                               cfg.SPIKE_ALPHA, cfg.AFTERGLOW_MIN_ALPHA)
+        return frameBuffers, afterglow
+
+#==============================================================================
+
+#blender: one scene for all jobs, neurons made again only for a new dataset
+class blenderBatch():
+    def __init__(self):
+        import blender_backend
+        self.renderer = blender_backend.BlenderRenderer(0, cfg.RESOLUTION_SCALE, cfg.TEXTURE_ATLAS_TILE_ROWS)
+        with metrics.Phase('scene'):
+            self.renderer.OpenScene(cfg.BASE_SCENE_FILE)
+        self.hasNeurons = False
+        self.keyFiles = [path.join(SOURCE_PATH, "config.py"), path.join(SOURCE_PATH, cfg.BASE_SCENE_FILE)]
+
+    def SetDataset(self, dataset, outputDir):
+        renderer = self.renderer
+        if self.hasNeurons:
+            with metrics.Phase('clear'):
+                renderer.ClearNeurons()
+                renderer.ClearLegend()
+        renderer.SetTotalFrames(len(dataset))
+        with metrics.Phase('materials'):
+            renderer.CreateMaterials(dataset.neuronGroups)
+            if cfg.DRAW_LEGEND == True:
+                renderer.CreateLegend(dataset.neuronGroups)
+        with metrics.Phase('particles'):
+            renderer.CreateNeurons(dataset.particlePositions, cfg.SIZE, cfg.EMISSION)
+        self.hasNeurons = True
+
+    def SetCamera(self, dataset, camera):
+        if camera is None:
+            self.renderer.SetCamera()
+        else:
+            self.renderer.SetCamera(*GetCameraValues(camera))
+
+    def RenderLegend(self, outputDir):
+        if cfg.DRAW_LEGEND == True:
+            with metrics.Phase('legend'):
+                self.renderer.RenderLegend(path.join(outputDir, "_legend_" + str(1).zfill(4) + ".png"),
+                                           path.join(outputDir, cfg.OUT_LEGEND_FILE))
+
+
+#numpy: nothing to keep but the projection - a renderer per camera
+class numpyBatch():
+    def __init__(self):
+        self.renderer = None
+        self.keyFiles = [path.join(SOURCE_PATH, "config.py")]
+
+    def SetDataset(self, dataset, outputDir):
+        self.renderer = None
+
+    def SetCamera(self, dataset, camera):
+        (location, rotation, cameraType, orthoScale, lens, sensorWidth) = GetCameraValues(camera or {})
+        camera = splat_renderer.Camera(location, rotation, cameraType, orthoScale, lens, sensorWidth)
+        self.renderer = splat_renderer.SplatRenderer(camera, cfg.SPLAT_RESOLUTION, cfg.RESOLUTION_SCALE, cfg.EMISSION, cfg.SPLAT_OBJECT_RADIUS)
+        with metrics.Phase('particles'):
+            self.renderer.CreateNeurons(dataset.particlePositions, cfg.SIZE, cfg.EMISSION)
+
+    def RenderLegend(self, outputDir):
+        pass
+
+#==============================================================================
+
+def RenderJob(batch, dataset, job, outputDir):
+    frameFrom = job.get('from', 0)
+    frameTo = min(job.get('to', len(dataset) - 1), len(dataset) - 1)
+    frames = list(range(frameFrom, frameTo + 1, job.get('step', 1)))
+    print('job:', dataset.inputPath, '->', outputDir, len(frames), 'frames, camera', job.get('camera'))
+
+    framesDirectory = path.join(outputDir, "render-frames")
+    renderKey = frame_manifest.RenderKey(dataset.dataKey + json.dumps(job.get('camera'), sort_keys=True), batch.keyFiles)
+    framesManifest = frame_manifest.FrameManifest(framesDirectory, 1, renderKey)
+    if RESUME:
+        framesManifest.Load()
+
+    frameBuffers, afterglow = dataset.GetFrameBuffers()
+    timings = []
+    for nFrame in frames:
+        timeStart = time.time()
+        outputFile = path.join(framesDirectory, "render_" + str(nFrame).zfill(4) + ".png")
+        if RESUME and framesManifest.IsDone(nFrame, outputFile):
+            continue
+        with metrics.Phase('update', nFrame):
+            if afterglow is not None:
+                rows, factors = afterglow.Advance(nFrame)
+                frameBuffers.UpdateGlowing(rows, factors)
+            else:
+                frameBuffers.Update(dataset.frameIndex.GetSpiking(nFrame))
+            batch.renderer.UpdateFrame(nFrame, frameBuffers)
+        tmpFile = frame_manifest.GetTempFile(outputFile)
+        with metrics.Phase('render', nFrame):
+            batch.renderer.Render(tmpFile)
+        if dataset.overlay is not None:
+            with metrics.Phase('overlay', nFrame):
+                dataset.overlay.Write(nFrame, path.join(framesDirectory, "overlay_" + str(nFrame).zfill(4) + ".png"))
+        framesManifest.Commit(nFrame, dataset.frameIndex.times[nFrame], tmpFile, outputFile)
+        timings.append((nFrame, time.time() - timeStart, False))
+        print(dataset.frameIndex.times[nFrame], nFrame)
+    if len(timings):
+        scheduler.WriteTimings(outputDir, 1, timings, scheduler.TimingsKey(dataset.prepared.meta, cfg))
+
+#==============================================================================
+
+batch = blenderBatch() if cfg.RENDER_BACKEND == 'blender' else numpyBatch()
+dataset = None
+for jobNumber, job in enumerate(JOBS):
+    metrics.TASK = metrics.Metrics()        # metrics of every job to its output directory
+    metrics.TASK.nodeIndex = 1
+    metrics.TASK.info = {'backend': cfg.RENDER_BACKEND, 'batchJob': jobNumber, 'camera': job.get('camera')}
+    inputPath = path.join(SOURCE_PATH, job['input'])
+    outputDir = path.join(SOURCE_PATH, job['output'])
+    if not path.isdir(outputDir):
+        makedirs(outputDir)
+
+    if dataset is None or dataset.inputPath != inputPath:
+        dataset = Dataset(inputPath, outputDir)
+        batch.SetDataset(dataset, outputDir)
+        legendDirs = set()
+    batch.SetCamera(dataset, job.get('camera'))
+    if outputDir not in legendDirs:                  # the legend does not depend on the camera
+        batch.RenderLegend(outputDir)
+        legendDirs.add(outputDir)
+    RenderJob(batch, dataset, job, outputDir)
+    print('metrics:', metrics.TASK.Write(outputDir))
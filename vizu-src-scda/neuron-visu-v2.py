@@ -3,12 +3,10 @@
 #--------------------------------------------------------------------------
 
 
-import bpy  #for blender's python api 
-import bmesh
-
 import sys
-from os import path, walk, listdir, makedirs
-import colorsys as cs
+import time
+import collections
+from os import path, makedirs
 import numpy as np
 
 
@@ -32,22 +30,46 @@ This version is a little more optimised -
 for i in range(0, len(sys.argv)):
     print(i,sys.argv[i])
 
-inputDataPath = sys.argv[4]
-outputRenderPath = sys.argv[5]
+#script arguments follow the script path: 'blender -b -P neuron-visu-v2.py args' or 'python neuron-visu-v2.py args'
+scriptNames = [path.basename(arg) for arg in sys.argv]
+args = sys.argv[scriptNames.index(path.basename(__file__)) + 1:]
+flags = [arg for arg in args if arg.startswith('--')]    # --build-scene: only build the cached positions scene (blender) and exit
+args = [arg for arg in args if not arg.startswith('--')]  # --manifest: frames of this task from the scheduler manifest (scheduler.py)
+BUILD_SCENE = '--build-scene' in flags                    # --resume: skip frames already rendered (frame_manifest.py)
+USE_MANIFEST = '--manifest' in flags
+RESUME = '--resume' in flags                              # --groups=TH_M1,M1 --box=... etc: subset to render (selection.py)
+
+inputDataPath = args[0]
+outputRenderPath = args[1]
 #some default values:
 renderFrom = 0 
 renderTo = 100 # max 
 renderStep = 1 # every frame
 nodeIndex = 1 # 1 index based
 print('total args', len(sys.argv))
-if len(sys.argv) == 9:
-    renderFrom = int(sys.argv[6])
-    renderTo = int(sys.argv[7])
-    renderStep = int(sys.argv[8])
-    nodeIndex = int(sys.argv[9])
+if len(args) >= 6:
+    renderFrom = int(args[2])
+    renderTo = int(args[3])
+    renderStep = int(args[4])
+    nodeIndex = int(args[5])
     
 ABSOLUTE_PATH = path.join(path.dirname(path.realpath(__file__)), inputDataPath)
 SOURCE_PATH = path.dirname(path.realpath(__file__))
+sys.path.insert(0, SOURCE_PATH)     #helper modules next to this script
+
+import prepare
+import frame_buffer
+import splat_renderer
+import scheduler
+import frame_manifest
+import segment_encoder
+import lod
+import metrics
+import spike_stream
+import selection
+import neuron_groups
+import activity_overlay
+import frame_dedup
 
 #==============================================================================
 
@@ -56,6 +78,7 @@ import importlib.util
 configMod = importlib.util.spec_from_file_location("configuration", path.join(SOURCE_PATH,"config.py" ))
 cfg = importlib.util.module_from_spec(configMod)
 configMod.loader.exec_module(cfg)
+selection.ApplyArgs(cfg, flags)          # --groups=... override SELECT_* of config.py
 
 
 BASE_ALPHA = cfg.BASE_ALPHA
@@ -65,6 +88,7 @@ SIZE = cfg.SIZE
 SIZE_SPIKE = cfg.SIZE_SPIKE    
 RESOLUTION_SCALE = cfg.RESOLUTION_SCALE #100% is 1920x1080
 SKIP_RENDER = cfg.SKIP_RENDER
+RENDER_BACKEND = cfg.RENDER_BACKEND
 
 #if we're not rendering - then exit on all other nodes except for the first one (starts with 1 index based)
 if SKIP_RENDER:
@@ -81,220 +105,60 @@ if not path.isdir(targetDirectory):
 
 #==============================================================================
 
-
-
-#open the default start up file.  (overwrite for parametrical input)
-bpy.ops.wm.open_mainfile(filepath=cfg.BASE_SCENE_FILE)
-
-
-#==============================================================================
-
-#has position id and spike time  -------------------------------------------
-class Neuron():
-    EXCITATORY='I'
-    INHIBITORY='E'
-    def __init__(self, sID, vXYZ, neuronType, neuronState):
-        self.sID = sID
-        self.pos = vXYZ
-        self.spikeTimes = []        #list of spike times, as float
-        self.neuronType = neuronType
-        self.rampElement = None     #reference to color ramp element in blender cycles material
-        self.neuronState = neuronState  #EXCITATORY / INHIBITORY
-        
-    def __repr__(self):
-        return str(self.sID) + ' ' + str(self.pos) + ' ' + str(self.spikeTimes)
-    
-    def IsSpiked(self, timeFrame):
-        return timeFrame in self.spikeTimes
-
-#neuron type has neurons  ---------------------------------------------------      
-class NeuronType():
-    def __init__(self, typeName, neuronGroup):
-        self.name = typeName
-        self.neurons = []
-        self.neuronGroup = neuronGroup
-        self.color = (0,0,0)
-    
-    def GetSpiked(self, timeFrame):
-        return [n for n in self.neurons if n.IsSpiked(timeFrame)]
-    
-    def __repr__(self):
-        return self.name + ' ' + str(self.neurons)
-
-
-#group of neuron types   ---------------------------------------------------
-class NeuronGroup():    # BG, M1, S1, TH_M1
-    def __init__(self, groupName):
-        self.name = groupName
-        self.neuronTypes = []
-    
-    def GetSpiked(self, timeFrame):
-        allSpiked = [] 
-        for nt in self.neuronTypes:
-            spiked = nt.GetSpiked(timeFrame)
-            if len(spiked) > 0:
-                allSpiked.extend(spiked)
-        return allSpiked 
-
-    def __repr__(self):
-        return self.name + ' ' + str(self.neuronTypes)
-
-#==============================================================================
-
-#returns list of Neurons
-def readNeuronData(filePath, neuronType):
-    neurons = []
-    with open(filePath, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            data = line.split(' ')
-            sID = str(float(data[0]))
-            fx = float(data[1])
-            fy = float(data[2])
-            fz = float(data[3])  
-            neuronState = str(data[4]) 
-            neuron = Neuron(sID, (fx,fy,fz), neuronType, neuronState)
-            neurons.append(neuron)
-    return neurons
-
-#==============================================================================
-
-
-#returns dictionary - key is string repr of neurond ID, value - spike time, float
-def readSpikeData(filePath):
-    spikes={}
-    with open(filePath, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            data = line.split(' ')
-            if len(data) != 2:
-                continue
-            key = str(float(data[0]))
-            spikeTime = float(data[1])
-            if key not in spikes.keys():
-                spikes[key] = []            # createa list of spikes for this key     
-            spikes[key].append(spikeTime)   #append spike to this key
-    return spikes
-
-
-#==============================================================================
-
-#matches spikes values to each neuron.spike time
-def addSpikesToNeurons(neurons, spikes, refTimeFrames):
-    for neuron in neurons:
-        key = neuron.sID
-        if key in spikes.keys():
-            neuron.spikeTimes = spikes[key]
-            refTimeFrames.extend(neuron.spikeTimes)
-
-
-#==============================================================================
-
-def GetColorKey(neuronGroup, neuronType):
-    return neuronGroup.name +'-' + neuronType.name
-
-#==============================================================================
-
-#returns material
-def CreateMaterial(name, color):
-    scene_legend = bpy.data.scenes["flat"]
-    plane = scene_legend.objects['Plane']
-    matSRC = plane.active_material
-    mat = matSRC.copy()
-    mat.node_tree.nodes["Emission"].inputs[0].default_value = (color[0], color[1], color[2], 1)
-    mat.name = name
-    return mat 
-
-
-
-#==============================================================================
-
-
-
-
-
-
-
-
-
-
-
-
-
 #==============================================================================
 #this data has neuron types and neurons with spike times for each neuron
-neuronGroups = []
-SPIKES = 'spikes'
-
-for dirname, dirnames, filenames in walk(ABSOLUTE_PATH):
-    # print path to all subdirectories first.
-    for subdirname in dirnames:
-        if SPIKES == subdirname:
-            continue        
-        else:
-            neuronGroups.append(NeuronGroup(subdirname))
+#neuron arrays, frame index & colors are prepared once for all tasks (prepare.py) and memory-mapped here,
+#if there is no prepared artifact for this data & config yet - it is built now
+metrics.TASK.nodeIndex = nodeIndex               # phases of this task -> <output>/metrics/task_####.json
+metrics.TASK.info = {'backend': RENDER_BACKEND, 'outputMode': cfg.OUTPUT_MODE}
+with metrics.Phase('load'):
+    prepared = prepare.OpenPrepared(ABSOLUTE_PATH, targetDirectory, cfg, SOURCE_PATH)
+print(prepared)
+DATA_KEY = prepared.meta['data'] + selection.FromConfig(cfg).GetSignature()     # data & subset - scene cache & render keys
+neuronTable = prepared.neuronTable              # all neurons as columns (positions, types, states)
+frameIndex = prepared.frameIndex                # frames with the neurons spiking in each frame
+if cfg.SPIKE_WINDOW > 0:
+    frameIndex = spike_stream.WindowedFrameIndex(frameIndex, cfg.SPIKE_WINDOW)    # spikes of the frames rendered only, windows read ahead
+
+neuronGroups = neuron_groups.GetNeuronGroups(neuronTable)      # NeuronGroup, NeuronType: names & row ranges
 print('\n', neuronGroups,'\n')
 
-timeFrames = [] # add time frames to the list to get max & total time for the simulation
-#read data for each neuronGroup:
-for neuronGroup in neuronGroups:  
-    pathGroup = path.join(ABSOLUTE_PATH, neuronGroup.name)
-    dirs = listdir(pathGroup)    
-
-    # if spikes - are in the separate text files 'BG_neurons_type'        
-    # This would print all the files and directories
-    for file in dirs:
-        if file.endswith('.txt'):
-            neuronTypeName = file.split('.')[0]
-            print(neuronTypeName) 
-            neuronType = NeuronType(neuronTypeName, neuronGroup)
-            neuronGroup.neuronTypes.append(neuronType)
-            neuronType.neurons = readNeuronData(path.join(pathGroup, file), neuronType)          
-            spikes = readSpikeData(path.join(pathGroup, SPIKES, neuronTypeName + '_' + SPIKES + '.txt'))  
-            addSpikesToNeurons(neuronType.neurons, spikes, timeFrames)
    
     
     
 #==============================================================================
             
-TIME_LIST = list(dict.fromkeys(timeFrames))
-TIME_MIN = min(TIME_LIST)
-TIME_MAX = max(TIME_LIST)
+TIME_LIST = frameIndex.times
+TIME_MIN = TIME_LIST[0]
+TIME_MAX = TIME_LIST[-1]
 TOTAL_FRAMES = len(TIME_LIST)
 
 #==============================================================================
 print(TIME_MIN, TIME_MAX, TOTAL_FRAMES)
 #==============================================================================
 
-
-
-
-#IMPORTANT set the last frame in the scene now - need it for particles! 
-#particles start is latest canbe 
-scene = bpy.context.scene
-scene.frame_start = -1
-scene.frame_end = TOTAL_FRAMES
-
-
-
-
-
 #==============================================================================
-#------ Put all neurons in one list -------------------------------------------  
-allNeurons = []
-groupsAndTypesCount = 0
-for neuronGroup in neuronGroups: 
-    for neuronType in neuronGroup.neuronTypes:
-        groupsAndTypesCount+=1
-        for n in neuronType.neurons:
-            allNeurons.append(n)    
-
-print('total neurons:', len(allNeurons))
+#------ Count neurons, groups and types -------------------------------------------  
+groupsAndTypesCount = len(neuronTable.types)
+TOTAL_NEURONS = len(neuronTable)
+
+print('total neurons:', TOTAL_NEURONS)
 print('Min Time:', TIME_MIN)
 print('Max Time:', TIME_MAX)
 print('total time', TOTAL_FRAMES)
+
+#frames of this task: from the scheduler manifest (balanced by cost) or renderFrom..renderTo every renderStep
+if USE_MANIFEST:
+    manifest = scheduler.ReadManifest(targetDirectory)
+    if manifest['data'] != prepared.meta['data'] or manifest['config'] != prepared.meta['config']:
+        sys.exit('schedule manifest is not for this data & config - run scheduler.py again')
+    FRAME_LIST = scheduler.GetTaskFrames(manifest, nodeIndex, cfg.OUTPUT_MODE != 'segments')   # segments: no single frames of other chunks
+else:
+    FRAME_LIST = list(range(renderFrom, min(renderTo, TOTAL_FRAMES - 1) + 1, renderStep))
+if cfg.OUTPUT_MODE == 'segments' and not USE_MANIFEST and renderStep > 1 and SKIP_RENDER == False:
+    sys.exit('OUTPUT_MODE "segments" needs contiguous frames per task - use --manifest (submit-all.sh) or a step of 1')
 if SKIP_RENDER == False:
-    print('THIS RENDER:[', renderFrom, ',', renderTo, ']')
+    print('THIS RENDER:', len(FRAME_LIST), 'frames [', FRAME_LIST[:1], '...', FRAME_LIST[-1:], ']')
 #==============================================================================
 
 
@@ -305,17 +169,9 @@ if SKIP_RENDER == False:
 
 
 #==============================================================================
-#------ CREATE COLORS & MATERIALS for all groups all types------------------------------            
-hueStep = 0.9/groupsAndTypesCount
-hue = 0 
-MATERIALS = {}
-for neuronGroup in neuronGroups: 
-    for neuronType in neuronGroup.neuronTypes:
-        key = GetColorKey(neuronGroup, neuronType)
-        color = cs.hsv_to_rgb(hue,1,1)
-        neuronType.color = color
-        MATERIALS[key] = CreateMaterial(key, color)
-        hue += hueStep
+#------ COLORS for all groups all types (prepared) ------------------------------            
+TYPE_COLORS = prepared.typeColors.tolist()      # color of each type code
+neuron_groups.SetTypeColors(neuronGroups, TYPE_COLORS)
 #==============================================================================
 
 
@@ -325,183 +181,78 @@ for neuronGroup in neuronGroups:
 
 
 #==============================================================================
-#---------update and render the legend in scene 'flat'----------------------------------------
-def CreateLegendItem(scn, oText, oPlane, name, material, pos):
-    oTextNew = oText.copy()                             # copy base object
-    oTextNew.data = oText.data.copy();
-    oTextNew.data.body = name
-    before = oTextNew.location
-    oTextNew.location = (before[0] + pos[0], before[1] + pos[1], before[2] + pos[2]) # set the position, parameter pos
-    oTextNew.hide_render=False
-    scn.objects.link(oTextNew)                          # link this object to the scene
-    
-    oPlaneNew = oPlane.copy()
-    oPlaneNew.data = oPlane.data;
-    before = oPlaneNew.location
-    oPlaneNew.location = (before[0] + pos[0], before[1] + pos[1], before[2] + pos[2]) # set the position, parameter pos
-    oPlaneNew.hide_render=False
-    oPlaneNew.material_slots[0].material = material     # update material
-    oPlaneNew.active_material    
-    scn.objects.link(oPlaneNew)
-
-scene_legend = bpy.data.scenes["flat"]
-textBase = scene_legend.objects['Text']
-textBase.hide_render=True
-plane = scene_legend.objects['Plane']
-plane.hide_render=True
-
-#draw legend if needed
-if cfg.DRAW_LEGEND == True:
-    offsetX = 0
-    offsetY = 0
-    for neuronGroup in neuronGroups: 
-        #print(neuronGroup.name)
-        CreateLegendItem(scene_legend, textBase, plane, neuronType.name, MATERIALS[key], (offsetX, offsetY, 0))
-        offsetX = 0
-        offsetY -= 1
-        for neuronType in neuronGroup.neuronTypes:
-            #print("   ", neuronType.name)
-            key = GetColorKey(neuronGroup, neuronType)
-            CreateLegendItem(scene_legend, textBase, plane, neuronType.name, MATERIALS[key], (offsetX, offsetY, 0))
-            offsetX = 1
-            offsetY -= 1
-        
-    #--------- RENDER LEGEND---------------------------------ENDER------------------------
-    if nodeIndex == 1:                                  # for the first now - render the legend (we do it once , we need just one frame for it) & save as debug-legend.blend
-        #render legend separately
-        sceneBefore = bpy.context.scene    
-        bpy.context.screen.scene = scene_legend         # set the legend scene is a main scene
-        scene_legend.frame_set(1)                       # Sets scene frame to nFrame.
-        scene_legend.update()
-        
-        outputFile = path.join(SOURCE_PATH,  outputRenderPath, "_legend_" + str(1).zfill(4) + ".png" ) 
-        #outputFile = "//" + RENDER_PATH + "/" + RENDER_PATH + "_legend_" + str(1).zfill(4) + ".png" # saves to relative path: "//file/file_####.png" where #### is a frame index, e.g 0001
-        scene_legend.render.filepath = outputFile       # update render output path
-        bpy.ops.render.render( write_still=True )
-        bpy.context.screen.scene = sceneBefore          # set the base scene as default
-    
-        #Save the blend file for debugging:
-        
-        bpy.ops.wm.save_as_mainfile(filepath = path.join(SOURCE_PATH, outputRenderPath, cfg.OUT_LEGEND_FILE))
-    
-    #--------end-update Legend in scene 'flat'----------------------------------------
+#------ PARTICLES: one per neuron, or with LOD_BUDGET voxel representatives + slots for the spiking neurons -----
+particlePositions = neuronTable.positions
+voxelLOD = None
+if cfg.LOD_BUDGET > 0 and cfg.LOD_BUDGET < TOTAL_NEURONS:
+    voxelLOD = lod.BuildVoxelLOD(neuronTable.positions, TYPE_COLORS, neuronTable.typeCodes, cfg.LOD_BUDGET)
+    slotCount = int(np.ceil(scheduler.FrameWork(frameIndex, cfg).max()))    # most neurons changed in one frame (upper bound with afterglow)
+    print(voxelLOD, '+', slotCount, 'spike slots')
+    particlePositions = np.zeros((len(voxelLOD) + slotCount, 3), dtype=np.float32)
+    particlePositions[:len(voxelLOD)] = voxelLOD.positions
+    particlePositions[len(voxelLOD):] = voxelLOD.positions[0]
 #==============================================================================
 
-
-
-
-
-
-
-
-#returns created object, dupli - is an object to be cloned if non None. - 
-#for the performance we use the same mesh data of this dupli object (DUPLI_MESH)  
-
-
-#------------------------------------------------------------------------------
-def CreateNeuralNetwork(neurons, totalFrames):
-    bpy.context.screen.scene = bpy.data.scenes["Scene"]
-    obj = bpy.data.objects.new("NeuralNetwork", bpy.data.meshes.new("mesh"))  # add a new object using the mesh
-    scene = bpy.context.scene
-    scene.objects.link(obj)             # put the object into the scene (link)
-    mesh = obj.data
-    bm = bmesh.new()
-    #create verticies for this mesh
-    for neuron in neurons:
-        bm.verts.new(neuron.pos)        # add a new vert
-    bm.to_mesh(mesh)  
-    bm.free()                           # always do this when finished 
-    #neuron view object
-    renderObject = scene.objects['neuron-render']
-    neuralMaterial = renderObject.material_slots[0].material
-    obj.data.materials.append(neuralMaterial)
-    obj.material_slots[0].link = 'OBJECT'    
-
-    return obj, neuralMaterial
-
-#==============================================================================
-
-
-
-
-
-
-
-
-
-
 #==============================================================================
-
-def CreateParticlesForFrame(nFrame, obj, neurons, totalFrames, size):
-    obj.modifiers.clear()
-    
-    scene = bpy.context.scene    
-    renderObject = scene.objects['neuron-render']
-    #add particle system, set number of points to be exact as number of vertices (neurons)
-    obj.modifiers.new("particles", type='PARTICLE_SYSTEM')
-    
-    #particle system:
-    particleSystem = obj.particle_systems[0]
-    settings = particleSystem.settings
-      
-    settings.emit_from = 'VERT'
-    settings.use_emit_random = True #  True or False - doesnt matter - we set location every frame anyway.    
-    settings.physics_type = 'NEWTON' #'NO' #'NEWTON'   FLUID  #IMPORTANT! neded this to activate caching otherwise we cannot set particles position/size 
-    settings.particle_size = size
-    settings.render_type = 'OBJECT' 
-    settings.dupli_object = renderObject 
-    settings.show_unborn = False
-    settings.use_dead = True
-    settings.count = len(neurons)
-    settings.frame_start = -1 #totalFrames - resets to 200??? 
-    settings.frame_end = -1 #totalFrames
-    settings.lifetime = 1
-    settings.draw_percentage = 1 # 1% - to draw 
-    settings.normal_factor = 0
-    settings.mass = 0
-    
-    #to use cache - file mustbe saved first!
-    #bpy.ops.wm.save_as_mainfile(filepath="_debug_node_" + str(nodeIndex) + ".blend")
-    particleSystem.point_cache.use_disk_cache = False
-    particleSystem.point_cache.use_library_path = False
-    
-    bpy.context.scene.frame_current = -1
-    scene.update()                      #IMPORTANT! this will spawn and update particles
-    
-    #position particles - clear particle cache
-    particleSystem.seed+=1
-    particleSystem.seed-=1
-
-    particles = particleSystem.particles
-    neuronLocations = np.array([0,0,0]*len(particles), dtype='float')
-    for index, neuron in enumerate(neurons):
-        neuronLocations[index*3] = neuron.pos[0]
-        neuronLocations[index*3 + 1] = neuron.pos[1]
-        neuronLocations[index*3 + 2] = neuron.pos[2]
-    particles.foreach_set("location", neuronLocations)
-
-    scene.update()                      #IMPORTANT! this will spawn and update particles
-
-    return particleSystem, neuronLocations
-    
-
-#==============================================================================
-
-
-
-
-
-NeuralObject, NeuralMaterial = CreateNeuralNetwork(allNeurons, TOTAL_FRAMES) # create vertices & particle system to visualize non spiked neurons
-ParticleSystem, neuronLocations = CreateParticlesForFrame(0, NeuralObject, allNeurons, TOTAL_FRAMES, size = SIZE)
-
-NeuralMaterial.node_tree.nodes["Math"].inputs[1].default_value = len(allNeurons) - 1
-NeuralMaterial.node_tree.nodes['Emission'].inputs[1].default_value = EMISSION
-
-#neuron colors & alpha - spikes are encoded into texture, index based -- create texture, total pixels >= number of neurons
-# bpy.ops.image.new(name="untitled", width=1024, height=1024, color=(0.0, 0.0, 0.0, 1.0), alpha=True, uv_test_grid=False, float=False)
-imageColors = bpy.data.images.new(name='NeuronsColors', width=len(allNeurons), height=1, alpha=True)
-ImageTextureNode = NeuralMaterial.node_tree.nodes["Image Texture"]
-ImageTextureNode.image = imageColors
+#------ RENDER BACKEND: blender (Cycles) or numpy (headless point splatting) ------------------
+if RENDER_BACKEND == 'blender':
+    import blender_backend
+    renderer = blender_backend.BlenderRenderer(TOTAL_FRAMES, RESOLUTION_SCALE, cfg.TEXTURE_ATLAS_TILE_ROWS)
+    #the scene with mesh, particles, materials & legend is built once for this data & config and opened by all tasks
+    sceneFile = None
+    if cfg.SCENE_CACHE:
+        sceneFile = blender_backend.GetSceneCacheFile(targetDirectory, DATA_KEY,
+                                                      [path.join(SOURCE_PATH, "config.py"), path.join(SOURCE_PATH, cfg.BASE_SCENE_FILE)])
+    if sceneFile is not None and path.isfile(sceneFile) and not BUILD_SCENE:
+        print('cached scene:', sceneFile)
+        with metrics.Phase('particles'):
+            renderer.OpenCachedScene(sceneFile, neuronGroups, particlePositions)
+    else:
+        with metrics.Phase('materials'):
+            renderer.OpenScene(cfg.BASE_SCENE_FILE)
+            renderer.CreateMaterials(neuronGroups)
+            if cfg.DRAW_LEGEND == True:
+                renderer.CreateLegend(neuronGroups)
+        with metrics.Phase('particles'):
+            renderer.CreateNeurons(particlePositions, SIZE, EMISSION)   # create vertices & particle system to visualize non spiked neurons
+        if sceneFile is not None:
+            with metrics.Phase('save'):
+                renderer.SaveScene(sceneFile)
+    if BUILD_SCENE:
+        sys.exit()
+    #draw legend if needed
+    if cfg.DRAW_LEGEND == True and nodeIndex == 1:
+        with metrics.Phase('legend'):
+            renderer.RenderLegend(path.join(SOURCE_PATH, outputRenderPath, "_legend_" + str(1).zfill(4) + ".png"),
+                                  path.join(SOURCE_PATH, outputRenderPath, cfg.OUT_LEGEND_FILE))
+elif RENDER_BACKEND == 'numpy':
+    camera = splat_renderer.Camera(cfg.CAMERA_LOCATION, cfg.CAMERA_ROTATION, cfg.CAMERA_TYPE, cfg.CAMERA_ORTHO_SCALE, cfg.CAMERA_LENS, cfg.CAMERA_SENSOR_WIDTH)
+    renderer = splat_renderer.SplatRenderer(camera, cfg.SPLAT_RESOLUTION, RESOLUTION_SCALE, EMISSION, cfg.SPLAT_OBJECT_RADIUS)
+    with metrics.Phase('particles'):
+        renderer.CreateNeurons(particlePositions, SIZE, EMISSION)
+else:
+    sys.exit('unknown RENDER_BACKEND: ' + str(RENDER_BACKEND))
+
+#population activity next to the 3D view - from the spike histograms of the prepared data, not the neuron lists
+overlay = None
+if cfg.ACTIVITY_OVERLAY and SKIP_RENDER == False:
+    overlay = activity_overlay.ActivityOverlay(prepared.typeActivity, neuronGroups, cfg.ACTIVITY_WINDOW,
+                                               cfg.ACTIVITY_OVERLAY_SIZE[0] * RESOLUTION_SCALE / 100, cfg.ACTIVITY_OVERLAY_SIZE[1] * RESOLUTION_SCALE / 100)
+    overlayX, overlayY = activity_overlay.ParsePosition(cfg.ACTIVITY_OVERLAY_POSITION)      # segments: drawn into the frames here
+    overlayX, overlayY = int(overlayX * RESOLUTION_SCALE / 100), int(overlayY * RESOLUTION_SCALE / 100)
+    print(overlay)
+
+#frames looking like an earlier frame of this task (same spikes, glow & camera) are filled from that frame, not rendered
+duplicates = {}
+if cfg.DEDUP_FRAMES and SKIP_RENDER == False:
+    with metrics.Phase('signatures'):
+        if USE_MANIFEST and cfg.OUTPUT_MODE != 'segments':
+            taskFrames = set(FRAME_LIST)                # the scheduler put duplicates with their canonical frame, it knows no scene
+            duplicates = dict((nFrame, canonical) for nFrame, canonical in scheduler.GetDuplicates(manifest).items()
+                              if nFrame in taskFrames and renderer.GetFrameStateKey(nFrame) == renderer.GetFrameStateKey(canonical))
+        else:
+            duplicates = frame_dedup.FindDuplicates(frameIndex, FRAME_LIST, frame_dedup.GetSignatureLength(frameIndex, cfg), renderer.GetFrameStateKey)
+    print('duplicate frames:', len(duplicates), 'of', len(FRAME_LIST))
 
 #==============================================================================
 
@@ -514,19 +265,14 @@ ImageTextureNode.image = imageColors
 
 #==============================================================================
 
-def UpdateSpikedNeuronsForFrame(localPixels, neuronSizes, nFrame, imageColors, allNeurons, neuronsSpiked):
-    for index, neuron in enumerate(allNeurons):
-        (r,g,b) = neuron.neuronType.color
-        color = (r, g, b, BASE_ALPHA)
-        neuronSizes[index] = SIZE
-        #if spiked then - recolor with aplha and update particle size:
-        if neuron in neuronsSpiked:
-            color = (r, g, b, SPIKE_ALPHA)
-            neuronSizes[index] = SIZE_SPIKE        
-        #pixel value is rgba, so we offsetting by 4 and write sequentially r,g,b,a values:
-        for n in range(0, 4):
-            localPixels[index * 4 + n] = color[n]   
-    imageColors.pixels = localPixels[:]
+def UpdateSpikedNeuronsForFrame(frameBuffers, nFrame, renderer, neuronsSpiked, afterglow = None):
+    with metrics.Phase('update', nFrame):
+        if afterglow is not None:
+            rows, factors = afterglow.Advance(nFrame)       # neurons still fading from earlier spikes, incl. this frame spikes
+            frameBuffers.UpdateGlowing(rows, factors)
+        else:
+            frameBuffers.Update(neuronsSpiked)              # only rows of the last & this frame spikes are touched
+        renderer.UpdateFrame(nFrame, frameBuffers)          # pixels rgba & particle sizes - contiguous float32 buffers
     
 #==============================================================================
 
@@ -539,53 +285,116 @@ def UpdateSpikedNeuronsForFrame(localPixels, neuronSizes, nFrame, imageColors, a
 
 
 #==============================================================================
-# movie resolution 
-scene = bpy.context.scene
-scene.render.resolution_percentage = RESOLUTION_SCALE #50 # 100 for 1920x1080
-
-localPixels = np.array(imageColors.pixels[:])
-neuronSizes = np.array([0]*len(allNeurons), dtype='float')
+#base color (type color, BASE_ALPHA) & size of every neuron - computed once
+frameBuffers = frame_buffer.FrameBuffers(TYPE_COLORS, neuronTable.typeCodes, BASE_ALPHA, SPIKE_ALPHA, SIZE, SIZE_SPIKE, cfg.DELTA_UPDATES)
+if voxelLOD is not None:
+    frameBuffers = lod.LODBuffers(voxelLOD, frameBuffers, neuronTable.positions, len(particlePositions) - len(voxelLOD))
+afterglow = None
+if cfg.AFTERGLOW:
+    afterglow = frame_buffer.Afterglow(frameIndex, TOTAL_NEURONS, cfg.AFTERGLOW_DECAY, BASE_ALPHA, SPIKE_ALPHA, cfg.AFTERGLOW_MIN_ALPHA)
 
 if SKIP_RENDER == False:
     print("----start render frames------")
 
-timeFrame = TIME_LIST[renderFrom]
-
-for nFrame in range(renderFrom, TOTAL_FRAMES, renderStep):                  # frame is actual blender related frame, frame which will be rendered 
-    
-    if nFrame >= renderFrom and nFrame <= renderTo:                         # if within render range - then compute spiked neurons and render:
-        timeFrame = TIME_LIST[nFrame]                                       # get the value of timeStep
-        neuronsSpiked = [n for n in allNeurons if n.IsSpiked(timeFrame)]    # get spikes - for this time step
-        
-        UpdateSpikedNeuronsForFrame(localPixels, neuronSizes, nFrame, imageColors, allNeurons, neuronsSpiked) 
-        ParticleSystem.seed+=1
-        ParticleSystem.seed-=1      
-
-        ParticleSystem.particles.foreach_set("location", neuronLocations)
-        ParticleSystem.particles.foreach_set("size", neuronSizes) 
-
-        bpy.context.scene.frame_current = nFrame + 2 #IMPORTANT make sure we never render <= 1 frame, because frame 1 is broken for particles
-        scene.update() 
-         
-        if SKIP_RENDER == False:
-            outputFile = path.join(SOURCE_PATH, outputRenderPath, "render-frames", "render_" + str(nFrame).zfill(4) + ".png")
-            scene.render.filepath = outputFile                                  # update render output path
-            bpy.ops.render.render( write_still = True )
-            print(timeFrame,nFrame)
+timings = []                                                                # (frame, seconds, linked) - calibrates the scheduler cost model
+
+#finished frames are recorded per task, with the key of data & config they were rendered with
+framesDirectory = path.join(SOURCE_PATH, outputRenderPath, "render-frames")
+renderKeyFiles = [path.join(SOURCE_PATH, "config.py")]
+if RENDER_BACKEND == 'blender':
+    renderKeyFiles.append(path.join(SOURCE_PATH, cfg.BASE_SCENE_FILE))
+framesManifest = frame_manifest.FrameManifest(framesDirectory, nodeIndex, frame_manifest.RenderKey(DATA_KEY, renderKeyFiles))
+if RESUME:
+    framesManifest.Load()
+
+#updates & renders frame nFrame: to outputFile (png) or returned as rgba (outputFile None)
+def RenderSpikedFrame(nFrame, outputFile=None):
+    UpdateSpikedNeuronsForFrame(frameBuffers, nFrame, renderer, frameIndex.GetSpiking(nFrame), afterglow)
+    with metrics.Phase('render', nFrame):
+        rgba = renderer.RenderFrame() if outputFile is None else renderer.Render(outputFile)
+    print(TIME_LIST[nFrame], nFrame)
+    return rgba
+
+
+def WriteOverlayFile(nFrame):
+    if overlay is not None:
+        with metrics.Phase('overlay', nFrame):
+            overlay.Write(nFrame, path.join(framesDirectory, "overlay_" + str(nFrame).zfill(4) + ".png"))
+
+
+if cfg.OUTPUT_MODE == 'segments' and SKIP_RENDER == False:
+    #frames are piped into ffmpeg, one movie segment per contiguous chunk of frames (segment_encoder.py joins them)
+    segmentsDirectory = segment_encoder.GetSegmentsDir(targetDirectory)
+    keptFrames = {}                                                         # canonical frame -> rgba, while it has duplicates to come
+    pendingDuplicates = collections.Counter(duplicates.values())
+    for chunk in segment_encoder.SplitContiguous(FRAME_LIST):
+        segmentFile = segment_encoder.GetSegmentFile(segmentsDirectory, chunk[0], chunk[-1])
+        segment_encoder.RemoveStaleSegments(segmentsDirectory, chunk[0], chunk[-1])     # other bounds (earlier schedule) - frames twice in the movie
+        if RESUME and path.isfile(segmentFile):
+            continue                                                        # segments are renamed into place when complete
+        encoder = segment_encoder.SegmentEncoder(segmentFile, cfg.MOVIE_FRAMERATE, cfg.FFMPEG_PATH)
+        for nFrame in chunk:
+            timeStart = time.time()                                         # the whole frame is timed for the scheduler, written frames & linked ones
+            canonical = duplicates.get(nFrame)
+            linked = canonical in keptFrames
+            if linked:
+                with metrics.Phase('dedup', nFrame):
+                    rgba = keptFrames[canonical].copy()
+                    pendingDuplicates[canonical] -= 1
+                    if pendingDuplicates[canonical] == 0:
+                        del keptFrames[canonical]
+                print(TIME_LIST[nFrame], nFrame, '= frame', canonical)
+            else:
+                rgba = RenderSpikedFrame(nFrame)
+                if pendingDuplicates[nFrame] > 0 and len(keptFrames) < cfg.DEDUP_KEEP_FRAMES:
+                    keptFrames[nFrame] = rgba.copy()                        # before the overlay - it differs per frame
+            if overlay is not None:
+                with metrics.Phase('overlay', nFrame):
+                    overlay.Composite(rgba, nFrame, overlayX, overlayY)
+            encoder.Write(rgba)
+            timings.append((nFrame, time.time() - timeStart, linked))
+        encoder.Close()
+        print('segment:', segmentFile)
+elif SKIP_RENDER == False:
+    framesDone = set()                                                          # frames with their png in place - canonical frames of duplicates
+    for nFrame in FRAME_LIST:                                                   # frame is actual blender related frame, frame which will be rendered 
+        timeFrame = TIME_LIST[nFrame]                                           # get the value of timeStep
+        outputFile = path.join(framesDirectory, "render_" + str(nFrame).zfill(4) + ".png")
+        if RESUME and framesManifest.IsDone(nFrame, outputFile):
+            framesDone.add(nFrame)
+            continue                                                            # rendered before, file verified - afterglow seeks to the next frame
+        timeStart = time.time()                                                 # the whole frame is timed for the scheduler, rendered frames & linked ones
+        tmpFile = frame_manifest.GetTempFile(outputFile)                        # a killed task never leaves a truncated png
+        canonical = duplicates.get(nFrame)
+        if canonical in framesDone:                                             # same picture as an earlier frame: a hardlink of its png
+            with metrics.Phase('dedup', nFrame):
+                frame_dedup.LinkFrame(path.join(framesDirectory, "render_" + str(canonical).zfill(4) + ".png"), tmpFile)
+            print(timeFrame, nFrame, '= frame', canonical)
         else:
-            break
+            canonical = None
+            RenderSpikedFrame(nFrame, tmpFile)
+        WriteOverlayFile(nFrame)
+        framesManifest.Commit(nFrame, timeFrame, tmpFile, outputFile, canonical)
+        timings.append((nFrame, time.time() - timeStart, canonical is not None))
+        framesDone.add(nFrame)
+elif len(FRAME_LIST):
+    UpdateSpikedNeuronsForFrame(frameBuffers, FRAME_LIST[0], renderer, frameIndex.GetSpiking(FRAME_LIST[0]), afterglow)   # positions only: first frame, no render
+
+if len(timings):
+    scheduler.WriteTimings(targetDirectory, nodeIndex, timings, scheduler.TimingsKey(prepared.meta, cfg))
 
 if nodeIndex == 1:  # for the first now - save the file for debug (it won's save the spikes - they are created per frame basis) 
-    imageColors.filepath_raw =  path.join(SOURCE_PATH, outputRenderPath, "spikes-map-debug-only.bmp")
-    imageColors.file_format = 'BMP'
-    imageColors.save()
-    #Save the blend file for debugging:
-    if SKIP_RENDER == False: 
-        bpy.ops.wm.save_as_mainfile( filepath = path.join(SOURCE_PATH, outputRenderPath, cfg.OUT_NEURONS_FILE))
-    else:
-        bpy.ops.wm.save_as_mainfile( filepath = path.join(SOURCE_PATH, outputRenderPath, cfg.OUT_POSITIONS_FILE))
+    with metrics.Phase('save'):
+        if SKIP_RENDER == False: 
+            renderer.SaveDebug(path.join(SOURCE_PATH, outputRenderPath), cfg.OUT_NEURONS_FILE)
+        else:
+            renderer.SaveDebug(path.join(SOURCE_PATH, outputRenderPath), cfg.OUT_POSITIONS_FILE)
+
+print('metrics:', metrics.TASK.Write(targetDirectory))
 
 #---------------------------------------------------------------------------------
 #when all finished - in the dependent slurm job - run:
 #ffmpeg -framerate 30 -i render/render_%04d.png -i render/render_legend_0001.png -filter_complex "[0:v][1:v] overlay=1600:0" -c:v libx264  out1000-30fps.mp4 -y
 # to overlay the legend and to render frames to the video file
+#with ACTIVITY_OVERLAY add the overlay frames too:
+#ffmpeg -framerate 30 -i render/render_%04d.png -framerate 30 -i render/overlay_%04d.png -filter_complex "[0:v][1:v] overlay=0:810" -c:v libx264 out1000-30fps.mp4 -y
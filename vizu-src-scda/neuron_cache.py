@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+#Columnar binary cache of the neuron text data (positions, types, E/I state, spikes)
+#--------------------------------------------------------------------------
+#
+# The text tree is parsed once and written as plain .npy columns, which the
+# render tasks memory-map instead of reading the .txt files again:
+#
+#   ids.npy          int32    neuron id
+#   positions.npy    float32  (N,3) x y z
+#   types.npy        uint16   index into meta['types']
+#   states.npy       uint8    STATE_CODES of the E/I column
+#   spike_neuron.npy int32    row of the neuron in the columns above
+#   spike_time.npy   float64  spike time, all spikes sorted by time
+#   meta.json        groups, types (with their row ranges) and the source signature
+# selection (selection.py): only the selected type files are parsed, neurons outside of box / id range dropped with
+# their spikes - the cache of a selection is '<cacheDir>-select-<hash>', meta 'selection' holds it
+# withSpikes=False: spike columns stay empty (meta 'spikes': false) - spikes are streamed from the
+# text files instead (spike_stream.py, SPIKE_STREAMING), for simulations with more spikes than memory
+#
+# can be run standalone (outside of blender) to build the cache ahead of time:
+#   python neuron_cache.py ../1M_test [cacheDir] [processes]
+#
+# with processes > 1 the type files are parsed by a process pool: a worker saves its arrays as .npy
+# into shared memory (/dev/shm, tmpfs) and returns only their names, the parent memory-maps them
+# and merges in the order of the sources - rows, type codes & colors don't depend on the worker timing.
+#
+# the cache directory is a symlink to its current version '<cacheDir>.v-<time>-<pid>': a new version is written
+# beside it and the link is swapped in one step (PublishDirectory) - a task opening the cache meanwhile finds the old or
+# the new version, never none or half of one.
+
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from os import path, listdir, stat, getpid, makedirs, cpu_count, symlink, replace
+
+import numpy as np
+
+from neuron_table import JoinSpikes
+
+
+CACHE_VERSION = 2
+SPIKES = 'spikes'
+STATE_CODES = {'E': 0, 'I': 1}
+META_FILE = 'meta.json'
+SHARED_MEMORY_DIR = '/dev/shm'
+VERSION_INFIX = '.v-'
+SPIKE_LINE_BYTES = 24          #about the size of a spike line - readlines size hint
+PARSE_CHUNK_LINES = 1000000    #spike lines parsed at once - spikes of dropped neurons never all sit in memory
+TYPE_COLUMNS = ('ids', 'positions', 'states', 'spike_rows', 'spike_times')
+
+#==============================================================================
+
+#returns default cache directory for the data directory - sits next to the data, not inside (inside it would be scanned as a neuron group)
+def DefaultCacheDir(dataPath):
+    return path.normpath(dataPath) + '-cache'
+
+
+#returns cache directory of a selection - the subsets don't overwrite each other's (or the full) cache
+def SelectionCacheDir(cacheDir, selection):
+    if selection is None or selection.IsEmpty():
+        return cacheDir
+    return path.normpath(cacheDir) + '-select-' + selection.GetSignature()
+
+#==============================================================================
+
+#returns list of (groupName, typeName, neuronsFile, spikesFile) sorted by group & file name (type codes, colors & rows
+#don't depend on the file system order), of the selected groups & types only if selection is given
+def ScanSources(dataPath, selection=None):
+    sources = []
+    for groupName in sorted(listdir(dataPath)):
+        pathGroup = path.join(dataPath, groupName)
+        if groupName == SPIKES or not path.isdir(pathGroup):
+            continue
+        for file in sorted(listdir(pathGroup)):
+            if file.endswith('.txt'):
+                typeName = file.split('.')[0]
+                spikesFile = path.join(pathGroup, SPIKES, typeName + '_' + SPIKES + '.txt')
+                sources.append((groupName, typeName, path.join(pathGroup, file), spikesFile))
+    if selection is not None:
+        selected = selection.SelectSources(sources)
+        if len(sources) and len(selected) == 0:
+            sys.exit('selection matches no neuron types: ' + selection.GetFlags() + ' (or SELECT_* in config.py) - groups: ' +
+                     ', '.join(sorted(set(source[0] for source in sources))) + ', a type name goes to --types')
+        return selected
+    return sources
+
+#==============================================================================
+
+#returns new empty directory for the next version of linkPath - nothing refers to it until PublishDirectory
+def NewVersionDir(linkPath):
+    versionDir = path.normpath(linkPath) + VERSION_INFIX + str(int(time.time() * 1000)) + '-' + str(getpid())
+    makedirs(versionDir)
+    return versionDir
+
+
+#points linkPath (symlink) at versionDir in one step (rename of a new link over the old one), removes the complete
+#versions but this one & the one replaced (a reader may be opening that one) - versions being written have no META_FILE yet
+def PublishDirectory(versionDir, linkPath):
+    linkPath = path.normpath(linkPath)
+    if path.isdir(linkPath) and not path.islink(linkPath):
+        shutil.rmtree(linkPath, ignore_errors=True)     #plain directory of an older version of this code
+    keep = [path.basename(versionDir)]
+    if path.islink(linkPath):
+        keep.append(path.basename(path.realpath(linkPath)))
+    tmpLink = linkPath + '.link-' + str(getpid())
+    symlink(path.basename(versionDir), tmpLink)
+    replace(tmpLink, linkPath)
+    parentDir = path.dirname(linkPath) or '.'
+    prefix = path.basename(linkPath) + VERSION_INFIX
+    for name in listdir(parentDir):
+        if name.startswith(prefix) and name not in keep and path.isfile(path.join(parentDir, name, META_FILE)):
+            shutil.rmtree(path.join(parentDir, name), ignore_errors=True)
+
+#==============================================================================
+
+def FileHash(filePath):
+    h = hashlib.sha1()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+#returns signature of one source file: size & mtime, hash only if asked (it reads the whole file)
+def FileSignature(filePath, withHash):
+    if not path.isfile(filePath):
+        return None
+    st = stat(filePath)
+    signature = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if withHash:
+        signature['sha1'] = FileHash(filePath)
+    return signature
+
+
+def SourcesSignature(sources, withHash):
+    signature = []
+    for (groupName, typeName, neuronsFile, spikesFile) in sources:
+        signature.append({'group': groupName,
+                          'type': typeName,
+                          'neurons': FileSignature(neuronsFile, withHash),
+                          'spikes': FileSignature(spikesFile, withHash)})
+    return signature
+
+#==============================================================================
+
+#returns ids, positions, states of one neuron type file: "id x y z E|I" per line
+def parseNeuronFile(filePath):
+    with open(filePath, 'r') as f:
+        data = f.read().split()
+    data = np.array(data, dtype=object).reshape(-1, 5)
+    ids = data[:, 0].astype(np.float64)
+    if np.any(ids != np.rint(ids)):
+        raise ValueError('neuron ids must be whole numbers: ' + filePath)    #spikes of fractional ids are dropped (ParseSpikeLines)
+    ids = ids.astype(np.int32)
+    positions = data[:, 1:4].astype(np.float64).astype(np.float32)
+    states = np.array([STATE_CODES.get(s, 0) for s in data[:, 4]], dtype=np.uint8)
+    return ids, positions, states
+
+
+#returns neuron ids, spike times of "id time" lines - as the text reader matched them: a line without exactly
+#two fields is skipped, an id that is not a whole number is no neuron's id (the spike is dropped, never rounded)
+def ParseSpikeLines(lines):
+    tokens = ''.join(lines).split() if all(line.count(' ') == 1 for line in lines) else []     #np.fromstring(sep=' ') is deprecated
+    if len(lines) and len(tokens) == 2 * len(lines):
+        data = np.array(tokens, dtype=np.float64).reshape(-1, 2)
+    else:                                   #malformed lines - field by field, line by line
+        fields = [parts for parts in (line.split(' ') for line in lines) if len(parts) == 2]
+        data = np.array(fields, dtype=np.float64).reshape(-1, 2)
+    whole = data[:, 0] == np.rint(data[:, 0])
+    return data[whole, 0].astype(np.int32), data[whole, 1]
+
+
+#yields (ids, times) of about chunkLines lines of a spike file at a time (ParseSpikeLines) - missing file (or None) yields nothing
+def ReadSpikeChunks(filePath, chunkLines):
+    if filePath is None or not path.isfile(filePath):
+        return
+    with open(filePath, 'r') as f:
+        while True:
+            lines = f.readlines(chunkLines * SPIKE_LINE_BYTES)   #size hint - whole lines only
+            if not lines:
+                break
+            yield ParseSpikeLines(lines)
+
+
+#returns rows in ids, spike times of one spike file: "id time" per line, missing file (or None) - no spikes
+#read in chunks of about chunkLines lines, spikes of neurons not in ids (unknown, not selected) are dropped per chunk
+def parseSpikeFile(filePath, ids, chunkLines=PARSE_CHUNK_LINES):
+    rows = [np.zeros(0, dtype=np.int32)]
+    times = [np.zeros(0, dtype=np.float64)]
+    for (chunkIDs, chunkTimes) in ReadSpikeChunks(filePath, chunkLines):
+        chunkRows = JoinSpikes(ids, chunkIDs)
+        valid = chunkRows >= 0
+        rows.append(chunkRows[valid])
+        times.append(chunkTimes[valid])
+    return np.concatenate(rows).astype(np.int32), np.concatenate(times)
+
+#==============================================================================
+
+#returns columns of one type: ids, positions, states & its spikes - rows within the type (unknown neurons dropped), times
+#selection: neurons outside of its box / id range are dropped, and so their spikes
+def ParseType(neuronsFile, spikesFile, selection=None):
+    tIDs, tPositions, tStates = parseNeuronFile(neuronsFile)
+    mask = selection.NeuronMask(tIDs, tPositions) if selection is not None else None
+    if mask is not None:
+        tIDs, tPositions, tStates = tIDs[mask], tPositions[mask], tStates[mask]
+    sRows, sTimes = parseSpikeFile(spikesFile, tIDs)
+    return tIDs, tPositions, tStates, sRows, sTimes
+
+
+#pool worker: parses one type, columns go to sharedDir as <index>_<column>.npy - nothing big is pickled
+def parseTypeToShared(task):
+    (index, neuronsFile, spikesFile, selection, sharedDir) = task
+    columns = ParseType(neuronsFile, spikesFile, selection)
+    for name, column in zip(TYPE_COLUMNS, columns):
+        np.save(path.join(sharedDir, str(index) + '_' + name + '.npy'), column)
+    return index
+
+
+#returns columns of every source, in source order: parsed by a pool of processes, memory-mapped from shared memory
+def parseTypesParallel(sources, processes, sharedDir, selection):
+    sizes = [path.getsize(neuronsFile) + (path.getsize(spikesFile) if spikesFile is not None and path.isfile(spikesFile) else 0)
+             for (groupName, typeName, neuronsFile, spikesFile) in sources]
+    tasks = [(i, sources[i][2], sources[i][3], selection, sharedDir) for i in sorted(range(len(sources)), key=lambda i: -sizes[i])]  #biggest first
+    pool = multiprocessing.Pool(processes)
+    try:
+        for index in pool.imap_unordered(parseTypeToShared, tasks):
+            print(sources[index][1])
+    finally:
+        pool.close()
+        pool.join()
+    return [tuple(np.load(path.join(sharedDir, str(i) + '_' + name + '.npy'), mmap_mode='r') for name in TYPE_COLUMNS)
+            for i in range(len(sources))]
+
+
+#processes: 1 - parse here, one type after the other, 0 - one process per cpu
+def WriteCache(dataPath, cacheDir, withHash=False, processes=1, withSpikes=True, selection=None):
+    sources = ScanSources(dataPath, selection)
+    parseSources = sources if withSpikes else [(g, t, neuronsFile, None) for (g, t, neuronsFile, spikesFile) in sources]
+    processes = processes or cpu_count() or 1
+    sharedDir = None
+    if processes > 1 and len(sources) > 1:
+        sharedDir = tempfile.mkdtemp(prefix='neuron-cache-', dir=SHARED_MEMORY_DIR if path.isdir(SHARED_MEMORY_DIR) else None)
+    try:
+        if sharedDir is not None:
+            parsed = parseTypesParallel(parseSources, min(processes, len(sources)), sharedDir, selection)
+        else:
+            parsed = None
+        writeCache(dataPath, cacheDir, withHash, sources, parseSources, parsed, selection)
+    finally:
+        if sharedDir is not None:
+            shutil.rmtree(sharedDir, ignore_errors=True)
+
+
+#merges the types in source order & writes the cache, parsed: columns of every source or None (parse now)
+def writeCache(dataPath, cacheDir, withHash, sources, parseSources, parsed, selection):
+    groups = []
+    types = []
+    ids, positions, states, typeCodes = [], [], [], []
+    spikeRows, spikeTimes = [], []
+    row = 0
+    for code, (groupName, typeName, neuronsFile, spikesFile) in enumerate(parseSources):
+        if groupName not in groups:
+            groups.append(groupName)
+        if parsed is None:
+            print(typeName)
+            tIDs, tPositions, tStates, sRows, sTimes = ParseType(neuronsFile, spikesFile, selection)
+        else:
+            tIDs, tPositions, tStates, sRows, sTimes = parsed[code]
+
+        types.append({'name': typeName, 'group': groupName, 'start': row, 'end': row + len(tIDs)})
+        ids.append(tIDs)
+        positions.append(tPositions)
+        states.append(tStates)
+        typeCodes.append(np.full(len(tIDs), code, dtype=np.uint16))
+        spikeRows.append(sRows + np.int32(row))
+        spikeTimes.append(sTimes)
+        row += len(tIDs)
+
+    spikeRows = np.concatenate(spikeRows) if spikeRows else np.zeros(0, dtype=np.int32)
+    spikeTimes = np.concatenate(spikeTimes) if spikeTimes else np.zeros(0, dtype=np.float64)
+    order = np.argsort(spikeTimes, kind='mergesort')   #stable - same time keeps file order
+
+    columns = {
+        'ids': np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32),
+        'positions': np.concatenate(positions) if positions else np.zeros((0, 3), dtype=np.float32),
+        'types': np.concatenate(typeCodes) if typeCodes else np.zeros(0, dtype=np.uint16),
+        'states': np.concatenate(states) if states else np.zeros(0, dtype=np.uint8),
+        'spike_neuron': spikeRows[order],
+        'spike_time': spikeTimes[order],
+    }
+    meta = {'version': CACHE_VERSION,
+            'groups': groups,
+            'types': types,
+            'spikes': parseSources is sources,
+            'selection': selection.GetKey() if selection is not None else None,
+            'sources': SourcesSignature(sources, withHash)}
+
+    #write a new version, several tasks may build the same cache at the same time - the last one published is used
+    versionDir = NewVersionDir(cacheDir)
+    try:
+        for name, column in columns.items():
+            np.save(path.join(versionDir, name + '.npy'), column)
+        WriteJSON(path.join(versionDir, META_FILE), meta)
+    except BaseException:                   #a full disk, an interrupt - no half written version left behind
+        shutil.rmtree(versionDir, ignore_errors=True)
+        raise
+    PublishDirectory(versionDir, cacheDir)
+
+#==============================================================================
+
+#writes value to a temporary file beside filePath and renames it into place - a reader finds the old or the new file, never half of one
+def WriteJSON(filePath, value):
+    tmpFile = filePath + '.tmp-' + str(getpid())
+    with open(tmpFile, 'w') as f:
+        json.dump(value, f)
+    replace(tmpFile, filePath)
+
+
+def readMeta(cacheDir):
+    metaFile = path.join(cacheDir, META_FILE)
+    if not path.isfile(metaFile):
+        return None
+    with open(metaFile, 'r') as f:
+        return json.load(f)
+
+
+def sameFile(now, before):
+    if now is None or before is None:
+        return now is before
+    return now['size'] == before['size'] and now['mtime'] == before['mtime']
+
+
+#returns True if the cache matches the data: same files with same size & mtime,
+#if only mtimes differ (e.g. data copied to the cluster) and withHash - compares sha1 of the files instead
+def IsCacheFresh(dataPath, cacheDir, withHash=False, withSpikes=True, selection=None):
+    meta = readMeta(cacheDir)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    if withSpikes and not meta.get('spikes', True):
+        return False
+    if meta.get('selection') != (selection.GetKey() if selection is not None else None):
+        return False
+    sources = ScanSources(dataPath, selection)
+    current = SourcesSignature(sources, False)
+    cached = meta['sources']
+    if [(s['group'], s['type']) for s in current] != [(s['group'], s['type']) for s in cached]:
+        return False
+    touched = False
+    for source, now, before in zip(sources, current, cached):
+        for key, filePath in (('neurons', source[2]), ('spikes', source[3])):
+            if sameFile(now[key], before[key]):
+                continue
+            if not withHash or now[key] is None or before[key] is None or 'sha1' not in before[key]:
+                return False
+            if now[key]['size'] != before[key]['size'] or FileHash(filePath) != before[key]['sha1']:
+                return False
+            before[key]['mtime'] = now[key]['mtime']    #same content - remember the new mtime, no hashing next time
+            touched = True
+    if touched:
+        try:
+            WriteJSON(path.join(cacheDir, META_FILE), meta)    #other tasks may be reading it
+        except OSError:
+            pass
+    return True
+
+#==============================================================================
+
+#memory-mapped columns of the cache
+class NeuronStore():
+    def __init__(self, cacheDir):
+        cacheDir = path.realpath(cacheDir)      #one version for all columns, even if a new one is published meanwhile
+        meta = readMeta(cacheDir)
+        self.groups = meta['groups']
+        self.types = meta['types']
+        self.ids = np.load(path.join(cacheDir, 'ids.npy'), mmap_mode='r')
+        self.positions = np.load(path.join(cacheDir, 'positions.npy'), mmap_mode='r')
+        self.typeCodes = np.load(path.join(cacheDir, 'types.npy'), mmap_mode='r')
+        self.states = np.load(path.join(cacheDir, 'states.npy'), mmap_mode='r')
+        self.spikeNeurons = np.load(path.join(cacheDir, 'spike_neuron.npy'), mmap_mode='r')
+        self.spikeTimes = np.load(path.join(cacheDir, 'spike_time.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return 'NeuronStore ' + str(len(self.ids)) + ' neurons, ' + str(len(self.spikeTimes)) + ' spikes'
+
+
+#returns NeuronStore for the data, (re)builds the cache only if the data changed
+def OpenStore(dataPath, cacheDir=None, withHash=False, processes=1, withSpikes=True, selection=None):
+    if not cacheDir:
+        cacheDir = DefaultCacheDir(dataPath)
+    cacheDir = SelectionCacheDir(cacheDir, selection)
+    if not IsCacheFresh(dataPath, cacheDir, withHash, withSpikes, selection):
+        print('building neuron cache:', cacheDir)
+        WriteCache(dataPath, cacheDir, withHash, processes, withSpikes, selection)
+    return NeuronStore(cacheDir)
+
+#==============================================================================
+
+if __name__ == '__main__':
+    dataPath = sys.argv[1]
+    cacheDir = sys.argv[2] if len(sys.argv) > 2 else DefaultCacheDir(dataPath)
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    WriteCache(dataPath, cacheDir, withHash=True, processes=processes)
+    print(NeuronStore(cacheDir))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#Neuron groups & types of a NeuronTable - names, row ranges & colors for materials and the legend
+#--------------------------------------------------------------------------
+
+#==============================================================================
+
+#neuron type - rows [start, end) of the NeuronTable  ---------------------------
+class NeuronType():
+    def __init__(self, typeName, neuronGroup, code, start, end):
+        self.name = typeName
+        self.neuronGroup = neuronGroup
+        self.code = code            #type code in NeuronTable.typeCodes
+        self.start = start
+        self.end = end
+        self.color = (0,0,0)
+    
+    def __repr__(self):
+        return self.name + ' [' + str(self.start) + ':' + str(self.end) + ']'
+
+
+#group of neuron types   ---------------------------------------------------
+class NeuronGroup():    # BG, M1, S1, TH_M1
+    def __init__(self, groupName):
+        self.name = groupName
+        self.neuronTypes = []
+
+    def __repr__(self):
+        return self.name + ' ' + str(self.neuronTypes)
+
+#==============================================================================
+
+#returns groups with their types, in data order
+def GetNeuronGroups(neuronTable):
+    neuronGroups = []
+    for groupName in neuronTable.groups:
+        neuronGroups.append(NeuronGroup(groupName))
+    for code, typeInfo in enumerate(neuronTable.types):
+        neuronGroup = neuronGroups[neuronTable.groups.index(typeInfo['group'])]
+        neuronGroup.neuronTypes.append(NeuronType(typeInfo['name'], neuronGroup, code, typeInfo['start'], typeInfo['end']))
+    return neuronGroups
+
+
+#color of every type from the color of its type code
+def SetTypeColors(neuronGroups, typeColors):
+    for neuronGroup in neuronGroups:
+        for neuronType in neuronGroup.neuronTypes:
+            neuronType.color = tuple(typeColors[neuronType.code])
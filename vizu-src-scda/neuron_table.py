@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#Struct-of-arrays table of all neurons, replaces one python object per neuron
+#--------------------------------------------------------------------------
+#
+# row i of every column is one neuron:
+#   ids          int32    neuron id from the data files
+#   positions    float32  (N,3) contiguous x y z
+#   typeCodes    uint16   index into types (meta of the neuron_cache)
+#   states       uint8    neuron_cache.STATE_CODES
+# spike trains are CSR-style: spikes of neuron i are
+#   spikeTimes[spikeOffsets[i]:spikeOffsets[i+1]]   (float64, sorted by time)
+# (None when the table comes from the prepared artifact - rendering uses the frame index only)
+
+import numpy as np
+
+
+#==============================================================================
+
+#matches spike neuron ids to table rows - integer join by sort & searchsorted,
+#returns int32 row for each spike, -1 if the id is not in ids
+def JoinSpikes(ids, spikeIds, rowOffset=0):
+    ids = np.asarray(ids)
+    spikeIds = np.asarray(spikeIds)
+    if len(ids) == 0 or len(spikeIds) == 0:
+        return np.full(len(spikeIds), -1, dtype=np.int32)
+    order = np.argsort(ids, kind='mergesort')
+    sortedIDs = ids[order]
+    found = np.searchsorted(sortedIDs, spikeIds)
+    found[found == len(sortedIDs)] = 0
+    matched = sortedIDs[found] == spikeIds
+    rows = np.where(matched, order[found] + rowOffset, -1)
+    return rows.astype(np.int32)
+
+#==============================================================================
+
+class NeuronTable():
+    def __init__(self, ids, positions, typeCodes, states, spikeOffsets, spikeTimes, groups, types):
+        self.ids = ids
+        self.positions = positions
+        self.typeCodes = typeCodes
+        self.states = states
+        self.spikeOffsets = spikeOffsets
+        self.spikeTimes = spikeTimes
+        self.groups = groups        #group names, in data order
+        self.types = types          #dicts: name, group, start, end (row range of the type)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        spikes = str(len(self.spikeTimes)) + ' spikes' if self.spikeTimes is not None else 'no spike trains'
+        return 'NeuronTable ' + str(len(self.ids)) + ' neurons, ' + spikes
+
+    def GetSpikeTimes(self, row):
+        return self.spikeTimes[self.spikeOffsets[row]:self.spikeOffsets[row + 1]]
+
+    #returns row of the neuron for every entry of spikeTimes
+    def GetSpikeRows(self):
+        return np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.spikeOffsets))
+
+    def GetTypeRows(self, typeCode):
+        t = self.types[typeCode]
+        return slice(t['start'], t['end'])
+
+#==============================================================================
+
+#returns NeuronTable with the columns of a neuron_cache.NeuronStore (positions etc. stay memory-mapped)
+#spike trains are regrouped per neuron: stable sort by row keeps them sorted by time
+def FromStore(store):
+    spikeNeurons = np.asarray(store.spikeNeurons)
+    order = np.argsort(spikeNeurons, kind='mergesort')
+    spikeOffsets = np.searchsorted(spikeNeurons[order], np.arange(len(store.ids) + 1)).astype(np.int64)
+    spikeTimes = np.asarray(store.spikeTimes)[order]
+    return NeuronTable(store.ids, store.positions, store.typeCodes, store.states,
+                       spikeOffsets, spikeTimes, store.groups, store.types)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#Prepare stage: everything the render tasks need, computed once for the whole array job
+#--------------------------------------------------------------------------
+#
+# run once (plain python3, see prepare-job.slurm / submit-all.sh), before the render tasks:
+#   python3 prepare.py ../1M_test ../out_1M_test [--groups=TH_M1,M1 ...]
+#
+# writes <output dir>/prepared/ - memory-mapped by every render task:
+#   ids.npy, positions.npy, types.npy, states.npy   neuron columns (NeuronTable)
+#   frame_times.npy, frame_offsets.npy, frame_neurons.npy   frame index (per-frame spike offsets)
+#   type_colors.npy                                  color of each neuron type
+#   type_activity.npy                                spikes of each type in each frame (activity_overlay.py)
+#   meta.json                                        groups, types, frame count, config & data signature
+#
+# a task finding no (or a stale) artifact builds it itself, so single node runs need no extra step
+# 'prepared' is a symlink to the current version, swapped in one step (neuron_cache.PublishDirectory)
+# SELECT_* (or --groups=... flags, selection.py): only the selected subset is parsed & prepared
+# SPIKE_STREAMING: the frame index is built streaming the spike files (spike_stream.py), memory independent of the spike count
+
+import sys
+import json
+import hashlib
+import shutil
+import colorsys as cs
+from os import path, makedirs
+
+import numpy as np
+
+import neuron_cache
+import neuron_table
+import frame_index
+import spike_stream
+import selection
+import activity_overlay
+import metrics
+
+
+PREPARED_DIR = 'prepared'
+PREPARED_VERSION = 3
+META_FILE = 'meta.json'
+
+#==============================================================================
+
+#config values the artifact depends on - a task with other values does not use it
+def ConfigKey(cfg):
+    return {'FRAME_BIN_WIDTH': cfg.FRAME_BIN_WIDTH,
+            'FRAME_TIME_START': cfg.FRAME_TIME_START,
+            'FRAME_TIME_END': cfg.FRAME_TIME_END,
+            'SELECTION': selection.FromConfig(cfg).GetKey()}
+
+
+#signature of the data files (names, sizes, mtimes) - stat only, no reading
+def DataSignature(dataPath):
+    sources = neuron_cache.ScanSources(dataPath)
+    signature = json.dumps(neuron_cache.SourcesSignature(sources, False), sort_keys=True)
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()
+
+
+def GetCacheDir(cfg, sourcePath):
+    return path.join(sourcePath, cfg.CACHE_DIR) if cfg.CACHE_DIR else None
+
+#==============================================================================
+
+#color of each type: hue steps over all types, in data order
+def TypeColors(types):
+    hueStep = 0.9/max(len(types), 1)
+    hue = 0
+    colors = []
+    for t in types:
+        colors.append(cs.hsv_to_rgb(hue,1,1))
+        hue += hueStep
+    return np.array(colors, dtype=np.float32).reshape(-1, 3)
+
+
+#frames: fixed time bins or sorted unique spike times, with the neurons spiking in each frame
+def BuildFrameIndex(store, cfg):
+    if cfg.FRAME_BIN_WIDTH > 0:
+        return frame_index.FromBinnedSpikes(store.spikeNeurons, store.spikeTimes, cfg.FRAME_BIN_WIDTH, cfg.FRAME_TIME_START, cfg.FRAME_TIME_END)
+    return frame_index.FromSpikes(store.spikeNeurons, store.spikeTimes, cfg.FRAME_TIME_START, cfg.FRAME_TIME_END)
+
+#==============================================================================
+
+#writes the artifact into the new version directory tmpDir
+def writeVersion(dataPath, tmpDir, cfg, sourcePath):
+    subset = selection.FromConfig(cfg)
+    with metrics.Phase('parse'):
+        store = neuron_cache.OpenStore(dataPath, GetCacheDir(cfg, sourcePath), cfg.CACHE_HASH_CHECK, cfg.INGEST_PROCESSES,
+                                       withSpikes=not cfg.SPIKE_STREAMING, selection=subset)
+    print(store)
+    with metrics.Phase('index'):
+        if cfg.SPIKE_STREAMING:
+            frameIndex = spike_stream.WriteFrameIndex(store, neuron_cache.ScanSources(dataPath, subset), cfg, tmpDir)
+        else:
+            frameIndex = BuildFrameIndex(store, cfg)
+    print(frameIndex)
+    with metrics.Phase('activity'):
+        typeActivity = activity_overlay.TypeHistograms(frameIndex, store.typeCodes, len(store.types))
+
+    columns = {
+        'ids': store.ids,
+        'positions': store.positions,
+        'types': store.typeCodes,
+        'states': store.states,
+        'frame_times': frameIndex.times,
+        'frame_offsets': frameIndex.offsets,
+        'type_colors': TypeColors(store.types),
+        'type_activity': typeActivity,
+    }
+    meta = {'version': PREPARED_VERSION,
+            'groups': store.groups,
+            'types': store.types,
+            'totalFrames': len(frameIndex),
+            'config': ConfigKey(cfg),
+            'data': DataSignature(dataPath)}
+    if not cfg.SPIKE_STREAMING:
+        columns['frame_neurons'] = frameIndex.neurons     #streamed: written already
+    for name, column in columns.items():
+        np.save(path.join(tmpDir, name + '.npy'), np.asarray(column))
+    neuron_cache.WriteJSON(path.join(tmpDir, META_FILE), meta)
+
+
+def WritePrepared(dataPath, preparedDir, cfg, sourcePath):
+    #write a new version - tasks may open the artifact meanwhile, they get the old one until it is published
+    tmpDir = neuron_cache.NewVersionDir(preparedDir)
+    try:
+        writeVersion(dataPath, tmpDir, cfg, sourcePath)
+    except BaseException:                   #errors, exits & interrupts - no half written version left on the shared file system
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        raise
+    neuron_cache.PublishDirectory(tmpDir, preparedDir)
+
+#==============================================================================
+
+def readMeta(preparedDir):
+    metaFile = path.join(preparedDir, META_FILE)
+    if not path.isfile(metaFile):
+        return None
+    with open(metaFile, 'r') as f:
+        return json.load(f)
+
+
+def IsPreparedFresh(dataPath, preparedDir, cfg):
+    meta = readMeta(preparedDir)
+    if meta is None or meta.get('version') != PREPARED_VERSION:
+        return False
+    return meta['config'] == ConfigKey(cfg) and meta['data'] == DataSignature(dataPath)
+
+
+#memory-mapped artifact: neuronTable (without spike trains - not needed to render), frameIndex, typeColors, typeActivity
+class Prepared():
+    def __init__(self, preparedDir):
+        def load(name):
+            return np.load(path.join(preparedDir, name + '.npy'), mmap_mode='r')
+
+        preparedDir = path.realpath(preparedDir)    #one version for all columns, even if a new one is published meanwhile
+        self.preparedDir = preparedDir
+        self.meta = readMeta(preparedDir)
+        self.neuronTable = neuron_table.NeuronTable(load('ids'), load('positions'), load('types'), load('states'),
+                                                    None, None, self.meta['groups'], self.meta['types'])
+        self.frameIndex = frame_index.FrameIndex(load('frame_times'), load('frame_offsets'), load('frame_neurons'))
+        self.typeColors = load('type_colors')
+        self.typeActivity = load('type_activity')
+
+    def __repr__(self):
+        return 'Prepared ' + self.preparedDir + ' ' + str(len(self.neuronTable)) + ' neurons, ' + str(len(self.frameIndex)) + ' frames'
+
+
+#returns the Prepared artifact of the data in outputDir, builds it if missing or stale
+def OpenPrepared(dataPath, outputDir, cfg, sourcePath):
+    preparedDir = path.join(outputDir, PREPARED_DIR)
+    if not IsPreparedFresh(dataPath, preparedDir, cfg):
+        print('preparing:', preparedDir)
+        WritePrepared(dataPath, preparedDir, cfg, sourcePath)
+    return Prepared(preparedDir)
+
+#==============================================================================
+
+#loads config.py next to this script (same as the visu script does)
+def LoadConfig(sourcePath):
+    import importlib.util
+    configMod = importlib.util.spec_from_file_location("configuration", path.join(sourcePath,"config.py" ))
+    cfg = importlib.util.module_from_spec(configMod)
+    configMod.loader.exec_module(cfg)
+    return cfg
+
+
+if __name__ == '__main__':
+    SOURCE_PATH = path.dirname(path.realpath(__file__))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    ABSOLUTE_PATH = path.join(SOURCE_PATH, args[0])
+    targetDirectory = path.join(SOURCE_PATH, args[1])
+    cfg = selection.ApplyArgs(LoadConfig(SOURCE_PATH), [arg for arg in sys.argv[1:] if arg.startswith('--')])
+    if not path.isdir(targetDirectory):
+        makedirs(targetDirectory)
+    print(OpenPrepared(ABSOLUTE_PATH, targetDirectory, cfg, SOURCE_PATH))   # built only if missing or stale
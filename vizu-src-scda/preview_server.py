@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+#Local preview: asyncio server streaming the spikes frame by frame to a browser, over a WebSocket
+#--------------------------------------------------------------------------
+#
+#   python3 preview_server.py ../1M_test ../out_1M_test [port]     -> open http://127.0.0.1:8765/
+#
+# the prepared data (prepare.py - built if missing) is loaded once and shared by all viewers:
+# - a viewer gets once: meta (json: neurons, frames, type colors, BASE_ALPHA, SIZE, EMISSION, CAMERA_* ... of config.py),
+#   positions (float32 x y z) and type codes (uint16)
+# - then per frame only the delta of the spiking rows to the frame it has: rows on, rows off (uint32)
+# - the page (PAGE below) draws the points like the numpy backend, with inputs for the look & camera values of config.py
+# viewer commands (json text): play, pause, seek (frame - scrubbing), fps (capped at PREVIEW_FPS), step (frames per tick)
+#
+# messages from the server (binary, little endian, 8 byte header so the arrays are aligned):
+#   'P' pad3 uint32 count | float32 x y z * count
+#   'T' pad3 uint32 count | uint16 type code * count
+#   'D' pad3 uint32 frame | float64 time | uint32 on | uint32 off | uint32 rows on | uint32 rows off
+# the WebSocket protocol (RFC 6455) is written here - standard library only, python 3.5 asyncio (asyncio.run where there is one).
+# a malformed command (missing or not a number: frame, value) is ignored, the viewer stays connected.
+
+import sys
+import json
+import math
+import time
+import base64
+import struct
+import hashlib
+import asyncio
+from os import path
+
+import numpy as np
+
+import prepare
+import selection
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC11B65'
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+MAX_MESSAGE = 1 << 16       #commands of a viewer are small
+
+#==============================================================================
+#WebSocket frames: server frames are not masked, client frames are
+
+def encodeFrame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < (1 << 16):
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+#returns (opcode, payload) of the next client frame
+async def readFrame(reader):
+    (first, second) = struct.unpack('!BB', await reader.readexactly(2))
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE:
+        raise ValueError('viewer message too long: ' + str(length))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = (np.frombuffer(payload, dtype=np.uint8) ^ np.resize(np.frombuffer(mask, dtype=np.uint8), length)).tobytes()
+    return opcode, payload
+
+
+def acceptKey(key):
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+#==============================================================================
+
+#everything the viewers get - loaded once, the static messages encoded once
+class PreviewData():
+    def __init__(self, prepared, cfg):
+        self.frameIndex = prepared.frameIndex
+        self.times = np.asarray(prepared.frameIndex.times)
+        table = prepared.neuronTable
+        positions = np.ascontiguousarray(table.positions, dtype='<f4')
+        typeCodes = np.ascontiguousarray(table.typeCodes, dtype='<u2')
+        meta = {'neurons': len(table),
+                'frames': len(self.times),
+                'types': [t['name'] for t in table.types],
+                'typeColors': np.asarray(prepared.typeColors).tolist(),
+                'fps': cfg.PREVIEW_FPS,
+                'resolution': [int(v * cfg.RESOLUTION_SCALE / 100) for v in cfg.SPLAT_RESOLUTION],
+                'config': {'BASE_ALPHA': cfg.BASE_ALPHA, 'SPIKE_ALPHA': cfg.SPIKE_ALPHA, 'EMISSION': cfg.EMISSION,
+                           'SIZE': cfg.SIZE, 'SIZE_SPIKE': cfg.SIZE_SPIKE, 'SPLAT_OBJECT_RADIUS': cfg.SPLAT_OBJECT_RADIUS,
+                           'CAMERA_LOCATION': list(cfg.CAMERA_LOCATION), 'CAMERA_ROTATION': list(cfg.CAMERA_ROTATION),
+                           'CAMERA_TYPE': cfg.CAMERA_TYPE, 'CAMERA_ORTHO_SCALE': cfg.CAMERA_ORTHO_SCALE,
+                           'CAMERA_LENS': cfg.CAMERA_LENS, 'CAMERA_SENSOR_WIDTH': cfg.CAMERA_SENSOR_WIDTH}}
+        self.metaMessage = encodeFrame(OP_TEXT, json.dumps(meta).encode('utf-8'))
+        self.positionsMessage = encodeFrame(OP_BINARY, struct.pack('<B3xI', ord('P'), len(table)) + positions.tobytes())
+        self.typesMessage = encodeFrame(OP_BINARY, struct.pack('<B3xI', ord('T'), len(table)) + typeCodes.tobytes())
+
+    def __len__(self):
+        return len(self.times)
+
+    #returns delta message of frame nFrame to a viewer showing spiking, and the spiking rows of nFrame
+    def GetDelta(self, nFrame, spiking):
+        now = np.unique(np.asarray(self.frameIndex.GetSpiking(nFrame))).astype('<u4')
+        on = np.setdiff1d(now, spiking).astype('<u4')
+        off = np.setdiff1d(spiking, now).astype('<u4')
+        header = struct.pack('<B3xIdII', ord('D'), nFrame, float(self.times[nFrame]), len(on), len(off))
+        return encodeFrame(OP_BINARY, header + on.tobytes() + off.tobytes()), now
+
+#==============================================================================
+
+#one browser: its frame, play state & the spiking rows it has
+class viewer():
+    def __init__(self, data, writer, fpsCap):
+        self.data = data
+        self.writer = writer
+        self.fpsCap = fpsCap
+        self.fps = fpsCap
+        self.step = 1
+        self.frame = 0
+        self.playing = False
+        self.wake = asyncio.Event()
+        self.spiking = np.zeros(0, dtype='<u4')
+        self.closed = False
+        self.sending = asyncio.Lock()           #player & command loop send to one writer - one drain at a time, deltas in order
+
+    async def send(self, message):
+        async with self.sending:
+            self.writer.write(message)
+            await self.writer.drain()
+
+    async def SendFrame(self, nFrame):
+        async with self.sending:
+            self.frame = min(max(int(nFrame), 0), len(self.data) - 1)
+            (message, self.spiking) = self.data.GetDelta(self.frame, self.spiking)
+            self.writer.write(message)
+            await self.writer.drain()
+
+    #raises KeyError, TypeError or ValueError for a command without its number (the viewer loop ignores it)
+    def Command(self, command):
+        name = command.get('cmd')
+        if name == 'play':
+            self.playing = True
+        elif name == 'pause':
+            self.playing = False
+        elif name == 'fps':
+            fps = float(command['value'])
+            if math.isnan(fps):
+                raise ValueError('fps is not a number')
+            self.fps = min(max(fps, 0.1), self.fpsCap)
+        elif name == 'step':
+            self.step = max(int(command['value']), 1)
+        self.wake.set()
+
+    #plays at fps (at most the cap) - the time of sending counts, a slow viewer gets fewer frames
+    async def Play(self):
+        while not self.closed:
+            if not self.playing:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            start = time.time()
+            nextFrame = self.frame + self.step
+            if nextFrame >= len(self.data):
+                nextFrame = 0
+            await self.SendFrame(nextFrame)
+            await asyncio.sleep(max(1.0 / self.fps - (time.time() - start), 0.0))
+
+
+class PreviewServer():
+    def __init__(self, data, fpsCap, page):
+        self.data = data
+        self.fpsCap = fpsCap
+        self.page = page
+        self.viewers = 0
+
+    async def httpResponse(self, writer, status, contentType, body):
+        writer.write(('HTTP/1.1 ' + status + '\r\nContent-Type: ' + contentType + '\r\nContent-Length: ' + str(len(body)) +
+                      '\r\nConnection: close\r\n\r\n').encode('ascii') + body)
+        await writer.drain()
+        writer.close()
+
+    async def Handle(self, reader, writer):
+        request = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            (name, sep, value) = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(request) < 2 or request[0] != 'GET':
+            await self.httpResponse(writer, '400 Bad Request', 'text/plain', b'')
+        elif request[1] == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+            if headers.get('sec-websocket-key'):
+                await self.websocket(reader, writer, headers['sec-websocket-key'])
+            else:
+                await self.httpResponse(writer, '400 Bad Request', 'text/plain', b'')
+        elif request[1] in ('/', '/index.html'):
+            await self.httpResponse(writer, '200 OK', 'text/html; charset=utf-8', self.page.encode('utf-8'))
+        else:
+            await self.httpResponse(writer, '404 Not Found', 'text/plain', b'')
+
+    async def websocket(self, reader, writer, key):
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: ' + acceptKey(key) + '\r\n\r\n').encode('ascii'))
+        client = viewer(self.data, writer, self.fpsCap)
+        self.viewers += 1
+        print('viewer connected,', self.viewers, 'viewers')
+        player = asyncio.ensure_future(client.Play())
+        try:
+            await client.send(self.data.metaMessage)
+            await client.send(self.data.positionsMessage)       # static - once per viewer
+            await client.send(self.data.typesMessage)
+            await client.SendFrame(0)
+            while True:
+                (opcode, payload) = await readFrame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encodeFrame(OP_CLOSE, payload[:2]))
+                    break
+                elif opcode == OP_PING:
+                    await client.send(encodeFrame(OP_PONG, payload))
+                elif opcode == OP_TEXT:
+                    try:
+                        command = json.loads(payload.decode('utf-8'))
+                        if command.get('cmd') == 'seek':
+                            await client.SendFrame(command['frame'])    # scrubbing: shown at once, also when paused
+                        else:
+                            client.Command(command)
+                    except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+                        print('viewer command ignored:', payload[:80])
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            client.closed = True
+            client.wake.set()
+            player.cancel()
+            writer.close()
+            self.viewers -= 1
+            print('viewer left,', self.viewers, 'viewers')
+
+
+async def serveForever(server, host, port):
+    listener = await asyncio.start_server(server.Handle, host, port)
+    print('preview: http://' + host + ':' + str(port) + '/')
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        listener.close()
+        await listener.wait_closed()
+
+
+def Serve(data, host, port, fpsCap, page):
+    server = PreviewServer(data, fpsCap, page)
+    try:
+        if hasattr(asyncio, 'run'):
+            asyncio.run(serveForever(server, host, port))
+        else:                                       #python < 3.7
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(serveForever(server, host, port))
+            finally:
+                loop.close()
+    except KeyboardInterrupt:
+        pass
+
+#==============================================================================
+#the viewer page: points drawn like splat_renderer (projection, emissive squares, additive, sRGB), look & camera editable
+
+PAGE = r'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>neuron preview</title>
+<style>body{background:#222;color:#ddd;font:12px sans-serif;margin:8px} canvas{background:#000;max-width:100%}
+input[type=number]{width:70px} #frame{width:600px} label{margin-right:8px} pre{background:#111;padding:4px}</style></head>
+<body>
+<canvas id="view"></canvas>
+<div><button id="play">play</button> <input id="frame" type="range" min="0" value="0"> <span id="info"></span>
+<label>fps <input id="fps" type="number" step="1"></label><label>step <input id="step" type="number" value="1" min="1"></label></div>
+<div id="params"></div>
+<pre id="config"></pre>
+<script>
+var PARAMS = ['BASE_ALPHA', 'SPIKE_ALPHA', 'EMISSION', 'SIZE', 'SIZE_SPIKE', 'CAMERA_LOCATION', 'CAMERA_ROTATION',
+              'CAMERA_TYPE', 'CAMERA_ORTHO_SCALE', 'CAMERA_LENS', 'CAMERA_SENSOR_WIDTH'];
+var meta = null, cfg = null, positions = null, types = null, spiking = null, spikingCount = 0, projected = null, playing = false;
+var canvas = document.getElementById('view'), ctx = canvas.getContext('2d');
+var ws = new WebSocket('ws://' + location.host + '/ws');
+ws.binaryType = 'arraybuffer';
+function send(command) { ws.send(JSON.stringify(command)); }
+
+function eulerMatrix(r) {
+  var cx = Math.cos(r[0]), sx = Math.sin(r[0]), cy = Math.cos(r[1]), sy = Math.sin(r[1]), cz = Math.cos(r[2]), sz = Math.sin(r[2]);
+  return [[cz*cy, cz*sy*sx - sz*cx, cz*sy*cx + sz*sx], [sz*cy, sz*sy*sx + cz*cx, sz*sy*cx - cz*sx], [-sy, cy*sx, cy*cx]];
+}
+function project() {
+  var n = meta.neurons, w = canvas.width, h = canvas.height, fit = Math.max(w, h), m = eulerMatrix(cfg.CAMERA_ROTATION);
+  var loc = cfg.CAMERA_LOCATION, ortho = cfg.CAMERA_TYPE == 'ORTHO';
+  projected = {x: new Float32Array(n), y: new Float32Array(n), s: new Float32Array(n), v: new Uint8Array(n)};
+  for (var i = 0; i < n; i++) {
+    var p = [positions[3*i] - loc[0], positions[3*i+1] - loc[1], positions[3*i+2] - loc[2]];
+    var l0 = p[0]*m[0][0] + p[1]*m[1][0] + p[2]*m[2][0], l1 = p[0]*m[0][1] + p[1]*m[1][1] + p[2]*m[2][1];
+    var depth = -(p[0]*m[0][2] + p[1]*m[1][2] + p[2]*m[2][2]);
+    var scale = ortho ? fit / cfg.CAMERA_ORTHO_SCALE : (cfg.CAMERA_LENS / cfg.CAMERA_SENSOR_WIDTH) * fit / Math.max(depth, 1e-9);
+    projected.x[i] = w*0.5 + l0*scale; projected.y[i] = h*0.5 - l1*scale;
+    projected.s[i] = scale * meta.config.SPLAT_OBJECT_RADIUS; projected.v[i] = depth > 0.1 && depth < 100 ? 1 : 0;
+  }
+}
+function draw() {
+  if (!projected) return;
+  var w = canvas.width, h = canvas.height, sum = new Float32Array(w*h*3), colors = meta.typeColors;
+  for (var i = 0; i < meta.neurons; i++) {
+    if (!projected.v[i]) continue;
+    var on = spiking[i], alpha = on ? cfg.SPIKE_ALPHA : cfg.BASE_ALPHA, half = projected.s[i] * (on ? cfg.SIZE_SPIKE : cfg.SIZE);
+    var c = colors[types[i]], k = alpha * cfg.EMISSION, x = Math.floor(projected.x[i]), y = Math.floor(projected.y[i]);
+    var area = half < 0.5 ? 4*half*half : 1, r = Math.max(Math.round(half) - 1, 0);
+    for (var dy = -r; dy <= r; dy++) for (var dx = -r; dx <= r; dx++) {
+      var px = x + dx, py = y + dy;
+      if (px < 0 || py < 0 || px >= w || py >= h) continue;
+      var o = (py*w + px)*3;
+      sum[o] += c[0]*k*area; sum[o+1] += c[1]*k*area; sum[o+2] += c[2]*k*area;
+    }
+  }
+  var image = ctx.createImageData(w, h), d = image.data;
+  for (var j = 0, q = 0; j < w*h*3; j += 3, q += 4) {
+    for (var ch = 0; ch < 3; ch++) {
+      var v = Math.min(Math.max(sum[j+ch], 0), 1);
+      d[q+ch] = 255 * (v <= 0.0031308 ? v*12.92 : 1.055*Math.pow(v, 1/2.4) - 0.055) + 0.5;
+    }
+    d[q+3] = 255;
+  }
+  ctx.putImageData(image, 0, 0);
+}
+function showConfig() {
+  var lines = [];
+  PARAMS.forEach(function(name) { lines.push(name + ' = ' + JSON.stringify(cfg[name]).replace(/^\[(.*)\]$/, '($1)')); });
+  document.getElementById('config').textContent = lines.join('\n');
+}
+function buildParams() {
+  var div = document.getElementById('params');
+  PARAMS.forEach(function(name) {
+    var label = document.createElement('label'), input = document.createElement('input');
+    input.value = Array.isArray(cfg[name]) ? cfg[name].join(',') : cfg[name];
+    input.size = Array.isArray(cfg[name]) ? 24 : 6;
+    input.onchange = function() {
+      if (Array.isArray(cfg[name])) cfg[name] = input.value.split(',').map(Number);
+      else if (typeof cfg[name] == 'number') cfg[name] = Number(input.value);
+      else cfg[name] = input.value;
+      if (name.indexOf('CAMERA') == 0) project();
+      showConfig(); draw();
+    };
+    label.textContent = name + ' '; label.appendChild(input); div.appendChild(label);
+  });
+  showConfig();
+}
+ws.onmessage = function(event) {
+  if (typeof event.data == 'string') {
+    meta = JSON.parse(event.data); cfg = JSON.parse(JSON.stringify(meta.config));
+    canvas.width = meta.resolution[0]; canvas.height = meta.resolution[1];
+    document.getElementById('frame').max = meta.frames - 1; document.getElementById('fps').value = meta.fps;
+    spiking = new Uint8Array(meta.neurons); spikingCount = 0; buildParams();
+    return;
+  }
+  var view = new DataView(event.data), kind = String.fromCharCode(view.getUint8(0));
+  if (kind == 'P') { positions = new Float32Array(event.data, 8, 3*view.getUint32(4, true)); }
+  else if (kind == 'T') { types = new Uint16Array(event.data, 8, view.getUint32(4, true)); project(); }
+  else if (kind == 'D') {
+    var frame = view.getUint32(4, true), t = view.getFloat64(8, true), nOn = view.getUint32(16, true), nOff = view.getUint32(20, true);
+    var on = new Uint32Array(event.data, 24, nOn), off = new Uint32Array(event.data, 24 + 4*nOn, nOff);
+    for (var i = 0; i < nOff; i++) spiking[off[i]] = 0;
+    for (var i = 0; i < nOn; i++) spiking[on[i]] = 1;
+    spikingCount += nOn - nOff;
+    document.getElementById('frame').value = frame;
+    document.getElementById('info').textContent = 'frame ' + frame + ' time ' + t.toFixed(3) + ' spiking ' + spikingCount + ' (on ' + nOn + ', off ' + nOff + ')';
+    draw();
+  }
+};
+document.getElementById('play').onclick = function() { playing = !playing; send({cmd: playing ? 'play' : 'pause'}); this.textContent = playing ? 'pause' : 'play'; };
+document.getElementById('frame').oninput = function() { send({cmd: 'seek', frame: Number(this.value)}); };
+document.getElementById('fps').onchange = function() { send({cmd: 'fps', value: Number(this.value)}); };
+document.getElementById('step').onchange = function() { send({cmd: 'step', value: Number(this.value)}); };
+</script></body></html>
+'''
+
+#==============================================================================
+
+if __name__ == '__main__':
+    SOURCE_PATH = path.dirname(path.realpath(__file__))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]    # --groups=... flags: selection.py
+    ABSOLUTE_PATH = path.join(SOURCE_PATH, args[0])
+    targetDirectory = path.join(SOURCE_PATH, args[1])
+    cfg = selection.ApplyArgs(prepare.LoadConfig(SOURCE_PATH), [arg for arg in sys.argv[1:] if arg.startswith('--')])
+    port = int(args[2]) if len(args) > 2 else cfg.PREVIEW_PORT
+    prepared = prepare.OpenPrepared(ABSOLUTE_PATH, targetDirectory, cfg, SOURCE_PATH)
+    print(prepared)
+    Serve(PreviewData(prepared, cfg), cfg.PREVIEW_HOST, port, cfg.PREVIEW_FPS, PAGE)
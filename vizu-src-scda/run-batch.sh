@@ -0,0 +1,22 @@
+#!/bin/bash
+
+#run-batch.sh jobs.json [--resume] [--groups=TH_M1,M1 ...]
+#all jobs of jobs.json (datasets, frame ranges, cameras - see neuron-visu-batch.py) in one blender process
+
+#path to blender
+blenderPath="/apps/ef/blender2.79b/blender"
+
+#path to local python code to control blender's behavior
+pythonScript="neuron-visu-batch.py"
+
+#path to python with numpy - for the "numpy" render backend (no blender needed)
+pythonPath="python3"
+
+#render backend is set in config.py
+renderBackend=$($pythonPath -c "import config; print(config.RENDER_BACKEND)")
+
+if [ "$renderBackend" == "numpy" ]; then
+    $pythonPath $pythonScript $@
+else
+    $blenderPath -b -P $pythonScript $@
+fi
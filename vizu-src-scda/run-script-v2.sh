@@ -9,6 +9,7 @@ RENDER_FROM=$3
 RENDER_TO=$4
 RENDER_STEP=$5
 NODEINDEX=$6
+FLAGS=${@:7}            #e.g. --manifest
 
 #path to blender
 blenderPath="/apps/ef/blender2.79b/blender"
@@ -16,8 +17,19 @@ blenderPath="/apps/ef/blender2.79b/blender"
 #path to local python code to control blender's behavior
 pythonScript="neuron-visu-v2.py"
 
-#run blender with python script and input file
-$blenderPath -b -P $pythonScript $srcNeuronsPath $dstRednerPath $RENDER_FROM $RENDER_TO $RENDER_STEP $NODEINDEX
+#path to python with numpy - for the "numpy" render backend (no blender needed)
+pythonPath="python3"
+
+#render backend is set in config.py
+renderBackend=$($pythonPath -c "import config; print(config.RENDER_BACKEND)")
+
+if [ "$renderBackend" == "numpy" ]; then
+    #run python script without blender
+    $pythonPath $pythonScript $srcNeuronsPath $dstRednerPath $RENDER_FROM $RENDER_TO $RENDER_STEP $NODEINDEX $FLAGS
+else
+    #run blender with python script and input file
+    $blenderPath -b -P $pythonScript $srcNeuronsPath $dstRednerPath $RENDER_FROM $RENDER_TO $RENDER_STEP $NODEINDEX $FLAGS
+fi
 
 #framerate is frames per second: - call this in slurm script when all frames are rendered - in dependent job
 #ffmpeg -framerate 30 -i render/render_%04d.png -c:v libx264 -vf fps=30 -pix_fmt yuv420p out.mp4 -y
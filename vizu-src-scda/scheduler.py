@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#Scheduler stage: frames of the render array balanced by estimated cost, written as a per-task manifest
+#--------------------------------------------------------------------------
+#
+# run after the prepare stage (see prepare-job.slurm / submit-all.sh), before the render tasks:
+#   python3 scheduler.py ../1M_test ../out_1M_test 20            (all frames, 20 tasks)
+#   python3 scheduler.py ../1M_test ../out_1M_test 20 0 1000     (frames 0..1000)
+#
+# cost of a frame = FRAME_COST + SPIKE_COST * (neurons changed in the frame):
+#   spiking neurons of the frame, with AFTERGLOW all neurons still glowing (spikes of the last 'length' frames)
+# the two constants are fitted to the timings of previous runs when there are any (<output>/schedule/timings/*.txt,
+# written by every render task: 'frame seconds linked' per line), otherwise the config values are used.
+# a timings file starts with the key of its run (TimingsKey: data, selection, frame binning & the render config of
+# TIMING_CONFIG) - timings of other data or settings (or without a key) are not fitted.
+#
+# frames are cut into contiguous chunks of equal cost (afterglow needs no seek inside a chunk),
+# chunks go to the task with the least cost so far, biggest first.
+# DEDUP_FRAMES: a frame with the spikes of an earlier frame (frame_dedup.py) is linked, not rendered - it costs
+# SCHEDULE_LINK_COST (median of the linked frames of previous runs when there are any: link, checksum, overlay).
+#   png:      it goes to the task of its frame & its cost with it - a frame links at most the duplicates of a chunk's
+#             cost, the next duplicate is rendered and linked to by the ones after it
+#   segments: only a duplicate of a frame of its own chunk is linked (the task keeps that frame in memory), the others are rendered
+# writes <output>/schedule/manifest.json, a render task started with --manifest renders its frames from there.
+
+import sys
+import json
+import heapq
+import hashlib
+from os import path, listdir, getpid, makedirs, replace
+
+import numpy as np
+
+import prepare
+import frame_buffer
+import frame_dedup
+import selection
+
+
+SCHEDULE_DIR = 'schedule'
+TIMINGS_DIR = 'timings'
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+TIMINGS_KEY = '# key '
+TIMING_CONFIG = ('RENDER_BACKEND', 'RESOLUTION_SCALE', 'SPLAT_RESOLUTION', 'AFTERGLOW', 'AFTERGLOW_DECAY', 'AFTERGLOW_MIN_ALPHA',
+                 'DELTA_UPDATES', 'LOD_BUDGET', 'TEXTURE_ATLAS_TILE_ROWS', 'OUTPUT_MODE', 'ACTIVITY_OVERLAY', 'ACTIVITY_OVERLAY_SIZE')    #config the time of a frame depends on
+
+#==============================================================================
+
+def GetScheduleDir(outputDir):
+    return path.join(outputDir, SCHEDULE_DIR)
+
+
+def GetTimingsFile(outputDir, nodeIndex):
+    return path.join(outputDir, SCHEDULE_DIR, TIMINGS_DIR, 'task_' + str(nodeIndex).zfill(4) + '.txt')
+
+#==============================================================================
+
+#neurons changed in every frame: spike counts, with afterglow summed over the frames a spike stays visible
+def FrameWork(frameIndex, cfg):
+    counts = frameIndex.GetSpikeCounts().astype(np.float64)
+    if cfg.AFTERGLOW and len(counts):
+        length = frame_buffer.Afterglow(frameIndex, 0, cfg.AFTERGLOW_DECAY, cfg.BASE_ALPHA, cfg.SPIKE_ALPHA, cfg.AFTERGLOW_MIN_ALPHA).length
+        counts = np.convolve(counts, np.ones(length))[:len(counts)]
+    return counts
+
+
+#key of the timings of a run: data signature, frame binning & selection of the prepared data (meta), render config
+def TimingsKey(meta, cfg):
+    key = {'data': meta['data'], 'config': meta['config'],
+           'render': dict((name, getattr(cfg, name, None)) for name in TIMING_CONFIG)}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def readTimingsKey(timingsFile):
+    with open(timingsFile, 'r') as f:
+        line = f.readline().strip()
+    return line[len(TIMINGS_KEY):] if line.startswith(TIMINGS_KEY) else None
+
+
+#returns frames, seconds & linked (bool, frame_dedup) of the timing files of previous runs with the key
+def readTimings(outputDir, key):
+    timingsDir = path.join(outputDir, SCHEDULE_DIR, TIMINGS_DIR)
+    frames, seconds, linked = [], [], []
+    if path.isdir(timingsDir):
+        for name in sorted(listdir(timingsDir)):
+            if name.endswith('.txt') and readTimingsKey(path.join(timingsDir, name)) == key:
+                data = np.loadtxt(path.join(timingsDir, name), ndmin=2)
+                if data.size:
+                    frames.append(data[:, 0].astype(np.int64))
+                    seconds.append(data[:, 1])
+                    linked.append(data[:, 2] > 0)
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=bool)
+    return np.concatenate(frames), np.concatenate(seconds), np.concatenate(linked)
+
+
+#returns (frameCost, spikeCost): least squares fit of seconds = frameCost + spikeCost * work,
+#the defaults when there are not enough timings (or the fit makes no sense)
+def CalibrateCostModel(work, frames, seconds, defaults):
+    inRange = frames < len(work)
+    frames, seconds = frames[inRange], seconds[inRange]
+    if len(frames) < 2 or len(np.unique(work[frames])) < 2:
+        return defaults
+    design = np.column_stack((np.ones(len(frames)), work[frames]))
+    (frameCost, spikeCost) = np.linalg.lstsq(design, seconds, rcond=-1)[0]
+    if frameCost <= 0 or spikeCost < 0:
+        return defaults
+    return (float(frameCost), float(spikeCost))
+
+
+#returns seconds of a linked frame: median of the linked frames timed, the default without any
+def CalibrateLinkCost(seconds, default):
+    if len(seconds) == 0:
+        return default
+    return max(float(np.median(seconds)), 1e-6)
+
+#==============================================================================
+
+#returns chunks [start, end) of frames: contiguous, about equal cost each
+def SplitChunks(costs, chunkCount):
+    cumulative = np.cumsum(costs)
+    total = cumulative[-1] if len(cumulative) else 0.0
+    bounds = np.searchsorted(cumulative, total * np.arange(1, chunkCount) / chunkCount, side='right')
+    bounds = np.unique(np.concatenate(([0], bounds, [len(costs)])))
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+#returns per task list of chunks - biggest chunk to the least loaded task (ties: lower task),
+#neighbouring chunks of the same task are joined
+def AssignChunks(chunks, chunkCosts, taskCount):
+    tasks = [[] for i in range(taskCount)]
+    loads = [(0.0, i) for i in range(taskCount)]
+    for c in sorted(range(len(chunks)), key=lambda c: (-chunkCosts[c], c)):
+        (load, i) = heapq.heappop(loads)
+        tasks[i].append(chunks[c])
+        heapq.heappush(loads, (load + chunkCosts[c], i))
+    for i in range(taskCount):
+        joined = []
+        for (start, end) in sorted(tasks[i]):
+            if len(joined) and joined[-1][1] == start:
+                joined[-1] = (joined[-1][0], end)
+            else:
+                joined.append((start, end))
+        tasks[i] = joined
+    return tasks
+
+
+#returns {duplicate: frame it links to} - at most linkLimit duplicates per rendered frame, the duplicate
+#after them is rendered & the next ones link to it (png: a frame and its links are one task's work)
+def LimitLinks(duplicates, linkLimit):
+    limited = {}
+    targets = {}                                        # canonical frame -> (frame linked to now, its links)
+    for nFrame in sorted(duplicates):
+        canonical = duplicates[nFrame]
+        (target, links) = targets.get(canonical, (canonical, 0))
+        if links >= linkLimit:
+            (target, links) = (nFrame, 0)               # rendered
+        else:
+            limited[nFrame] = target
+            links += 1
+        targets[canonical] = (target, links)
+    return limited
+
+
+#returns the duplicates of a frame of their own chunk [start, end) - offsets of frameFrom
+def SameChunk(duplicates, chunks, frameFrom):
+    starts = np.array([start for (start, end) in chunks], dtype=np.int64)
+    chunkOf = lambda nFrame: int(np.searchsorted(starts, nFrame - frameFrom, side='right'))
+    return dict((nFrame, canonical) for nFrame, canonical in duplicates.items() if chunkOf(nFrame) == chunkOf(canonical))
+
+#==============================================================================
+
+def WriteManifest(outputDir, prepared, cfg, taskCount, frameFrom=0, frameTo=None):
+    frameIndex = prepared.frameIndex
+    totalFrames = len(frameIndex)
+    frameTo = totalFrames - 1 if frameTo is None else min(frameTo, totalFrames - 1)
+
+    work = FrameWork(frameIndex, cfg)
+    frames, seconds, linked = readTimings(outputDir, TimingsKey(prepared.meta, cfg))
+    defaults = (cfg.SCHEDULE_FRAME_COST, cfg.SCHEDULE_SPIKE_COST)
+    costModel = CalibrateCostModel(work, frames[~linked], seconds[~linked], defaults)
+    linkCost = CalibrateLinkCost(seconds[linked], cfg.SCHEDULE_LINK_COST)
+    costs = costModel[0] + costModel[1] * work[frameFrom:frameTo + 1]
+    chunkCount = taskCount * cfg.SCHEDULE_CHUNKS_PER_TASK
+    chunks = None
+    duplicates = {}
+    if cfg.DEDUP_FRAMES:
+        duplicates = frame_dedup.FindDuplicates(frameIndex, range(frameFrom, frameTo + 1), frame_dedup.GetSignatureLength(frameIndex, cfg))
+        if cfg.OUTPUT_MODE == 'segments':
+            chunks = SplitChunks(costs, chunkCount)
+            duplicates = SameChunk(duplicates, chunks, frameFrom)
+            costs[np.array(sorted(duplicates), dtype=np.int64) - frameFrom] = linkCost
+        else:
+            duplicateRows = np.array(sorted(duplicates), dtype=np.int64) - frameFrom
+            chunkCost = (costs.sum() - costs[duplicateRows].sum() + linkCost * len(duplicateRows)) / chunkCount
+            duplicates = LimitLinks(duplicates, max(int(chunkCost / linkCost), 1) if linkCost > 0 else len(duplicates))
+            costs[np.array(sorted(duplicates), dtype=np.int64) - frameFrom] = 0.0
+            np.add.at(costs, np.array([duplicates[nFrame] for nFrame in sorted(duplicates)], dtype=np.int64) - frameFrom, linkCost)   # with the frame linked to
+
+    if chunks is None:
+        chunks = SplitChunks(costs, chunkCount)
+    chunkCosts = [float(costs[start:end].sum()) for (start, end) in chunks]
+    tasks = AssignChunks(chunks, chunkCosts, taskCount)
+
+    manifest = {'version': MANIFEST_VERSION,
+                'data': prepared.meta['data'],
+                'config': prepared.meta['config'],
+                'totalFrames': totalFrames,
+                'costModel': {'frame': costModel[0], 'spike': costModel[1], 'link': linkCost, 'timings': len(frames), 'calibrated': costModel != defaults},
+                'duplicates': dict((str(nFrame), canonical) for nFrame, canonical in duplicates.items()),
+                'tasks': []}
+    for taskChunks in tasks:
+        manifest['tasks'].append({'cost': sum(float(costs[start:end].sum()) for (start, end) in taskChunks),
+                                  'chunks': [[frameFrom + start, frameFrom + end - 1] for (start, end) in taskChunks]})
+
+    scheduleDir = GetScheduleDir(outputDir)
+    if not path.isdir(scheduleDir):
+        makedirs(scheduleDir)
+    manifestFile = path.join(scheduleDir, MANIFEST_FILE)
+    tmpFile = manifestFile + '.tmp-' + str(getpid())
+    with open(tmpFile, 'w') as f:
+        json.dump(manifest, f)
+    replace(tmpFile, manifestFile)
+    return manifest
+
+#==============================================================================
+
+def ReadManifest(outputDir):
+    with open(path.join(GetScheduleDir(outputDir), MANIFEST_FILE), 'r') as f:
+        return json.load(f)
+
+
+#returns {duplicate frame: canonical frame} of the manifest (DEDUP_FRAMES)
+def GetDuplicates(manifest):
+    return dict((int(nFrame), canonical) for nFrame, canonical in manifest.get('duplicates', {}).items())
+
+
+#returns frames of the task (1 index based) - chunks [first, last] in frame order,
+#moveDuplicates: duplicates of other tasks' frames left out, duplicates of this task's frames added (png links)
+def GetTaskFrames(manifest, nodeIndex, moveDuplicates=True):
+    if nodeIndex > len(manifest['tasks']):
+        return []
+    frames = []
+    for (first, last) in manifest['tasks'][nodeIndex - 1]['chunks']:
+        frames.extend(range(first, last + 1))
+    duplicates = GetDuplicates(manifest)
+    if moveDuplicates and len(duplicates):
+        own = set(frames)
+        frames = sorted([nFrame for nFrame in frames if nFrame not in duplicates] +
+                        [nFrame for nFrame, canonical in duplicates.items() if canonical in own])
+    return frames
+
+
+#records the time of every frame of this task (frame, seconds, linked) under the key of the run (TimingsKey), read by the next WriteManifest
+def WriteTimings(outputDir, nodeIndex, timings, key):
+    timingsFile = GetTimingsFile(outputDir, nodeIndex)
+    timingsDir = path.dirname(timingsFile)
+    if not path.isdir(timingsDir):
+        try:
+            makedirs(timingsDir)
+        except OSError:
+            pass
+    with open(timingsFile, 'w') as f:
+        f.write(TIMINGS_KEY + key + '\n')
+        for (nFrame, seconds, linked) in timings:
+            f.write(str(nFrame) + ' ' + repr(seconds) + ' ' + str(int(linked)) + '\n')
+
+#==============================================================================
+
+if __name__ == '__main__':
+    SOURCE_PATH = path.dirname(path.realpath(__file__))
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]    # --groups=... flags: selection.py
+    ABSOLUTE_PATH = path.join(SOURCE_PATH, args[0])
+    targetDirectory = path.join(SOURCE_PATH, args[1])
+    taskCount = int(args[2])
+    frameFrom = int(args[3]) if len(args) > 3 else 0
+    frameTo = int(args[4]) if len(args) > 4 else None
+    cfg = selection.ApplyArgs(prepare.LoadConfig(SOURCE_PATH), [arg for arg in sys.argv[1:] if arg.startswith('--')])
+    prepared = prepare.OpenPrepared(ABSOLUTE_PATH, targetDirectory, cfg, SOURCE_PATH)
+    manifest = WriteManifest(targetDirectory, prepared, cfg, taskCount, frameFrom, frameTo)
+    print('cost model:', manifest['costModel'])
+    print('duplicate frames (no render, linked to an earlier frame):', len(manifest['duplicates']))
+    for i, task in enumerate(manifest['tasks']):
+        print('task', i + 1, 'cost', round(task['cost'], 2), 'chunks', task['chunks'])
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#Movie segments: rendered frames go straight into a local ffmpeg, no png per frame on the shared storage
+#--------------------------------------------------------------------------
+#
+# OUTPUT_MODE = "segments" in config.py: every task pipes raw RGBA frames of each contiguous chunk
+# of its frames into one ffmpeg process -> <output>/segments/segment_<first>_<last>.mp4
+# (encoded to a temporary file, renamed when ffmpeg finished - a segment that exists is complete).
+#
+# when all tasks finished (concat-job.slurm), the segments are joined in frame order & the legend is overlaid:
+#   python3 segment_encoder.py ../out_1M_test            -> ../out_1M_test/movie.mp4
+#   python3 segment_encoder.py ../out_1M_test out.mp4
+# without a legend the segments are only copied into one file (no encoding).
+
+import sys
+import subprocess
+from os import path, listdir, makedirs, getpid, replace, remove
+
+
+SEGMENTS_DIR = 'segments'
+ENCODE_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']    # same for all segments - concat copies the streams
+
+#==============================================================================
+
+def GetSegmentsDir(outputDir):
+    return path.join(outputDir, SEGMENTS_DIR)
+
+
+def GetSegmentFile(segmentsDir, firstFrame, lastFrame):
+    return path.join(segmentsDir, 'segment_' + str(firstFrame).zfill(6) + '_' + str(lastFrame).zfill(6) + '.mp4')
+
+
+#returns runs of frames where each frame follows the one before - a segment never skips frames, concat plays them in order
+def SplitContiguous(frames):
+    chunks = []
+    for nFrame in frames:
+        if len(chunks) and nFrame == chunks[-1][-1] + 1:
+            chunks[-1].append(nFrame)
+        else:
+            chunks.append([nFrame])
+    return chunks
+
+#==============================================================================
+
+class SegmentEncoder():
+    def __init__(self, segmentFile, framerate, ffmpegPath='ffmpeg'):
+        self.segmentFile = segmentFile
+        self.tmpFile = segmentFile[:-len('.mp4')] + '.tmp-' + str(getpid()) + '.mp4'
+        self.framerate = framerate
+        self.ffmpegPath = ffmpegPath
+        self.process = None
+        self.frameCount = 0
+
+    #ffmpeg is started with the first frame - its size is the size of the video
+    def start(self, width, height):
+        segmentsDir = path.dirname(self.segmentFile)
+        if not path.isdir(segmentsDir):
+            try:
+                makedirs(segmentsDir)
+            except OSError:
+                pass
+        command = [self.ffmpegPath, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', str(width) + 'x' + str(height),
+                   '-framerate', str(self.framerate), '-i', '-'] + ENCODE_ARGS + [self.tmpFile]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.size = (height, width)
+
+    #rgba: 8 bit (height, width, 4), top row first
+    def Write(self, rgba):
+        if self.process is None:
+            self.start(rgba.shape[1], rgba.shape[0])
+        if rgba.shape[0:2] != self.size:
+            raise ValueError('frame size ' + str(rgba.shape[0:2]) + ' is not the segment size ' + str(self.size))
+        self.process.stdin.write(rgba.tobytes())
+        self.frameCount += 1
+
+    #waits for ffmpeg, moves the segment into place
+    def Close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg failed on ' + self.segmentFile)
+        replace(self.tmpFile, self.segmentFile)
+        self.process = None
+
+#==============================================================================
+
+#returns (first, last) frame of a segment file name, None for other files (temporary ones of a running encoder too)
+def parseSegmentName(name):
+    parts = name[:-len('.mp4')].split('_')
+    if not name.endswith('.mp4') or len(parts) != 3 or parts[0] != 'segment' or not (parts[1].isdigit() and parts[2].isdigit()):
+        return None
+    return int(parts[1]), int(parts[2])
+
+
+#returns (first, last, file) of all complete segments, sorted by first frame
+def readSegments(segmentsDir):
+    segments = []
+    if path.isdir(segmentsDir):
+        for name in listdir(segmentsDir):
+            frames = parseSegmentName(name)
+            if frames is not None:
+                segments.append((frames[0], frames[1], path.join(segmentsDir, name)))
+    return sorted(segments)
+
+
+#removes segments holding any of the frames first..last but not exactly them - left by a run with other chunk bounds
+#(a new schedule): with them the movie would show these frames twice
+def RemoveStaleSegments(segmentsDir, first, last):
+    for (start, end, segmentFile) in readSegments(segmentsDir):
+        if start <= last and end >= first and (start, end) != (first, last):
+            print('stale segment removed:', segmentFile)
+            remove(segmentFile)
+
+
+#returns segment files sorted by their first frame - reports frames missing between them,
+#exits if segments overlap (a frame would be in the movie twice, out of order)
+def ListSegments(segmentsDir):
+    segments = readSegments(segmentsDir)
+    for i in range(1, len(segments)):
+        if segments[i][0] <= segments[i - 1][1]:
+            sys.exit('segments overlap: ' + path.basename(segments[i - 1][2]) + ' ' + path.basename(segments[i][2]) +
+                     ' - remove the stale one and render its frames again')
+        if segments[i][0] != segments[i - 1][1] + 1:
+            print('segments: frames', segments[i - 1][1] + 1, 'to', segments[i][0] - 1, 'are missing')
+    return [segment[2] for segment in segments]
+
+
+#joins the segments in frame order into movieFile, overlays legendFile at overlay (x:y) if it exists
+def ConcatSegments(outputDir, movieFile, legendFile=None, overlay='1600:0', ffmpegPath='ffmpeg'):
+    segmentsDir = GetSegmentsDir(outputDir)
+    segments = ListSegments(segmentsDir)
+    if len(segments) == 0:
+        sys.exit('no segments in ' + segmentsDir)
+    listFile = path.join(segmentsDir, 'concat.txt')
+    with open(listFile, 'w') as f:
+        for segmentFile in segments:
+            f.write("file '" + path.abspath(segmentFile) + "'\n")
+
+    command = [ffmpegPath, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listFile]
+    if legendFile is not None and path.isfile(legendFile):
+        command += ['-i', legendFile, '-filter_complex', '[0:v][1:v] overlay=' + overlay] + ENCODE_ARGS
+    else:
+        command += ['-c', 'copy']
+    subprocess.check_call(command + [movieFile])
+    remove(listFile)
+
+#==============================================================================
+
+if __name__ == '__main__':
+    SOURCE_PATH = path.dirname(path.realpath(__file__))
+    sys.path.insert(0, SOURCE_PATH)
+    import prepare
+    cfg = prepare.LoadConfig(SOURCE_PATH)
+    targetDirectory = path.join(SOURCE_PATH, sys.argv[1])
+    movieFile = path.join(targetDirectory, sys.argv[2] if len(sys.argv) > 2 else 'movie.mp4')
+    legendFile = path.join(targetDirectory, "_legend_" + str(1).zfill(4) + ".png")
+    ConcatSegments(targetDirectory, movieFile, legendFile, cfg.LEGEND_OVERLAY, cfg.FFMPEG_PATH)
+    print(movieFile)
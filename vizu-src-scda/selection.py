@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#Subset of the data to render: groups, types, a bounding box, a neuron id range
+#--------------------------------------------------------------------------
+#
+# SELECT_* in config.py, or flags of the visu script / prepare.py / scheduler.py (they override config.py):
+#   --groups=TH_M1,M1   --exclude-groups=BG   --types=S1_L4_Pyr   --exclude-types=FSI
+#   --box=x0,y0,z0,x1,y1,z1   (inclusive)   --ids=first:last   (inclusive, either may be empty)
+#
+# applied where the data is read (neuron_cache): files of excluded groups & types are never parsed,
+# neurons outside of the box or id range are dropped right after their type file is parsed, their
+# spikes chunk by chunk while the spike file is read - the cache, the frame index and everything after hold the subset only.
+# the selection is part of the cache directory name & of the prepared artifact key (a cache per subset).
+
+import json
+import hashlib
+
+import numpy as np
+
+
+FLAGS = {'--groups': 'SELECT_GROUPS',
+         '--exclude-groups': 'SELECT_EXCLUDE_GROUPS',
+         '--types': 'SELECT_TYPES',
+         '--exclude-types': 'SELECT_EXCLUDE_TYPES',
+         '--box': 'SELECT_BOX',
+         '--ids': 'SELECT_ID_RANGE'}
+
+#==============================================================================
+
+def parseList(value):
+    return [name for name in value.split(',') if name]
+
+
+def parseBox(value):
+    bounds = [float(v) for v in value.split(',')]
+    if len(bounds) != 6:
+        raise ValueError('--box needs x0,y0,z0,x1,y1,z1: ' + value)
+    return (tuple(bounds[0:3]), tuple(bounds[3:6]))
+
+
+def parseIDRange(value):
+    (first, last) = value.split(':')
+    return (int(first) if first else None, int(last) if last else None)
+
+
+#sets the SELECT_* values of cfg from the --groups=... flags (other flags are left alone), returns cfg
+def ApplyArgs(cfg, flags):
+    parsers = {'SELECT_BOX': parseBox, 'SELECT_ID_RANGE': parseIDRange}
+    for flag in flags:
+        (name, sep, value) = flag.partition('=')
+        if name in FLAGS and sep:
+            key = FLAGS[name]
+            setattr(cfg, key, parsers.get(key, parseList)(value))
+    return cfg
+
+#==============================================================================
+
+class Selection():
+    def __init__(self, groups=None, excludeGroups=None, types=None, excludeTypes=None, box=None, idRange=None):
+        self.groups = list(groups or [])                #empty: all
+        self.excludeGroups = list(excludeGroups or [])
+        self.types = list(types or [])                  #empty: all
+        self.excludeTypes = list(excludeTypes or [])
+        self.box = box                                  #((x0,y0,z0), (x1,y1,z1)) or None
+        self.idRange = tuple(idRange) if idRange else None   #(first, last) or None, None in it: no limit
+        if self.idRange == (None, None):
+            self.idRange = None                         #no limit either end - same selection (& cache) as none
+
+    def __repr__(self):
+        return 'Selection ' + json.dumps(self.GetKey(), sort_keys=True)
+
+    def IsEmpty(self):
+        return not (self.groups or self.excludeGroups or self.types or self.excludeTypes or self.box or self.idRange)
+
+    #json-able values - cache & prepared artifact keys
+    def GetKey(self):
+        if self.IsEmpty():
+            return None
+        return {'groups': self.groups, 'excludeGroups': self.excludeGroups,
+                'types': self.types, 'excludeTypes': self.excludeTypes,
+                'box': [list(corner) for corner in self.box] if self.box else None,
+                'ids': list(self.idRange) if self.idRange else None}
+
+    #short hash of the key, '' for no selection
+    def GetSignature(self):
+        if self.IsEmpty():
+            return ''
+        return hashlib.sha1(json.dumps(self.GetKey(), sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    #the group & type flags of the selection (as ApplyArgs reads them) - for messages
+    def GetFlags(self):
+        flags = []
+        for (flag, names) in (('--groups', self.groups), ('--exclude-groups', self.excludeGroups),
+                              ('--types', self.types), ('--exclude-types', self.excludeTypes)):
+            if names:
+                flags.append(flag + '=' + ','.join(names))
+        return ' '.join(flags)
+
+    def HasType(self, groupName, typeName):
+        if self.groups and groupName not in self.groups:
+            return False
+        if groupName in self.excludeGroups:
+            return False
+        if self.types and typeName not in self.types:
+            return False
+        return typeName not in self.excludeTypes
+
+    #returns sources (neuron_cache.ScanSources) of the selected groups & types
+    def SelectSources(self, sources):
+        return [source for source in sources if self.HasType(source[0], source[1])]
+
+    #returns mask of the neurons inside of the box & id range, None: all of them
+    def NeuronMask(self, ids, positions):
+        if self.box is None and self.idRange is None:
+            return None
+        mask = np.ones(len(ids), dtype=bool)
+        if self.box is not None:
+            (low, high) = (np.asarray(self.box[0]), np.asarray(self.box[1]))
+            mask &= np.all((positions >= low) & (positions <= high), axis=1)
+        if self.idRange is not None:
+            (first, last) = self.idRange
+            if first is not None:
+                mask &= ids >= first
+            if last is not None:
+                mask &= ids <= last
+        return mask
+
+
+def FromConfig(cfg):
+    return Selection(cfg.SELECT_GROUPS, cfg.SELECT_EXCLUDE_GROUPS, cfg.SELECT_TYPES, cfg.SELECT_EXCLUDE_TYPES,
+                     cfg.SELECT_BOX, cfg.SELECT_ID_RANGE)
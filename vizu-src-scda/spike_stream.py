@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#Out-of-core spikes: time ordered streaming of the spike files, windowed frame index for the render tasks
+#--------------------------------------------------------------------------
+#
+# SPIKE_STREAMING = True in config.py (prepare stage):
+# - the neuron cache is built without spikes, the spike files are read in chunks of lines instead
+#   (every *_spikes.txt is sorted by time, as written by the simulator)
+# - the files of all types are merged by time chunk by chunk: a chunk holds the spikes earlier than the
+#   last time read of every file, same time keeps type & file order - exactly the order of the neuron cache
+# - the frame index is built from the merged chunks, frame_neurons.npy written as it grows
+# memory: SPIKE_STREAM_CHUNK spikes (all files together) + the frame times & offsets, not the spike count.
+#
+# SPIKE_WINDOW > 0 in config.py (render tasks):
+# - frame_neurons.npy is read in windows of SPIKE_WINDOW spikes covering the frames asked for,
+#   the next window is read by a thread meanwhile (prefetch), earlier windows are dropped
+# memory: 2 windows (current + prefetch), not the simulation length. 0: memory-mapped as before.
+
+import threading
+from os import path, remove
+
+import numpy as np
+
+from neuron_table import JoinSpikes
+import neuron_cache
+import frame_index
+
+#==============================================================================
+
+#yields (ids, times) chunks of about chunkLines spikes of a spike file, times sorted - missing file (or None) yields nothing
+#lines are parsed like the neuron cache does (neuron_cache.ParseSpikeLines) - streamed & cached spikes are the same
+def ReadSpikeChunks(filePath, chunkLines):
+    lastTime = -np.inf
+    for (ids, times) in neuron_cache.ReadSpikeChunks(filePath, chunkLines):
+        if len(times) == 0:
+            continue
+        if times[0] < lastTime or np.any(times[1:] < times[:-1]):
+            raise ValueError('spikes not sorted by time: ' + filePath)
+        lastTime = times[-1]
+        yield ids, times
+
+
+#one spike file: chunks read ahead, rows (not ids) of the spikes not handed out yet
+class spikeSource():
+    def __init__(self, spikesFile, ids, rowOffset, chunkLines):
+        self.chunks = ReadSpikeChunks(spikesFile, chunkLines)
+        self.ids = ids
+        self.rowOffset = rowOffset
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.times = np.zeros(0, dtype=np.float64)
+        self.done = False
+
+    #reads the next chunk behind the spikes kept, unknown neurons dropped
+    def read(self):
+        for ids, times in self.chunks:
+            rows = JoinSpikes(self.ids, ids, self.rowOffset)
+            valid = rows >= 0
+            self.rows = np.concatenate((self.rows, rows[valid]))
+            self.times = np.concatenate((self.times, times[valid]))
+            if len(self.times):
+                return
+        self.done = True
+
+    #returns & drops the spikes earlier than boundary
+    def take(self, boundary):
+        end = np.searchsorted(self.times, boundary, side='left')
+        taken = (self.rows[:end], self.times[:end])
+        (self.rows, self.times) = (self.rows[end:], self.times[end:])
+        return taken
+
+
+#yields (rows, times) of the spikes of all types in time order, chunk by chunk - like the spike columns of the neuron cache
+def MergeSpikeStreams(store, sources, chunkSpikes):
+    chunkLines = max(chunkSpikes // max(len(sources), 1), 1)
+    streams = []
+    for (groupName, typeName, neuronsFile, spikesFile), t in zip(sources, store.types):
+        streams.append(spikeSource(spikesFile, store.ids[t['start']:t['end']], t['start'], chunkLines))
+    for stream in streams:
+        stream.read()
+
+    while True:
+        active = [stream for stream in streams if not stream.done]
+        #every spike earlier than the last time read of each file is known - all files read up to there
+        boundary = min(stream.times[-1] for stream in active) if active else np.inf
+        taken = [stream.take(boundary) for stream in streams]
+        rows = np.concatenate([t[0] for t in taken]) if taken else np.zeros(0, dtype=np.int32)
+        times = np.concatenate([t[1] for t in taken]) if taken else np.zeros(0, dtype=np.float64)
+        if len(times):
+            order = np.argsort(times, kind='mergesort')    #stable - same time keeps type order
+            yield rows[order], times[order]
+        if not active:
+            return
+        for stream in active:
+            if len(stream.times) == 0 or stream.times[-1] == boundary:
+                stream.read()
+
+#==============================================================================
+
+#frame times, offsets & count of spikes of the stream as frames are found, the neurons go to a file
+class frameIndexWriter():
+    def __init__(self, neuronsFile, binWidth, timeStart, timeEnd):
+        self.neuronsFile = neuronsFile
+        self.binWidth = binWidth
+        self.timeStart = timeStart
+        self.timeEnd = timeEnd
+        self.times = []         #frame times of every chunk (distinct times)
+        self.firstFrames = []   #first frame of every chunk (bins)
+        self.counts = []        #spikes per frame of every chunk
+        self.lastTime = None
+        self.spikes = 0
+
+    def writeNeurons(self, f, rows):
+        f.write(rows.astype(np.int32, copy=False).tobytes())
+        self.spikes += len(rows)
+
+    #one frame per distinct time, a chunk holds all spikes of its times
+    def addSpikes(self, f, rows, times):
+        inside = np.ones(len(times), dtype=bool)
+        if self.timeStart is not None:
+            inside &= times >= self.timeStart
+        if self.timeEnd is not None:
+            inside &= times <= self.timeEnd
+        (rows, times) = (rows[inside], times[inside])
+        if len(times) == 0:
+            return
+        isFirst = np.ones(len(times), dtype=bool)
+        isFirst[1:] = times[1:] != times[:-1]
+        starts = np.flatnonzero(isFirst)
+        self.times.append(times[starts])
+        self.counts.append(np.diff(np.append(starts, len(times))))
+        self.writeNeurons(f, rows)
+
+    #fixed bins: the window starts at the first spike if not given - the first one streamed
+    def addBinnedSpikes(self, f, rows, times):
+        if len(times) == 0:
+            return
+        if self.timeStart is None:
+            self.timeStart = float(times[0])
+        self.lastTime = float(times[-1])
+        frames = np.floor((times - self.timeStart) / self.binWidth + frame_index.BIN_EPSILON).astype(np.int64)
+        inside = frames >= 0
+        if self.timeEnd is not None:
+            inside &= frames < frame_index.GetBinnedFrameCount(self.binWidth, self.timeStart, self.timeEnd)
+        if not np.any(inside):
+            return
+        frames = frames[inside]
+        self.firstFrames.append(frames[0])
+        self.counts.append(np.bincount(frames - frames[0]))
+        self.writeNeurons(f, rows[inside])
+
+    def Write(self, spikeChunks):
+        with open(self.neuronsFile, 'wb') as f:
+            for rows, times in spikeChunks:
+                if self.binWidth > 0:
+                    self.addBinnedSpikes(f, rows, times)
+                else:
+                    self.addSpikes(f, rows, times)
+
+    #returns frame times & offsets, the same as frame_index.FromSpikes / FromBinnedSpikes
+    def GetFrames(self):
+        if self.binWidth <= 0:
+            times = np.concatenate(self.times) if self.times else np.zeros(0, dtype=np.float64)
+            counts = np.concatenate(self.counts) if self.counts else np.zeros(0, dtype=np.int64)
+            return times, np.append(0, np.cumsum(counts)).astype(np.int64)
+
+        timeStart = self.timeStart if self.timeStart is not None else 0.0
+        timeEnd = self.timeEnd
+        if timeEnd is None:
+            timeEnd = self.lastTime if self.lastTime is not None else timeStart
+        totalFrames = frame_index.GetBinnedFrameCount(self.binWidth, timeStart, timeEnd)
+        counts = np.zeros(max(totalFrames, 0), dtype=np.int64)
+        for first, chunkCounts in zip(self.firstFrames, self.counts):
+            counts[first:first + len(chunkCounts)] += chunkCounts
+        times = timeStart + np.arange(totalFrames) * self.binWidth
+        return times, np.append(0, np.cumsum(counts)).astype(np.int64)
+
+#==============================================================================
+
+#copies the raw int32 file into an .npy in blocks, removes the raw file
+def rawToNpy(rawFile, npyFile, count, blockSize=1 << 24):
+    neurons = np.lib.format.open_memmap(npyFile, mode='w+', dtype=np.int32, shape=(count,))
+    with open(rawFile, 'rb') as f:
+        for start in range(0, count, blockSize):
+            end = min(start + blockSize, count)
+            f.readinto(memoryview(neurons[start:end]).cast('B'))
+    neurons.flush()
+    del neurons
+    remove(rawFile)
+
+
+#builds the frame index streaming the spike files of store (a neuron cache without spikes),
+#writes <outputDir>/frame_neurons.npy, returns FrameIndex with the neurons memory-mapped
+def WriteFrameIndex(store, sources, cfg, outputDir):
+    rawFile = path.join(outputDir, 'frame_neurons.raw')
+    npyFile = path.join(outputDir, 'frame_neurons.npy')
+    writer = frameIndexWriter(rawFile, cfg.FRAME_BIN_WIDTH, cfg.FRAME_TIME_START, cfg.FRAME_TIME_END)
+    writer.Write(MergeSpikeStreams(store, sources, cfg.SPIKE_STREAM_CHUNK))
+    times, offsets = writer.GetFrames()
+    rawToNpy(rawFile, npyFile, writer.spikes)
+    return frame_index.FrameIndex(times, offsets, np.load(npyFile, mmap_mode='r'))
+
+#==============================================================================
+
+#reads spikes start..end-1 of an int32 .npy into a new array - file reads release the GIL, fine in a thread
+def readNeurons(neuronsFile, dataOffset, start, end):
+    neurons = np.empty(end - start, dtype=np.int32)
+    with open(neuronsFile, 'rb') as f:
+        f.seek(dataOffset + start * neurons.itemsize)
+        f.readinto(memoryview(neurons).cast('B'))
+    return neurons
+
+
+class neuronWindow():
+    def __init__(self, neuronsFile, dataOffset, start, end, inThread):
+        self.start = start
+        self.end = end
+        self.neurons = None
+        self.thread = None
+        if inThread:
+            self.thread = threading.Thread(target=self.read, args=(neuronsFile, dataOffset))
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.read(neuronsFile, dataOffset)
+
+    def read(self, neuronsFile, dataOffset):
+        self.neurons = readNeurons(neuronsFile, dataOffset, self.start, self.end)
+
+    def Covers(self, start, end):
+        return self.start <= start and end <= self.end
+
+    def Wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self
+
+
+#same interface as frame_index.FrameIndex over a memory-mapped one (Prepared), its neurons held in windows of
+#windowSpikes spikes: the window covering the spikes asked for + the next one read ahead, everything else dropped
+class WindowedFrameIndex():
+    def __init__(self, frameIndex, windowSpikes):
+        self.times = np.array(frameIndex.times)
+        self.offsets = np.array(frameIndex.offsets)
+        self.neuronsFile = frameIndex.neurons.filename
+        self.dataOffset = frameIndex.neurons.offset
+        self.spikes = len(frameIndex.neurons)
+        self.windowSpikes = int(windowSpikes)
+        self.window = None
+        self.prefetch = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return 'WindowedFrameIndex ' + str(len(self.times)) + ' frames, ' + str(self.spikes) + ' spikes, window ' + str(self.windowSpikes)
+
+    #window from start on, at least windowSpikes long (longer if end is further)
+    def windowRange(self, start, end):
+        return start, min(max(end, start + self.windowSpikes), self.spikes)
+
+    def moveTo(self, start, end):
+        if self.prefetch is not None and self.prefetch.Covers(start, end):
+            self.window = self.prefetch.Wait()
+        else:
+            if self.prefetch is not None:
+                self.prefetch.Wait()
+            (self.window, self.prefetch) = (None, None)     #drop both before reading - 2 windows at most
+            (wStart, wEnd) = self.windowRange(start, end)
+            self.window = neuronWindow(self.neuronsFile, self.dataOffset, wStart, wEnd, False)
+        self.prefetch = None
+        if self.window.end < self.spikes:
+            (pStart, pEnd) = self.windowRange(self.window.end, self.window.end)
+            self.prefetch = neuronWindow(self.neuronsFile, self.dataOffset, pStart, pEnd, True)
+
+    #returns rows of the spikes start..end-1 (a view, do not modify)
+    def GetNeurons(self, start, end):
+        (start, end) = (int(start), int(end))
+        if start >= end:
+            return np.zeros(0, dtype=np.int32)
+        if self.window is None or not self.window.Covers(start, end):
+            self.moveTo(start, end)
+        return self.window.neurons[start - self.window.start:end - self.window.start]
+
+    def GetSpiking(self, nFrame):
+        return self.GetNeurons(self.offsets[nFrame], self.offsets[nFrame + 1])
+
+    def GetSpikingMask(self, nFrame, mask):
+        mask[:] = False
+        mask[self.GetSpiking(nFrame)] = True
+        return mask
+
+    def GetSpikeCounts(self):
+        return np.diff(self.offsets)
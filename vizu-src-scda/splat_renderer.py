@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#Headless NumPy render backend: neurons are splatted as emissive points, no blender needed
+#--------------------------------------------------------------------------
+#
+# Same input as the blender backend (positions + per-frame FrameBuffers: rgba & size of every neuron),
+# same output files (render-frames/render_####.png), for previews & big batches on CPU-only nodes.
+#
+# - positions are projected once through a camera like 'Camera' of start-particles.blend (ORTHO or PERSP)
+# - a neuron is the 'neuron-render' cube scaled by its particle size: half edge = objectRadius * size
+# - it adds color * alpha * emission on the pixels it covers (additive, like the emission shader),
+#   points smaller than a pixel add the same energy spread over the 4 nearest pixels
+# - the sum is clipped and sRGB encoded (blender 'Default' view transform), sky is black & opaque
+
+import zlib
+import struct
+from os import path, makedirs
+
+import numpy as np
+
+
+#==============================================================================
+
+#returns 3x3 rotation matrix of blender euler XYZ angles (radians)
+def EulerToMatrix(rotation):
+    (x, y, z) = rotation
+    cx, sx = np.cos(x), np.sin(x)
+    cy, sy = np.cos(y), np.sin(y)
+    cz, sz = np.cos(z), np.sin(z)
+    rotX = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rotY = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rotZ = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return rotZ.dot(rotY).dot(rotX)
+
+
+class Camera():
+    def __init__(self, location, rotation, cameraType='ORTHO', orthoScale=7.0, lens=35.0, sensorWidth=32.0, clipStart=0.1, clipEnd=100.0):
+        self.location = np.asarray(location, dtype=np.float64)
+        self.rotation = EulerToMatrix(rotation)
+        self.cameraType = cameraType
+        self.orthoScale = orthoScale
+        self.lens = lens
+        self.sensorWidth = sensorWidth
+        self.clipStart = clipStart
+        self.clipEnd = clipEnd
+
+    #returns pixel x, y (y down), pixels per world unit at the point, visible mask
+    def Project(self, positions, width, height):
+        local = (np.asarray(positions, dtype=np.float64) - self.location).dot(self.rotation)    # = R^T (p - loc)
+        depth = -local[:, 2]                                                                   # camera looks along -z
+        fit = max(width, height)                                                               # sensor fit 'AUTO'
+        if self.cameraType == 'ORTHO':
+            scale = np.full(len(local), fit / self.orthoScale)
+        else:
+            scale = (self.lens / self.sensorWidth) * fit / np.maximum(depth, 1e-9)
+        x = width * 0.5 + local[:, 0] * scale
+        y = height * 0.5 - local[:, 1] * scale
+        visible = (depth > self.clipStart) & (depth < self.clipEnd)
+        return x, y, scale, visible
+
+#==============================================================================
+
+#writes 8 bit RGBA image (height, width, 4) as png - zlib only, no imaging library needed
+def WritePNG(filePath, rgba, level=3):
+    height, width = rgba.shape[0], rgba.shape[1]
+    raw = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 0] = 0                                           # filter: none
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(filePath, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b'IEND', b''))
+
+
+def LinearToSRGB(linear):
+    linear = np.clip(linear, 0.0, 1.0)
+    return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(linear, 1.0 / 2.4) - 0.055)
+
+#==============================================================================
+
+class SplatRenderer():
+    def __init__(self, camera, resolution, resolutionScale, emission, objectRadius):
+        self.camera = camera
+        self.width = int(resolution[0] * resolutionScale / 100)
+        self.height = int(resolution[1] * resolutionScale / 100)
+        self.emission = emission
+        self.objectRadius = objectRadius
+        self.frameBuffers = None
+
+    #projects the neurons once - positions never change (except LOD spike slots, see UpdateFrame)
+    def CreateNeurons(self, positions, size, emission):
+        self.emission = emission
+        x, y, scale, visible = self.camera.Project(positions, self.width, self.height)
+        self.x = x.astype(np.float32)
+        self.y = y.astype(np.float32)
+        self.scale = (scale * self.objectRadius).astype(np.float32)   # half edge in pixels = scale * size
+        self.visible = visible
+        self.rows = np.flatnonzero(visible)
+
+    def UpdateFrame(self, nFrame, frameBuffers):
+        self.frameBuffers = frameBuffers
+        frameBuffers.Consume()                          # read straight from the buffers - no upload clears the dirty rows
+        if frameBuffers.locations is not None:         # LOD: only the spike slots move
+            slots = slice(frameBuffers.first, len(frameBuffers))
+            x, y, scale, visible = self.camera.Project(frameBuffers.locations[slots], self.width, self.height)
+            self.x[slots] = x
+            self.y[slots] = y
+            self.scale[slots] = scale * self.objectRadius
+            self.visible[slots] = visible
+            self.rows = np.flatnonzero(self.visible)
+
+    #adds weights (n,3) on pixels (ix, iy), pixels outside of the image are dropped
+    def deposit(self, image, ix, iy, weights):
+        inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+        index = iy[inside] * self.width + ix[inside]
+        weights = weights[inside]
+        for c in range(3):
+            image[:, c] += np.bincount(index, weights=weights[:, c], minlength=self.width * self.height)
+
+    #returns 8 bit RGBA frame (height, width, 4) of the current frame buffers
+    def RenderFrame(self):
+        pixels = self.frameBuffers.pixels[self.rows]
+        radiance = pixels[:, 0:3] * (pixels[:, 3:4] * self.emission)
+        x = self.x[self.rows]
+        y = self.y[self.rows]
+        halfEdge = self.scale[self.rows] * self.frameBuffers.sizes[self.rows]
+        image = np.zeros((self.width * self.height, 3), dtype=np.float64)
+
+        #points smaller than a pixel: energy = radiance * area, bilinear over the 4 nearest pixels
+        small = halfEdge < 1.0
+        if np.any(small):
+            sx = x[small] - 0.5
+            sy = y[small] - 0.5
+            x0 = np.floor(sx).astype(np.int64)
+            y0 = np.floor(sy).astype(np.int64)
+            fx = (sx - x0)[:, None]
+            fy = (sy - y0)[:, None]
+            energy = radiance[small] * ((2.0 * halfEdge[small]) ** 2)[:, None]
+            ix = np.concatenate((x0, x0 + 1, x0, x0 + 1))
+            iy = np.concatenate((y0, y0, y0 + 1, y0 + 1))
+            weights = np.concatenate((energy * (1 - fx) * (1 - fy), energy * fx * (1 - fy),
+                                      energy * (1 - fx) * fy, energy * fx * fy))
+            self.deposit(image, ix, iy, weights)
+
+        #bigger points: radiance on every pixel of the projected square, grouped by size in pixels
+        big = np.flatnonzero(~small)
+        if len(big):
+            extent = np.ceil(halfEdge[big]).astype(np.int64)
+            ixs, iys, weights = [], [], []
+            for k in np.unique(extent):
+                sel = big[extent == k]
+                cx = np.floor(x[sel]).astype(np.int64)
+                cy = np.floor(y[sel]).astype(np.int64)
+                for dy in range(-k, k + 1):
+                    for dx in range(-k, k + 1):
+                        inside = np.maximum(abs(dx), abs(dy)) <= halfEdge[sel]
+                        ixs.append(cx[inside] + dx)
+                        iys.append(cy[inside] + dy)
+                        weights.append(radiance[sel[inside]])
+            self.deposit(image, np.concatenate(ixs), np.concatenate(iys), np.concatenate(weights))
+
+        rgba = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        rgba[:, :, 0:3] = (LinearToSRGB(image) * 255 + 0.5).astype(np.uint8).reshape(self.height, self.width, 3)
+        rgba[:, :, 3] = 255
+        return rgba
+
+    def Render(self, outputFile):
+        outputDir = path.dirname(outputFile)
+        if outputDir and not path.isdir(outputDir):
+            try:
+                makedirs(outputDir)
+            except OSError:
+                pass
+        WritePNG(outputFile, self.RenderFrame())
+
+    #frame dependent state besides the neurons (frame_dedup.py) - the camera never moves
+    def GetFrameStateKey(self, nFrame):
+        return ''
+
+    def SaveDebug(self, outputDir, blendFile):
+        pass    #nothing to save - there is no scene
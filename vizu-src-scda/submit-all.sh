@@ -0,0 +1,16 @@
+#!/bin/bash
+
+#submit-all.sh ../1M_test ../out_1M_test [--resume] [--groups=TH_M1,M1 --box=... (selection.py)]
+#prepare job first, the render array starts when it finished successfully
+#the prepare job schedules the frames of the nTasks array tasks (scheduler.py), each task renders its frames of the manifest
+
+nTasks=20
+
+jobPrepare=$(sbatch --parsable prepare-job.slurm $1 $2 $nTasks ${@:3})
+jobRender=$(sbatch --parsable --dependency=afterok:$jobPrepare --array=1-$nTasks submit-job-array-v2.slurm $1 $2 --manifest ${@:3})
+
+#OUTPUT_MODE = "segments": the movie segments of the tasks are joined when the whole array finished
+outputMode=$(python3 -c "import config; print(config.OUTPUT_MODE)")
+if [ "$outputMode" == "segments" ]; then
+    sbatch --dependency=afterok:$jobRender concat-job.slurm $2
+fi
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#Synthetic neuron data in the layout of the real data - to test & benchmark any size
+#--------------------------------------------------------------------------
+#
+#   python3 synthetic_data.py ../synthetic-1M 1000000                  (1M neurons, defaults below)
+#   python3 synthetic_data.py ../synthetic-1M 1000000 40 5.0 2500      (40 types, 5 Hz, 2500 ms)
+#
+# writes <dir>/<GROUP>/<type>.txt           "id x y z E|I" per neuron
+#        <dir>/<GROUP>/spikes/<type>_spikes.txt   "id time" per spike
+# - types are spread over groups, neurons over types evenly; every group is a box next to the previous one
+# - spikes are poisson: rate (Hz) per neuron over duration (ms), times on a grid of dt (like the simulator output)
+# - files are written in chunks, memory stays bounded for 100M neurons
+
+import sys
+from os import path, makedirs
+
+import numpy as np
+
+
+GROUPS = 4
+TYPES = 16
+RATE = 2.0              #Hz per neuron
+DURATION = 2500.0       #ms
+DT = 0.1                #ms, time grid of the spikes
+INHIBITORY = 0.2        #fraction of 'I' neurons
+FIRST_ID = 1
+CHUNK = 1000000         #rows per write
+
+#==============================================================================
+
+def writeNeurons(filePath, ids, positions, states):
+    with open(filePath, 'w') as f:
+        for start in range(0, len(ids), CHUNK):
+            end = start + CHUNK
+            columns = np.empty((len(ids[start:end]), 4), dtype=np.float64)
+            columns[:, 0] = ids[start:end]
+            columns[:, 1:4] = positions[start:end]
+            lines = ['%.1f %.6f %.6f %.6f %s' % (c[0], c[1], c[2], c[3], s) for c, s in zip(columns.tolist(), states[start:end])]
+            f.write('\n'.join(lines) + '\n')
+
+
+def writeSpikes(filePath, spikeIDs, spikeTimes):
+    with open(filePath, 'w') as f:
+        for start in range(0, len(spikeIDs), CHUNK):
+            end = start + CHUNK
+            np.savetxt(f, np.column_stack((spikeIDs[start:end], spikeTimes[start:end])), fmt='%.1f %.4f')
+
+#==============================================================================
+
+#returns [(group, [types])]: types spread over groups evenly
+def GroupNames(groupCount, typeCount):
+    groups = []
+    for g in range(groupCount):
+        groupName = 'G' + str(g + 1)
+        groups.append((groupName, []))
+    for t in range(typeCount):
+        groupName, types = groups[t % groupCount]
+        types.append(groupName + '_T' + str(len(types) + 1))
+    return [(groupName, types) for groupName, types in groups if len(types)]
+
+
+#writes the dataset, returns number of neurons & spikes
+def GenerateDataset(dataPath, neuronCount, typeCount=TYPES, rate=RATE, duration=DURATION, groupCount=GROUPS, dt=DT, seed=0):
+    random = np.random.RandomState(seed)
+    groups = GroupNames(min(groupCount, typeCount), typeCount)
+    typeSizes = np.full(typeCount, neuronCount // typeCount, dtype=np.int64)
+    typeSizes[:neuronCount % typeCount] += 1
+    steps = int(round(duration / dt))
+
+    nextID = FIRST_ID
+    code = 0
+    totalSpikes = 0
+    for g, (groupName, types) in enumerate(groups):
+        spikesDir = path.join(dataPath, groupName, 'spikes')
+        if not path.isdir(spikesDir):
+            makedirs(spikesDir)
+        groupDepth = max(len(types), 1)
+        for t, typeName in enumerate(types):
+            count = int(typeSizes[code])
+            ids = np.arange(nextID, nextID + count, dtype=np.int64)
+            positions = random.uniform(0.0, 1.0, (count, 3))
+            positions[:, 0] += g * 1.5                                  # groups side by side
+            positions[:, 2] = (t + positions[:, 2]) / groupDepth        # types as layers of the group
+            states = np.where(random.uniform(size=count) < INHIBITORY, 'I', 'E')
+            writeNeurons(path.join(dataPath, groupName, typeName + '.txt'), ids, positions, states)
+
+            spikeCount = random.poisson(count * rate * duration / 1000.0)
+            spikeIDs = ids[random.randint(0, count, spikeCount)] if count else np.zeros(0, dtype=np.int64)
+            spikeTimes = random.randint(0, steps + 1, spikeCount) * dt
+            order = np.argsort(spikeTimes, kind='mergesort')
+            writeSpikes(path.join(spikesDir, typeName + '_spikes.txt'), spikeIDs[order], spikeTimes[order])
+
+            nextID += count
+            code += 1
+            totalSpikes += spikeCount
+    return neuronCount, totalSpikes
+
+#==============================================================================
+
+if __name__ == '__main__':
+    dataPath = sys.argv[1]
+    neuronCount = int(sys.argv[2])
+    typeCount = int(sys.argv[3]) if len(sys.argv) > 3 else TYPES
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else RATE
+    duration = float(sys.argv[5]) if len(sys.argv) > 5 else DURATION
+    (neurons, spikes) = GenerateDataset(dataPath, neuronCount, typeCount, rate, duration)
+    print(dataPath, neurons, 'neurons', spikes, 'spikes')
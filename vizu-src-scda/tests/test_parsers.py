@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#Regression tests of the text parsers against the text reader they replace (readNeuronData / readSpikeData)
+#--------------------------------------------------------------------------
+#
+#   python3 -m unittest discover tests        (in visu-src, or python3 -m pytest tests)
+#
+# the old reader matched spikes to neurons by str(float(id)): a line without exactly two fields was skipped,
+# a spike id that is not a whole number matched no neuron. The cache (neuron_cache) and the stream (spike_stream)
+# have to give the same spikes - fractional ids, malformed lines, odd token counts, any chunk size.
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.realpath(__file__))))
+
+import neuron_cache
+import spike_stream
+
+
+NEURONS = ('1.0 0.5 0.5 0.5 E\n'
+           '2.0 0.1 0.2 0.3 I\n'
+           '3.0 1.0 1.0 1.0 E\n'
+           '1588.0 2.0 2.0 2.0 I\n')
+
+SPIKES = ('1.0 0.5\n'
+          '1588.1 0.6\n'        # fractional id - no neuron, not neuron 1588
+          '2.0 0.7 9.9\n'       # three fields
+          '\n'
+          '3.0\n'               # one field - odd token count, must not shift the pairs after it
+          '1588.0 0.8\n'
+          '4.0 0.9\n'           # unknown neuron
+          '2.0 1.0\n'
+          '3.0 1.1\n')
+
+
+#the old text reader: {str(float(id)): [times]}
+def baselineSpikes(filePath):
+    spikes = {}
+    with open(filePath, 'r') as f:
+        for line in f.readlines():
+            data = line.split(' ')
+            if len(data) != 2:
+                continue
+            spikes.setdefault(str(float(data[0])), []).append(float(data[1]))
+    return spikes
+
+
+#the old matching: (row of the neuron, time) of every spike, in neuron order
+def baselineRows(ids, filePath):
+    spikes = baselineSpikes(filePath)
+    return sorted((row, t) for row, nID in enumerate(ids) for t in spikes.get(str(float(nID)), []))
+
+
+class ParserTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.neuronsFile = self.write('neurons.txt', NEURONS)
+        self.spikesFile = self.write('spikes.txt', SPIKES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def write(self, name, text):
+        filePath = path.join(self.tmpDir, name)
+        with open(filePath, 'w') as f:
+            f.write(text)
+        return filePath
+
+    def testSpikeLines(self):
+        (ids, times) = neuron_cache.ParseSpikeLines(SPIKES.splitlines(True))
+        self.assertEqual(ids.tolist(), [1, 1588, 4, 2, 3])
+        self.assertEqual(times.tolist(), [0.5, 0.8, 0.9, 1.0, 1.1])
+        self.assertEqual(ids.dtype, np.int32)
+
+    def testWellFormedLines(self):
+        (ids, times) = neuron_cache.ParseSpikeLines(['5.0 1.5\n', '6.0 2.5\n'])
+        self.assertEqual(ids.tolist(), [5, 6])
+        self.assertEqual(times.tolist(), [1.5, 2.5])
+        (ids, times) = neuron_cache.ParseSpikeLines([])
+        self.assertEqual((len(ids), len(times)), (0, 0))
+
+    def testSpikeFileMatchesBaseline(self):
+        (ids, positions, states) = neuron_cache.parseNeuronFile(self.neuronsFile)
+        expected = baselineRows(ids, self.spikesFile)
+        for chunkLines in (1, 2, 3, neuron_cache.PARSE_CHUNK_LINES):
+            (rows, times) = neuron_cache.parseSpikeFile(self.spikesFile, ids, chunkLines)
+            self.assertEqual(sorted(zip(rows.tolist(), times.tolist())), expected, chunkLines)
+        self.assertNotIn((3, 0.6), expected)       # 1588.1 is not neuron 1588
+
+    def testMissingSpikeFile(self):
+        (rows, times) = neuron_cache.parseSpikeFile(None, np.arange(3, dtype=np.int32))
+        self.assertEqual((len(rows), len(times)), (0, 0))
+
+    def testStreamMatchesCache(self):
+        sortedFile = self.write('sorted.txt', SPIKES)
+        for chunkLines in (1, 2, 100):
+            chunks = list(spike_stream.ReadSpikeChunks(sortedFile, chunkLines))
+            streamed = (np.concatenate([c[0] for c in chunks]).tolist(), np.concatenate([c[1] for c in chunks]).tolist())
+            cached = neuron_cache.ParseSpikeLines(SPIKES.splitlines(True))
+            self.assertEqual(streamed, (cached[0].tolist(), cached[1].tolist()), chunkLines)
+
+    def testStreamUnsorted(self):
+        unsortedFile = self.write('unsorted.txt', '1.0 2.0\n2.0 1.0\n')
+        with self.assertRaises(ValueError):
+            list(spike_stream.ReadSpikeChunks(unsortedFile, 100))
+
+    def testNeuronFile(self):
+        (ids, positions, states) = neuron_cache.parseNeuronFile(self.neuronsFile)
+        self.assertEqual(ids.tolist(), [1, 2, 3, 1588])
+        self.assertEqual(states.tolist(), [0, 1, 0, 1])
+        self.assertEqual(positions.shape, (4, 3))
+
+    def testFractionalNeuronID(self):
+        neuronsFile = self.write('fractional.txt', '1.0 0 0 0 E\n2.5 0 0 0 I\n')
+        with self.assertRaises(ValueError):
+            neuron_cache.parseNeuronFile(neuronsFile)
+
+
+if __name__ == '__main__':
+    unittest.main()
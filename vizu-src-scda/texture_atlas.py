@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#2D atlas layout of the per-neuron color texture
+#--------------------------------------------------------------------------
+#
+# neuron (particle index) i is pixel x = i % width, y = i // width of a width x height texture,
+# width & height are powers of two (square, or twice as wide as high) - no texture size limit is hit by one
+# long row, and the lookup in the material is exact: index % width, (index - column) / width are
+# exact in float32 for a power of two width (indices < 2^24), the texel centers are sampled with 'Closest'.
+#
+# the texture is split into tiles of tileRows texture rows - flat pixels [tile*width*tileRows, (tile+1)*width*tileRows).
+# a frame uploads only the runs of tiles holding dirty rows (FrameBuffers delta mode): a slice write converts
+# only those pixels from python, the conversion is the cost of a pixel upload (blender 2.79 has no foreach_set).
+
+import numpy as np
+
+
+MAX_TILE_RANGES = 8     #more runs of dirty tiles than this: the whole texture is written in one go
+
+#==============================================================================
+
+def nextPowerOfTwo(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+class AtlasLayout():
+    def __init__(self, count, tileRows):
+        self.count = count
+        self.width = nextPowerOfTwo(int(np.ceil(np.sqrt(max(count, 1)))))
+        self.height = nextPowerOfTwo(int(np.ceil(max(count, 1) / float(self.width))))
+        self.tileRows = max(int(tileRows), 1)
+        self.tilePixels = self.width * self.tileRows
+        self.tiles = int(np.ceil(max(count, 1) / float(self.tilePixels)))
+
+    def __repr__(self):
+        return 'AtlasLayout ' + str(self.width) + 'x' + str(self.height) + ', ' + str(self.tiles) + ' tiles of ' + str(self.tileRows) + ' rows'
+
+    #returns pixel ranges [(start, end)] of the runs of tiles holding rows, None: too many runs - write everything
+    def GetTileRanges(self, rows, maxRanges=MAX_TILE_RANGES):
+        tiles = np.unique(np.asarray(rows) // self.tilePixels)
+        if len(tiles) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(tiles) > 1)
+        if len(breaks) + 1 > maxRanges:
+            return None
+        firsts = tiles[np.append(0, breaks + 1)]
+        lasts = tiles[np.append(breaks, len(tiles) - 1)]
+        return [(int(first) * self.tilePixels, min((int(last) + 1) * self.tilePixels, self.count))
+                for first, last in zip(firsts, lasts)]